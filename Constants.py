@@ -1,6 +1,13 @@
 class TelnetConstants:
     TELNET_END_STRING = b"$"
     TELNET_CONNECTION_TIMEOUT = 7
+    TELNET_COMMAND_DEADLINE = 15  # seconds a command may wait for and take its turn
+    TELNET_COMMAND_HISTORY = 100  # the queue wait times kept for the statistics
+    # command priorities of the CommandScheduler, the lowest goes first
+    PRIORITY_ABORT = 0
+    PRIORITY_HIGH = 1
+    PRIORITY_NORMAL = 2
+    PRIORITY_LOW = 3
 
 
 class LV5600Constants:
@@ -11,6 +18,53 @@ class LV5600Constants:
 class FTPConstants:
     FTP_FILE_NAME_BMP = "cap_bmp.bmp"
     LOCAL_FILE_NAME_BMP = "snapshot.bmp"
+    FTP_HEALTH_CHECK_IDLE_TIME = 30  # seconds
+    FTP_BLOCK_SIZE = 65536
+    FTP_TIMEOUT = 10  # seconds
+    FTP_TRANSFER_HISTORY = 100
+    BMP_FILE_SIZE = 54 + 1920 * 1080 * 3  # 24-bit full screen capture
+
+
+class AnalysisConstants:
+    WORKERS = 2  # analysis worker processes, 0 to analyze in a thread of the GUI process
+    HISTORY = 100  # the queue and compute times kept for the statistics
+    CACHE_ENTRIES = 256  # analysis results kept by the AnalysisCache
+    CACHE_BYTES = 1 << 20  # the size the cached analysis results may take
+    CACHE_HASH = "sha1"  # hashlib algorithm of the frame keys, hardware accelerated on most CPUs
+
+
+class PipelineConstants:
+    QUEUE_SIZE = 1  # frames waiting between two capture pipeline stages
+    STOP_LOOKAHEAD = 1  # frames triggered ahead of the analysis when a run can stop early
+
+
+class LightSearchConstants:
+    MIN_LIGHT_LEVEL = 0
+    MAX_LIGHT_LEVEL = 256
+    SETTLE_TIME = 0.2  # seconds to wait after a light level change
+    MAX_AVERAGE_COUNT = 3  # most captures averaged per probe
+    CONFIDENCE_Z = 1.5  # half width of the mV confidence interval in standard errors
+    MV_NOISE_PRIOR = 2.0  # assumed capture to capture mV standard deviation
+    MV_NOISE_PRIOR_WEIGHT = 2  # degrees of freedom the assumed deviation counts as
+    CALIBRATION_MAX_AGE = 8 * 3600  # seconds a stored light response stays valid
+    CALIBRATION_MAX_POINTS = 32  # measurements stored per light response
+    CALIBRATION_DRIFT_TOLERANCE = 0.05  # relative mV deviation from a stored response that counts as drift
+    CALIBRATION_BRACKET = 4  # light levels the first warm start step spans
+    CALIBRATION_FILE_NAME = "light_calibration.json"
+    QUERY_INTERVAL = 0.02  # seconds between two level queries, about one frame
+    SETTLE_INTERVAL = 0.05  # seconds between two settle detection samples
+    SETTLE_TOLERANCE_MV = 4.0  # mV two successive settle samples may differ by, about twice the capture noise
+    SETTLE_RELATIVE_TOLERANCE = 0.01  # the same, relative to the level, for high levels
+    SETTLE_MAX_WAIT = 1.0  # most seconds to wait for the waveform to settle
+    SETTLE_MIN_WAIT = 0.1  # seconds before the first settle sample, the light source dead time
+
+
+class DebugConsoleConstants:
+    LIGHT_LIST_OFFSET = 5  # light setting list entries above light level 0
+    KEY_PRESS_TIME = 0.015  # estimated seconds per key press
+    CLICK_TIME = 0.05  # estimated seconds per mouse click
+    ACTIVATE_TIME = 0.02  # estimated seconds per window activation
+    INITIAL_SETTING_WAIT = 1.5  # seconds the delivery of the initial settings takes at most
 
 
 class CalculationConstants:
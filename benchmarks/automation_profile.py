@@ -0,0 +1,331 @@
+"""
+Headless end-to-end profile of the Set Saturation and Set Noise automation. Unlike the convergence benchmark, nothing is modelled: the light level searches run on the GUI code path (TelnetController, AsyncFTPSession, CapturePipeline and the NumPy analysis engine) against an in-process LV5600Simulator, whose waveform follows a SimulatedLightSource with settle time, hysteresis and flicker. Every run reports its wall time, captures, Telnet commands (and the redundant writes skipped) and light level changes, and the pipeline stage latencies are summarized, so complete runs can be timed in CI.
+
+Usage:
+    python -m benchmarks.automation_profile
+    python -m benchmarks.automation_profile --search model --rtt 0.005 --bandwidth 12e6
+    python -m benchmarks.automation_profile --settle-detect
+    python -m benchmarks.automation_profile --analysis-cache
+    python -m benchmarks.automation_profile --cprofile 20
+"""
+import argparse
+import asyncio
+import cProfile
+import logging
+import pstats
+import sys
+from functools import partial
+import time
+
+import numpy as np
+
+from Constants import CalculationConstants, LightSearchConstants, TelnetConstants
+from benchmarks.convergence_benchmark import (
+    CALIBRATION_KEY,
+    FLAT_PIXEL_COUNT,
+    FLAT_SD_THRESHOLD,
+    SAT_CAPTURE_LIGHT_LEVEL,
+    TARGET_TOLERANCE,
+    TARGETS_MV,
+)
+from controllers.analysis_cache import AnalysisCache
+from controllers.analysis_executor import create_analysis_executor
+from controllers.async_ftp_controller import AsyncFTPController
+from controllers.ftp_session_controller import AsyncFTPSession
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from controllers.telnet_controller import TelnetController
+from controllers.waveform_image_analysis_controller import summarize_analyses
+from simulator.light_source import LightSourceConfig, SimulatedLightSource
+from simulator.lv5600_simulator import LV5600Simulator, SimulatorConfig
+from tasks.calibration_tasks import LightCalibrationCache
+from tasks.connection_tasks import ConnectionTask
+from tasks.light_search_tasks import (
+    STRATEGIES,
+    DebugConsoleActuator,
+    LevelMeasurement,
+    LightLevelSearch,
+    MeasurementBackend,
+    QueryMeasurement,
+    SettleDetector,
+)
+from tasks.lv5600_tasks import CapturePipeline, LV5600Tasks
+
+
+class PipelineMeasurement(MeasurementBackend):
+    """
+    Measures like MainWindow.compute_average_mv_sd, without the display, and
+    collects the stage latencies of every capture pipeline run.
+    """
+
+    def __init__(self, telnet_client, ftp_session, engine, analysis_executor=None, analysis_cache=None):
+        self.telnet_client = telnet_client
+        self.ftp_session = ftp_session
+        self.engine = engine
+        self.analysis_executor = analysis_executor
+        self.analysis_cache = analysis_cache
+        self.latencies = {stage: [] for stage in CapturePipeline.STAGES}
+
+    async def measure(self, mode, num_sample, stop=None):
+        stacked = stop is None and not self.engine.requires_file
+        if stacked:
+
+            def analyze(frame):
+                return np.array(frame)
+
+        elif self.analysis_executor is not None:
+
+            async def analyze(frame):
+                return await self.analysis_executor.analyze(frame, mode, FLAT_PIXEL_COUNT)
+
+        else:
+
+            def analyze(frame):
+                return self.engine.analyze_frame(frame, mode, FLAT_PIXEL_COUNT)
+
+        await LV5600Tasks.scale_and_cursor(self.telnet_client, False)
+        pipeline = CapturePipeline(
+            self.telnet_client,
+            self.ftp_session,
+            analyze,
+            cache=None if stacked else self.analysis_cache,
+            cache_context=(mode, FLAT_PIXEL_COUNT),
+        )
+        try:
+            results = await pipeline.run(num_sample, stop)
+        finally:
+            await LV5600Tasks.scale_and_cursor(self.telnet_client, True)
+        for stage, latencies in pipeline.latencies.items():
+            self.latencies[stage].extend(latencies)
+        if stacked:
+            loop = asyncio.get_running_loop()
+            summary = await loop.run_in_executor(
+                None,
+                partial(self.engine.analyze_stack, np.stack(results), mode, FLAT_PIXEL_COUNT),
+            )
+        else:
+            summary = summarize_analyses(results)
+        return LevelMeasurement(summary.mv, summary.sd, samples=len(results))
+
+
+async def profile_searches(search_names, args):
+    """
+    Runs every search strategy on every target in one simulator session, the
+    way the GUI runs them one after another, and returns a result row per run
+    and the capture pipeline stage latencies.
+    """
+    light_source = SimulatedLightSource(
+        LightSourceConfig(
+            settle_time=args.light_settle,
+            dead_time=args.light_dead_time,
+            hysteresis=args.hysteresis,
+            seed=args.seed,
+        )
+    )
+    config = SimulatorConfig(
+        telnet_port=0,
+        ftp_port=0,
+        rtt=args.rtt,
+        bandwidth=args.bandwidth,
+        level_query=args.query,
+        seed=args.seed,
+    )
+    rows = []
+    async with LV5600Simulator(config, light_source) as simulator:
+        telnet_client = TelnetController(
+            config.host, config.telnet_port, config.username, config.password
+        )
+        await ConnectionTask.connect_to_telnet(telnet_client)
+        ftp_session = AsyncFTPSession(
+            AsyncFTPController(config.host, config.username, config.password, config.ftp_port)
+        )
+        engine = NumpyWaveformImageAnalysisController()
+        analysis_executor = create_analysis_executor(args.analysis_workers)
+        analysis_cache = AnalysisCache() if args.analysis_cache else None
+        capture_measurement = PipelineMeasurement(
+            telnet_client, ftp_session, engine, analysis_executor, analysis_cache
+        )
+        measurement = capture_measurement
+        if args.query:
+            measurement = QueryMeasurement(
+                lambda: LV5600Tasks.query_level(telnet_client), capture_measurement
+            )
+        settle = None
+        if args.settle_detect:
+            # settle samples like MainWindow: level queries if the search
+            # queries, quick single captures otherwise
+            settle_measurement = capture_measurement
+            if args.query:
+                settle_measurement = QueryMeasurement(
+                    lambda: LV5600Tasks.query_level(
+                        telnet_client, TelnetConstants.PRIORITY_LOW
+                    ),
+                    capture_measurement,
+                )
+            settle = SettleDetector(settle_measurement)
+        mode = CalculationConstants.NOISE_MODE
+        try:
+            for search_name in search_names:
+                # the stored light response is shared by the runs of a strategy
+                calibration = LightCalibrationCache(None)
+                for repeat in range(args.repeat):
+                    for target_mv in TARGETS_MV:
+                        light_search = LightLevelSearch(
+                            measurement,
+                            DebugConsoleActuator(light_source),
+                            engine,
+                            TARGET_TOLERANCE,
+                            FLAT_SD_THRESHOLD,
+                            strategy=STRATEGIES[search_name](),
+                            settle_time=args.settle,
+                            calibration=calibration,
+                            settle=settle,
+                        )
+                        stats_before = simulator.get_stats()
+                        suppressed_before = telnet_client.get_shadow_stats()["suppressed"]
+                        light_changes_before = light_source.stats["light_changes"]
+                        tic = time.perf_counter()
+                        target = target_mv
+                        settle_seconds = 0.0
+                        if target is None:
+                            # capture_sat_value
+                            light_source.set_light_level(SAT_CAPTURE_LIGHT_LEVEL)
+                            if settle is not None:
+                                settle_seconds = await settle.wait(mode)
+                            else:
+                                await asyncio.sleep(args.settle)
+                                settle_seconds = args.settle
+                            target = (await capture_measurement.measure(mode, 1)).mv
+                        result = await light_search.run(target, mode, CALIBRATION_KEY)
+                        seconds = time.perf_counter() - tic
+                        stats = simulator.get_stats()
+                        final_mv = simulator.model.level_mv(light_source.settled_output())
+                        rows.append(
+                            {
+                                "search": search_name,
+                                "target": "sat" if target_mv is None else f"{target_mv:g}",
+                                "repeat": repeat,
+                                "seconds": round(seconds, 3),
+                                "settle_s": round(settle_seconds + result.settle_seconds, 3),
+                                "captures": stats["captures"] - stats_before["captures"],
+                                "queries": stats["queries"] - stats_before["queries"],
+                                "commands": stats["commands"] - stats_before["commands"],
+                                "suppressed": telnet_client.get_shadow_stats()["suppressed"]
+                                - suppressed_before,
+                                "light_changes": light_source.stats["light_changes"]
+                                - light_changes_before,
+                                "light_level": result.light_level,
+                                "error_mv": round(final_mv - target, 2),
+                                "converged": abs(final_mv - target) <= TARGET_TOLERANCE * target,
+                            }
+                        )
+        finally:
+            await ftp_session.close()
+            await telnet_client.close()
+            if analysis_executor is not None:
+                print(f"Analysis executor statistics: {analysis_executor.get_stats()}")
+                analysis_executor.close()
+            if analysis_cache is not None:
+                print(f"Analysis cache statistics: {analysis_cache.get_stats()}")
+    return rows, capture_measurement.latencies
+
+
+def format_rows(rows, latencies):
+    columns = (
+        "search",
+        "target",
+        "repeat",
+        "seconds",
+        "settle_s",
+        "captures",
+        "queries",
+        "commands",
+        "suppressed",
+        "light_changes",
+        "light_level",
+        "error_mv",
+        "converged",
+    )
+    lines = ["".join(f"{column:>14}" for column in columns)]
+    for row in rows:
+        lines.append("".join(f"{str(row[column]):>14}" for column in columns))
+    total_seconds = sum(row["seconds"] for row in rows)
+    lines.append(
+        f"Total: {len(rows)} runs in {round(total_seconds, 2)} s, "
+        f"{round(sum(row['settle_s'] for row in rows), 2)} s settling, "
+        f"{sum(row['captures'] for row in rows)} captures, "
+        f"{sum(row['commands'] for row in rows)} Telnet commands "
+        f"({sum(row['suppressed'] for row in rows)} redundant writes skipped), "
+        f"{sum(row['converged'] for row in rows)} converged"
+    )
+    for stage, stage_latencies in latencies.items():
+        if stage_latencies:
+            lines.append(
+                f"{stage:<10}{len(stage_latencies):>6} frames"
+                f"{sum(stage_latencies) / len(stage_latencies) * 1000:>10.1f} ms mean"
+                f"{max(stage_latencies) * 1000:>10.1f} ms max"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end light level search profile")
+    parser.add_argument(
+        "--search", nargs="+", choices=sorted(STRATEGIES), default=sorted(STRATEGIES)
+    )
+    parser.add_argument("--repeat", type=int, default=2, help="runs per target, the later ones warm")
+    parser.add_argument("--query", action="store_true", help="sample with level queries")
+    parser.add_argument(
+        "--settle-detect",
+        action="store_true",
+        help="wait for the waveform to settle (single captures, level queries with --query) instead of sleeping --settle",
+    )
+    parser.add_argument(
+        "--analysis-workers", type=int, default=0,
+        help="analyze in this many worker processes, 0 for a thread as before",
+    )
+    parser.add_argument(
+        "--analysis-cache", action="store_true",
+        help="look the analysis results of identical frames up in an AnalysisCache",
+    )
+    parser.add_argument("--rtt", type=float, default=0.0, help="simulated network round trip in seconds")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="FTP bytes/s, 0 for unlimited")
+    parser.add_argument(
+        "--settle", type=float, default=LightSearchConstants.SETTLE_TIME,
+        help="seconds the search waits after a light level change",
+    )
+    parser.add_argument(
+        "--light-settle", type=float, default=LightSourceConfig.settle_time,
+        help="time constant of the simulated light output in seconds",
+    )
+    parser.add_argument(
+        "--light-dead-time", type=float, default=LightSourceConfig.dead_time,
+        help="seconds the simulated light output keeps its old level after a change",
+    )
+    parser.add_argument(
+        "--hysteresis", type=float, default=LightSourceConfig.hysteresis,
+        help="light levels the simulated light output lags behind",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--cprofile", type=int, metavar="N", help="profile the run and print the N most expensive calls"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    rows, latencies = asyncio.run(profile_searches(args.search, args))
+    if profiler is not None:
+        profiler.disable()
+    print(format_rows(rows, latencies))
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.cprofile)
+    # a profile, the convergence is reported but not enforced
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
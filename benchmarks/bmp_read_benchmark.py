@@ -0,0 +1,118 @@
+"""
+Benchmark of the ways an archived capture can be read for analysis: PIL decoding the whole BMP (what the NumPy engine did for file paths), reading the file and viewing the buffer with decode_bmp, and memory mapping the file with map_bmp. Every method slices the analysis ROI and thresholds it, so the pixels are really read, and the mean time per capture and the bytes copied are reported. Without capture files, captures rendered by the simulator are written to a temporary directory.
+
+Usage:
+    python -m benchmarks.bmp_read_benchmark
+    python -m benchmarks.bmp_read_benchmark snapshots/ --repeat 5
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from Constants import CalculationConstants
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from simulator.lv5600_simulator import SimulatorConfig, WaveformModel
+from utils.bmp_utils import decode_bmp, map_bmp
+
+
+def read_pil(file_path):
+    with Image.open(file_path) as img:
+        rgb = np.asarray(img.convert("RGB"))
+    return rgb[:, :, ::-1]
+
+
+def read_buffer(file_path):
+    with open(file_path, "rb") as file:
+        return decode_bmp(file.read())
+
+
+METHODS = {"pil": read_pil, "read": read_buffer, "mmap": map_bmp}
+
+
+def copied_bytes(method, file_path, pixels):
+    """
+    Returns the bytes a method copied to read a capture: PIL decodes the
+    whole image, a file read copies the file, a mapping copies nothing.
+    """
+    if method == "pil":
+        return pixels.nbytes
+    if method == "read":
+        return os.path.getsize(file_path)
+    return 0
+
+
+def find_captures(paths):
+    captures = []
+    for path in paths:
+        if os.path.isdir(path):
+            captures.extend(sorted(glob.glob(os.path.join(path, "*.bmp"))))
+        else:
+            captures.append(path)
+    return captures
+
+
+def render_captures(directory, count, seed=0):
+    model = WaveformModel(SimulatorConfig(seed=seed))
+    captures = []
+    for index, light_level in enumerate(np.linspace(40, 220, count).astype(int)):
+        file_path = os.path.join(directory, f"capture_{index}.bmp")
+        with open(file_path, "wb") as file:
+            file.write(model.render_bmp(model.sample(light_level)))
+        captures.append(file_path)
+    return captures
+
+
+def run_benchmark(captures, repeat):
+    """
+    Returns {method: (mean ms per capture, MB copied per capture)}.
+    """
+    engine = NumpyWaveformImageAnalysisController()
+    results = {}
+    for name, read in METHODS.items():
+        copied = 0
+        tic = time.perf_counter()
+        for _ in range(repeat):
+            for capture in captures:
+                pixels = read(capture)
+                roi = pixels[
+                    CalculationConstants.ROI_COORDINATES_Y1 : CalculationConstants.ROI_COORDINATES_Y2,
+                    CalculationConstants.ROI_COORDINATES_X1 : CalculationConstants.ROI_COORDINATES_X2,
+                ]
+                engine.cyan_mask(roi)
+                copied += copied_bytes(name, capture, pixels)
+                del pixels, roi
+        runs = repeat * len(captures)
+        results[name] = (
+            (time.perf_counter() - tic) / runs * 1000,
+            copied / runs / 1e6,
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BMP capture read benchmark")
+    parser.add_argument("captures", nargs="*", help="capture files or directories of them")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--count", type=int, default=10, help="captures rendered if none are given")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        captures = find_captures(args.captures) or render_captures(directory, args.count)
+        results = run_benchmark(captures, args.repeat)
+    print(f"{len(captures)} captures, {args.repeat} runs each")
+    print(f"{'method':<8}{'ms/capture':>12}{'MB copied':>12}")
+    for name, (ms, mb) in results.items():
+        print(f"{name:<8}{ms:>12.2f}{mb:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,449 @@
+"""
+Headless convergence benchmark for the light level searches of the GUI (Set Saturation and Set Noise, tasks/light_search_tasks.py). The search strategies run against a simulated instrument and light source over a grid of response curves, noise levels and targets, cold and repeated from the stored light response (unchanged and after a gain drift), and the captures, light level changes, instrument time and final error of every run are reported as mean/p50/p95 tables. Given a baseline, the run fails when the convergence cost went up or the accuracy went down.
+
+Usage:
+    python -m benchmarks.convergence_benchmark
+    python -m benchmarks.convergence_benchmark --baseline benchmarks/convergence_baseline.json
+    python -m benchmarks.convergence_benchmark --save-baseline benchmarks/convergence_baseline.json
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass, replace
+import itertools
+import json
+import sys
+import time
+
+import numpy as np
+
+from Constants import CalculationConstants, LightSearchConstants
+from controllers.debug_console_controller import DebugConsoleController
+from controllers.input_backend import FakeInputBackend
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from controllers.waveform_image_analysis_controller import summarize_analyses
+from simulator.lv5600_simulator import SimulatorConfig, WaveformModel
+from tasks.calibration_tasks import LightCalibrationCache
+from tasks.light_search_tasks import (
+    STRATEGIES,
+    BisectionStrategy,
+    LevelMeasurement,
+    LightActuator,
+    LightLevelSearch,
+    MeasurementBackend,
+)
+from utils.bmp_utils import decode_bmp
+
+# the default GUI settings (config.ini)
+TARGET_TOLERANCE = 0.02
+FLAT_SD_THRESHOLD = 1.2
+FLAT_PIXEL_COUNT = 100
+# the light level setSat measures the saturation target at (capture_sat_value)
+SAT_CAPTURE_LIGHT_LEVEL = 200
+
+GAMMAS = (0.6, 1.0, 1.6)
+GAINS_MV = (3.5, 5.0, 7.0)
+NOISE_LEVELS_MV = (2.0, 8.0, 15.0)
+# None is the saturation target of setSat, the others are setNoiseValue targets
+TARGETS_MV = (None, 200.0, 400.0, 600.0)
+# the gain change between the stored light response and a drifted repeat run
+DRIFT = 0.15
+CALIBRATION_KEY = "benchmark"
+
+METRICS = ("captures", "search_captures", "light_changes", "seconds", "abs_error_mv")
+# the metrics a regression run compares against the baseline
+COST_METRICS = ("captures", "light_changes", "seconds")
+# the accuracy a regression run compares against the baseline, so a cheaper
+# search cannot hide a worse result
+ERROR_METRIC = "abs_error_mv"
+# (search, reference, most share of the reference search captures). The model
+# search takes at most half the captures setSat took to converge before the
+# sequential sampler; the saturation target and display captures every run
+# pays whatever the search are not counted.
+CAPTURE_RATIOS = (("model", "setsat", 0.5),)
+# the bracket width up to which setSat averaged three captures per probe
+SETSAT_AVERAGING_BRACKET = 8
+SETSAT_AVERAGED_SAMPLES = 3
+
+
+@dataclass
+class Scenario:
+    gamma: float
+    gain_mv: float
+    noise_mv: float
+    target_mv: float  # None for the saturation target
+    seed: int
+
+    @property
+    def kind(self):
+        return "sat" if self.target_mv is None else "noise"
+
+
+@dataclass
+class CostModel:
+    """
+    Instrument time of the operations a search performs, in seconds.
+    """
+
+    capture: float = 0.35  # CAP:REFRESH, MAKE and download of one frame
+    query: float = 0.03  # one WFM:MEASURE:LEVEL ? round trip and the query interval
+    settle: float = 0.2  # the sleep after every light level change
+    key_press: float = 0.015  # one debug console key press
+    click: float = 0.05  # one debug console mouse click
+    activate: float = 0.02  # one debug console window activation
+
+
+class SimulatedBench(MeasurementBackend, LightActuator):
+    """
+    A simulated LV5600 and light source that counts what a search costs. It is
+    both the measurement backend and the light actuator of the search. With
+    query, the search samples are level queries (QueryMeasurement) instead of
+    captures.
+    """
+
+    def __init__(self, scenario, cost_model=None, render=False, query=False):
+        self.scenario = scenario
+        self.cost_model = cost_model or CostModel()
+        self.render = render
+        self.query = query
+        self.model = WaveformModel(
+            SimulatorConfig(
+                gamma=scenario.gamma,
+                gain_mv=scenario.gain_mv,
+                noise_mv=scenario.noise_mv,
+                seed=scenario.seed,
+            )
+        )
+        self.engine = NumpyWaveformImageAnalysisController()
+        self.light_level = 0
+        # the GUI debug console controller, on a backend that only adds up the input time
+        self.input_backend = FakeInputBackend(
+            self.cost_model.key_press, self.cost_model.click, self.cost_model.activate
+        )
+        self.debug_console = DebugConsoleController(self.input_backend)
+        self.captures = 0
+        self.queries = 0
+        self.light_changes = 0
+        self.seconds = 0.0
+
+    async def set_light_level(self, light_level):
+        if light_level == self.debug_console.light_level:
+            return  # already delivered, the controller does nothing
+        input_seconds = self.input_backend.seconds
+        self.debug_console.set_light_level(light_level)
+        self.seconds += (
+            self.input_backend.seconds - input_seconds + self.cost_model.settle
+        )
+        self.light_changes += 1
+        self.light_level = max(0, min(255, light_level))
+
+    def capture(self, mode=CalculationConstants.NOISE_MODE):
+        self.captures += 1
+        self.seconds += self.cost_model.capture
+        return self._analyze_sample(mode, self.render)
+
+    def query_level(self, mode=CalculationConstants.NOISE_MODE):
+        # the simulator answers the level query from the trace mask
+        self.queries += 1
+        self.seconds += self.cost_model.query
+        return self._analyze_sample(mode, False)
+
+    def _analyze_sample(self, mode, render):
+        levels = self.model.sample(self.light_level)
+        if render:
+            frame = decode_bmp(self.model.render_bmp(levels))
+            return self.engine.analyze_frame(frame, mode, FLAT_PIXEL_COUNT)
+        return self.engine.analyze_mask(
+            self.model.render_mask(levels), mode, FLAT_PIXEL_COUNT
+        )
+
+    async def measure(self, mode, num_sample, stop=None):
+        # averaged like MainWindow.compute_average_mv_sd
+        sample = self.query_level if self.query else self.capture
+        analyses = []
+        while len(analyses) < num_sample:
+            analyses.append(sample(mode))
+            if stop is not None and stop(analyses):
+                break
+        summary = summarize_analyses(analyses)
+        return LevelMeasurement(summary.mv, summary.sd, samples=len(analyses))
+
+
+class SetSatSampling:
+    """
+    A LightLevelSearch probed with the fixed sampling of setSat before the
+    sequential sampler: one capture per probe while the bracket is wider than
+    SETSAT_AVERAGING_BRACKET light levels, SETSAT_AVERAGED_SAMPLES captures
+    once it is narrower and for every step of the precise adjustment. setSat
+    had no stored light response to start from.
+    """
+
+    prior = None
+
+    def __init__(self, light_search):
+        self.light_search = light_search
+        self.lower_bound = LightSearchConstants.MIN_LIGHT_LEVEL - 1
+        self.upper_bound = LightSearchConstants.MAX_LIGHT_LEVEL
+
+    def __getattr__(self, name):
+        return getattr(self.light_search, name)
+
+    async def probe(self, light_level, num_sample=None):
+        if self.upper_bound - self.lower_bound > SETSAT_AVERAGING_BRACKET:
+            num_sample = 1
+        else:
+            num_sample = SETSAT_AVERAGED_SAMPLES
+        measurement, class_ = await self.light_search.probe(light_level, num_sample)
+        if class_ == 0:
+            self.upper_bound = min(self.upper_bound, light_level)
+        elif class_ == 1:
+            self.lower_bound = max(self.lower_bound, light_level)
+        return measurement, class_
+
+
+class SetSatStrategy(BisectionStrategy):
+    """
+    The bisection and sampling of setSat before the search strategies, the
+    reference the capture ratios are measured against.
+    """
+
+    name = "setsat"
+
+    async def search(self, light_search, target):
+        return await super().search(SetSatSampling(light_search), target)
+
+
+# the searches the benchmark runs, the GUI strategies and the references
+SEARCHES = {**STRATEGIES, SetSatStrategy.name: SetSatStrategy}
+
+
+def build_scenarios(seeds):
+    return [
+        Scenario(gamma, gain_mv, noise_mv, target_mv, seed)
+        for gamma, gain_mv, noise_mv, target_mv, seed in itertools.product(
+            GAMMAS, GAINS_MV, NOISE_LEVELS_MV, TARGETS_MV, range(seeds)
+        )
+    ]
+
+
+def run_scenario(
+    strategy, scenario, cost_model=None, render=False, calibration=None, query=False
+):
+    """
+    Runs one search on one scenario and returns its cost and final error.
+    With a LightCalibrationCache the search starts from the light response
+    stored by the previous runs and stores its own.
+    """
+    bench = SimulatedBench(scenario, cost_model, render, query)
+    mode = CalculationConstants.NOISE_MODE
+    light_search = LightLevelSearch(
+        bench,
+        bench,
+        bench.engine,
+        TARGET_TOLERANCE,
+        FLAT_SD_THRESHOLD,
+        strategy=strategy,
+        settle_time=0,
+        calibration=calibration,
+    )
+
+    async def run():
+        target = scenario.target_mv
+        if target is None:
+            # capture_sat_value
+            await bench.set_light_level(SAT_CAPTURE_LIGHT_LEVEL)
+            target = bench.capture(mode).mv
+        result = await light_search.run(target, mode, CALIBRATION_KEY)
+        bench.capture(mode)  # the final display capture
+        return target, result.light_level
+
+    target, final_light_level = asyncio.run(run())
+    error = bench.model.level_mv(final_light_level) - target
+    return {
+        "captures": bench.captures,
+        "search_captures": light_search.captures,
+        "light_changes": bench.light_changes,
+        "seconds": round(bench.seconds, 3),
+        "abs_error_mv": round(abs(error), 2),
+        "converged": abs(error) <= TARGET_TOLERANCE * target,
+    }
+
+
+def summarize(results):
+    """
+    Returns the mean, p50 and p95 of every metric and the share of converged
+    runs.
+    """
+    summary = {}
+    for metric in METRICS:
+        values = np.array([result[metric] for result in results], float)
+        summary[metric] = {
+            "mean": round(float(values.mean()), 3),
+            "p50": round(float(np.percentile(values, 50)), 3),
+            "p95": round(float(np.percentile(values, 95)), 3),
+        }
+    summary["converged"] = round(
+        sum(result["converged"] for result in results) / len(results), 3
+    )
+    return summary
+
+
+def run_benchmark(search_names, seeds, cost_model=None, render=False, query=False):
+    """
+    Returns {search: {group: summary}} where the groups are all runs, the
+    sat and noise targets, and every response curve gamma, all started cold.
+    Every scenario is then repeated starting from the stored light response
+    (warm), and once more after the gain drifted by DRIFT (drift). With query
+    the searches sample with level queries instead of captures.
+    """
+    scenarios = build_scenarios(seeds)
+    report = {}
+    for search_name in search_names:
+        results = []
+        groups = {"all": [], "sat": [], "noise": [], "warm": [], "drift": []}
+        for scenario in scenarios:
+            calibration = LightCalibrationCache(None)
+            run_arguments = (cost_model, render, calibration, query)
+            result = run_scenario(SEARCHES[search_name](), scenario, *run_arguments)
+            results.append((scenario, result))
+            groups["warm"].append(
+                run_scenario(SEARCHES[search_name](), scenario, *run_arguments)
+            )
+            drifted = replace(scenario, gain_mv=scenario.gain_mv * (1 + DRIFT))
+            groups["drift"].append(
+                run_scenario(SEARCHES[search_name](), drifted, *run_arguments)
+            )
+        for scenario, result in results:
+            groups["all"].append(result)
+            groups[scenario.kind].append(result)
+            groups.setdefault(f"gamma={scenario.gamma}", []).append(result)
+        report[search_name] = {
+            group: summarize(group_results) for group, group_results in groups.items()
+        }
+    return report
+
+
+def format_report(report):
+    lines = []
+    header = f"{'group':<12}{'captures mean':>15}" + "".join(
+        f"{metric + ' p50':>18}{metric + ' p95':>18}" for metric in METRICS
+    ) + f"{'converged':>11}"
+    for search_name, groups in report.items():
+        lines.append(f"== {search_name} ==")
+        lines.append(header)
+        for group, summary in groups.items():
+            lines.append(
+                f"{group:<12}{summary['captures']['mean']:>15}"
+                + "".join(
+                    f"{summary[metric]['p50']:>18}{summary[metric]['p95']:>18}"
+                    for metric in METRICS
+                )
+                + f"{summary['converged']:>11.1%}"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+
+def find_regressions(report, baseline, margin):
+    """
+    Returns a description of every cost p50/p95 and final error p95 that is
+    more than margin (relative) above the baseline, and of every converged
+    share more than margin below it.
+    """
+    regressions = []
+    for search_name, groups in baseline.items():
+        for group, summary in groups.items():
+            current = report.get(search_name, {}).get(group)
+            if current is None:
+                continue
+            for metric in COST_METRICS:
+                for percentile in ("p50", "p95"):
+                    allowed = summary[metric][percentile] * (1 + margin)
+                    value = current[metric][percentile]
+                    if value > allowed + 1e-9:
+                        regressions.append(
+                            f"{search_name} {group} {metric} {percentile}: "
+                            f"{value} > {summary[metric][percentile]} (+{margin:.0%})"
+                        )
+            allowed = summary[ERROR_METRIC]["p95"] * (1 + margin)
+            value = current[ERROR_METRIC]["p95"]
+            if value > allowed + 1e-9:
+                regressions.append(
+                    f"{search_name} {group} {ERROR_METRIC} p95: "
+                    f"{value} > {summary[ERROR_METRIC]['p95']} (+{margin:.0%})"
+                )
+            allowed = summary["converged"] * (1 - margin)
+            if current["converged"] < allowed - 1e-9:
+                regressions.append(
+                    f"{search_name} {group} converged: "
+                    f"{current['converged']} < {summary['converged']} (-{margin:.0%})"
+                )
+    return regressions
+
+
+def find_ratio_violations(report, ratios=CAPTURE_RATIOS):
+    """
+    Returns a description of every search whose mean search captures over all
+    cold runs exceed the given share of its reference search's. Searches not
+    in the report are skipped.
+    """
+    violations = []
+    for search_name, reference_name, max_ratio in ratios:
+        if search_name not in report or reference_name not in report:
+            continue
+        captures = report[search_name]["all"]["search_captures"]["mean"]
+        reference_captures = report[reference_name]["all"]["search_captures"]["mean"]
+        ratio = round(captures / reference_captures, 3)
+        if ratio > max_ratio:
+            violations.append(
+                f"{search_name} search captures: {ratio} of {reference_name} > {max_ratio}"
+            )
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Light level search convergence benchmark")
+    parser.add_argument(
+        "--search", nargs="+", choices=sorted(SEARCHES), default=sorted(SEARCHES)
+    )
+    parser.add_argument("--seeds", type=int, default=3, help="runs per scenario")
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="analyze rendered BMP captures instead of the trace mask (slower)",
+    )
+    parser.add_argument(
+        "--query",
+        action="store_true",
+        help="sample with level queries instead of captures, only the target and display frames are captured",
+    )
+    parser.add_argument("--baseline", help="fail if the cost exceeds this baseline")
+    parser.add_argument("--margin", type=float, default=0.05)
+    parser.add_argument("--save-baseline", help="write the results as a baseline")
+    args = parser.parse_args(argv)
+
+    tic = time.perf_counter()
+    report = run_benchmark(args.search, args.seeds, render=args.render, query=args.query)
+    print(format_report(report))
+    print(f"Benchmark time: {round(time.perf_counter() - tic, 2)} s")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(report, json.load(file), args.margin)
+        if not args.query:
+            # level queries replace the captures the ratios are about
+            regressions += find_ratio_violations(report)
+        if regressions:
+            print("Convergence regressions:")
+            print("\n".join(regressions))
+            return 1
+        print("No convergence regression")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Throughput benchmark of the trace color classification of the NumPy analysis engine (cyan_mask). The pixels are classified either by converting them to HSV or by looking their packed color up in the cached trace color lookup table, each with and without the V prefilter (only the pixels that pass the V range are classified), and the pixel throughput of every variant is reported in Mpx/s for rendered captures (a thin trace on a dark screen) and for ROIs where every pixel is bright, the worst case.
+
+Usage:
+    python -m benchmarks.cyan_mask_benchmark
+    python -m benchmarks.cyan_mask_benchmark --repeat 20 --bright 0.5
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from Constants import CalculationConstants
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from simulator.lv5600_simulator import SimulatorConfig, WaveformModel
+from utils.bmp_utils import decode_bmp
+
+
+def build_rois(count, bright, seed=0):
+    """
+    Returns {scene: list of ROIs}: rendered captures, and the same captures
+    with a share bright of the pixels set to random bright colors.
+    """
+    model = WaveformModel(SimulatorConfig(seed=seed))
+    rng = np.random.default_rng(seed)
+    captures = []
+    for light_level in np.linspace(40, 220, count).astype(int):
+        frame = decode_bmp(model.render_bmp(model.sample(light_level)))
+        captures.append(
+            np.ascontiguousarray(
+                frame[
+                    CalculationConstants.ROI_COORDINATES_Y1 : CalculationConstants.ROI_COORDINATES_Y2,
+                    CalculationConstants.ROI_COORDINATES_X1 : CalculationConstants.ROI_COORDINATES_X2,
+                ]
+            )
+        )
+    noisy = []
+    for roi in captures:
+        roi = roi.copy()
+        pixels = rng.random(roi.shape[:2]) < bright
+        roi[pixels] = rng.integers(200, 256, (int(pixels.sum()), 3), dtype=np.uint8)
+        noisy.append(roi)
+    return {"capture": captures, f"bright {bright:.0%}": noisy}
+
+
+def create_engines():
+    """
+    Returns {variant: engine} for the classification by HSV conversion and by
+    lookup table, with and without the V prefilter.
+    """
+    engines = {}
+    for use_lut in (False, True):
+        for v_prefilter in (False, True):
+            engine = NumpyWaveformImageAnalysisController()
+            engine.USE_LUT = use_lut
+            engine.V_PREFILTER = v_prefilter
+            name = ("lut" if use_lut else "hsv") + ("+v" if v_prefilter else "")
+            engines[name] = engine
+    return engines
+
+
+def throughput(engine, rois, repeat):
+    """
+    Returns the classification throughput over the ROIs in Mpx/s.
+    """
+    pixels = sum(roi.shape[0] * roi.shape[1] for roi in rois) * repeat
+    tic = time.perf_counter()
+    for _ in range(repeat):
+        for roi in rois:
+            engine.cyan_mask(roi)
+    return pixels / (time.perf_counter() - tic) / 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trace color classification throughput")
+    parser.add_argument("--count", type=int, default=8, help="captures rendered")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--bright", type=float, default=1.0, help="share of bright pixels in the worst case ROIs"
+    )
+    args = parser.parse_args(argv)
+
+    engines = create_engines()
+    tic = time.perf_counter()
+    engines["lut"].cyan_lut()
+    print(f"Lookup table built in {round(time.perf_counter() - tic, 2)} s")
+
+    print(f"{'scene':<14}" + "".join(f"{name + ' Mpx/s':>13}" for name in engines))
+    reference = engines["hsv"]
+    for scene, rois in build_rois(args.count, args.bright).items():
+        for roi in rois:
+            # the same classification, whichever way it is done
+            expected = reference.cyan_mask(roi)
+            for name, engine in engines.items():
+                if not np.array_equal(engine.cyan_mask(roi), expected):
+                    print(f"{name} disagrees with the HSV conversion on {scene}")
+                    return 1
+        print(
+            f"{scene:<14}"
+            + "".join(
+                f"{throughput(engine, rois, args.repeat):>13.0f}"
+                for engine in engines.values()
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -110,6 +110,12 @@ class WFMCommand:
         #  WFM:CURSOR:VALUE ON
         return "WFM:CURSOR:VALUE " + input
 
+    @staticmethod
+    def wfm_measure_level():
+        # the mV level (and spread) of the selected waveform line, if the
+        # firmware supports the measurement query
+        return "WFM:MEASURE:LEVEL ?"
+
 class CaptureCommand:
     @staticmethod
     def make(input):
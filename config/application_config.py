@@ -70,6 +70,20 @@ class AppConfig(QtCore.QObject):
         self.config.set("ftp", "password", password)
         self.settings_changed.emit()
 
+    def get_ftp_port(self):
+        return self.config.getint("ftp", "port", fallback=21)
+
+    def set_ftp_port(self, port):
+        self.config.set("ftp", "port", str(port))
+        self.settings_changed.emit()
+
+    def get_ftp_transport(self):
+        return self.config.get("ftp", "transport", fallback="async")
+
+    def set_ftp_transport(self, transport):
+        self.config.set("ftp", "transport", transport)
+        self.settings_changed.emit()
+
     def save_config_to_file(self):
         if getattr(sys, "frozen", False):
             application_path = sys._MEIPASS  # type: ignore
@@ -89,6 +103,13 @@ class AppConfig(QtCore.QObject):
         self.config.set("file", "local_file_path", local_file_path)
         self.settings_changed.emit()
 
+    def get_archive_captures(self):
+        return self.config.getboolean("file", "archive_captures", fallback=False)
+
+    def set_archive_captures(self, archive_captures):
+        self.config.set("file", "archive_captures", str(archive_captures))
+        self.settings_changed.emit()
+
     def get_target_tolerance(self):
         return self.config.getfloat("constants", "target_tolerance")
 
@@ -121,6 +142,13 @@ class AppConfig(QtCore.QObject):
     def get_flatness_check_sv_threshold(self):
         return self.config.getfloat("constants", "flatness_check_sv_threshold")
 
+    def get_max_average_count(self):
+        return self.config.getint("constants", "max_average_count", fallback=3)
+
+    def set_max_average_count(self, max_average_count):
+        self.config.set("constants", "max_average_count", str(max_average_count))
+        self.settings_changed.emit()
+
     def get_line_number(self):
         return self.config.get("lv5600", "line_number")
 
@@ -135,6 +163,78 @@ class AppConfig(QtCore.QObject):
     def get_target_noise(self):
         return self.config.getfloat("constants", "n1_value")
     
+    def get_analysis_backend(self):
+        return self.config.get("analysis", "backend", fallback="dll")
+
+    def set_analysis_backend(self, backend):
+        if not self.config.has_section("analysis"):
+            self.config.add_section("analysis")
+        self.config.set("analysis", "backend", backend)
+        self.settings_changed.emit()
+
+    def get_analysis_workers(self):
+        return self.config.getint("analysis", "workers", fallback=2)
+
+    def set_analysis_workers(self, workers):
+        if not self.config.has_section("analysis"):
+            self.config.add_section("analysis")
+        self.config.set("analysis", "workers", str(workers))
+        self.settings_changed.emit()
+
+    def get_analysis_cache(self):
+        return self.config.getboolean("analysis", "cache", fallback=True)
+
+    def set_analysis_cache(self, cache):
+        if not self.config.has_section("analysis"):
+            self.config.add_section("analysis")
+        self.config.set("analysis", "cache", str(cache))
+        self.settings_changed.emit()
+
+    def get_search_strategy(self):
+        return self.config.get("search", "strategy", fallback="model")
+
+    def set_search_strategy(self, strategy):
+        if not self.config.has_section("search"):
+            self.config.add_section("search")
+        self.config.set("search", "strategy", strategy)
+        self.settings_changed.emit()
+
+    def get_settle_mode(self):
+        return self.config.get("search", "settle", fallback="fixed")
+
+    def set_settle_mode(self, mode):
+        if not self.config.has_section("search"):
+            self.config.add_section("search")
+        self.config.set("search", "settle", mode)
+        self.settings_changed.emit()
+
+    def get_measurement_source(self):
+        return self.config.get("measurement", "source", fallback="capture")
+
+    def set_measurement_source(self, source):
+        if not self.config.has_section("measurement"):
+            self.config.add_section("measurement")
+        self.config.set("measurement", "source", source)
+        self.settings_changed.emit()
+
+    def get_input_backend(self):
+        return self.config.get("debug_console", "backend", fallback="dll")
+
+    def set_input_backend(self, backend):
+        if not self.config.has_section("debug_console"):
+            self.config.add_section("debug_console")
+        self.config.set("debug_console", "backend", backend)
+        self.settings_changed.emit()
+
+    def get_calibration_scope(self):
+        return self.config.get("calibration", "scope", fallback="default")
+
+    def set_calibration_scope(self, scope):
+        if not self.config.has_section("calibration"):
+            self.config.add_section("calibration")
+        self.config.set("calibration", "scope", scope)
+        self.settings_changed.emit()
+
     def get_current_settings(self):
         current_settings = ""
         current_settings += "Telnet Host: " + self.get_telnet_address() + "\n"
@@ -144,7 +244,12 @@ class AppConfig(QtCore.QObject):
         current_settings += "FTP Host: " + self.get_ftp_address() + "\n"
         current_settings += "FTP Username: " + self.get_ftp_username() + "\n"
         current_settings += "FTP Password: " + self.get_ftp_password() + "\n"
+        current_settings += "FTP Port: " + str(self.get_ftp_port()) + "\n"
+        current_settings += "FTP Transport: " + self.get_ftp_transport() + "\n"
         current_settings += "Local File Path: " + self.get_local_file_path() + "\n"
+        current_settings += (
+            "Archive Captures: " + str(self.get_archive_captures()) + "\n"
+        )
         current_settings += (
             "Target Tolerance: " + str(self.get_target_tolerance()) + "\n"
         )
@@ -159,7 +264,24 @@ class AppConfig(QtCore.QObject):
             + str(self.get_flatness_check_sv_threshold())
             + "\n"
         )
+        current_settings += (
+            "Max Average Count: " + str(self.get_max_average_count()) + "\n"
+        )
         current_settings += "Line Number: " + self.get_line_number() + "\n"
+        current_settings += "Analysis Backend: " + self.get_analysis_backend() + "\n"
+        current_settings += (
+            "Analysis Workers: " + str(self.get_analysis_workers()) + "\n"
+        )
+        current_settings += "Analysis Cache: " + str(self.get_analysis_cache()) + "\n"
+        current_settings += "Search Strategy: " + self.get_search_strategy() + "\n"
+        current_settings += "Settle Mode: " + self.get_settle_mode() + "\n"
+        current_settings += (
+            "Measurement Source: " + self.get_measurement_source() + "\n"
+        )
+        current_settings += (
+            "Calibration Scope: " + self.get_calibration_scope() + "\n"
+        )
+        current_settings += "Input Backend: " + self.get_input_backend() + "\n"
         return current_settings
 
     def set_default_settings(self):
@@ -170,12 +292,24 @@ class AppConfig(QtCore.QObject):
         self.set_ftp_address("192.168.0.1")
         self.set_ftp_username("LV5600")
         self.set_ftp_password("LV5600")
+        self.set_ftp_port(21)
+        self.set_ftp_transport("async")
         self.set_local_file_path("C://LV5600-OCB_Automation")
+        self.set_archive_captures(False)
         self.set_target_tolerance(0.02)
         self.set_target_saturation(763.3)
         self.set_flatness_check_pixel(100)
         self.set_flatness_check_sv_threshold(1.2)
+        self.set_max_average_count(3)
         self.set_line_number(580)
+        self.set_analysis_backend("dll")
+        self.set_analysis_workers(2)
+        self.set_analysis_cache(True)
+        self.set_search_strategy("model")
+        self.set_settle_mode("fixed")
+        self.set_measurement_source("capture")
+        self.set_calibration_scope("default")
+        self.set_input_backend("dll")
         self.save_config_to_file()
     
     def get_version(self):
@@ -0,0 +1,155 @@
+"""
+This module provides AnalysisCache, an LRU cache of waveform analysis results keyed by the content of the frame. Tuning loops often analyze identical frames, when the instrument did not refresh its screen or the same level is measured again, and a cached result saves the analysis (a DLL pass that also writes and reads the frame file). The key is a hash of the ROI pixels together with the ROI, the calculation mode and the flatness pixel count, so any pixel change in the ROI is a miss.
+
+Usage:
+    cache = AnalysisCache()
+    analysis = cache.analyze(pixels, mode, flat_pixel_count, lambda: engine.analyze_frame(frame, mode, flat_pixel_count))
+    analysis = await cache.analyze_async(pixels, mode, flat_pixel_count, lambda: executor.analyze(pixels, mode, flat_pixel_count))
+    analysis = await cache.analyze_async(pixels, mode, flat_pixel_count, compute, use_cache=False)  # verification analyzes afresh
+"""
+from collections import OrderedDict, deque
+import hashlib
+import inspect
+import pickle
+import time
+
+import numpy as np
+
+from Constants import AnalysisConstants, CalculationConstants
+
+DEFAULT_ROI = (
+    CalculationConstants.ROI_COORDINATES_X1,
+    CalculationConstants.ROI_COORDINATES_X2,
+    CalculationConstants.ROI_COORDINATES_Y1,
+    CalculationConstants.ROI_COORDINATES_Y2,
+)
+
+
+class AnalysisCache:
+    """
+    Analysis results by frame content, least recently used evicted first.
+
+    Attributes:
+    max_entries (int): The most results kept.
+    max_bytes (int): The most bytes the kept results may take (pickled size).
+    enabled (bool): False to analyze every frame.
+    """
+
+    def __init__(
+        self,
+        max_entries=AnalysisConstants.CACHE_ENTRIES,
+        max_bytes=AnalysisConstants.CACHE_BYTES,
+        enabled=True,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.entries = OrderedDict()  # key -> (result, size)
+        self.bytes = 0
+        self.hash_times = deque(maxlen=AnalysisConstants.HISTORY)
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "evictions": 0}
+
+    def frame_key(self, pixels, mode, flat_pixel_count, roi=DEFAULT_ROI):
+        """
+        Returns the cache key of the ROI of a BGR frame (H x W x 3 array) for
+        an analysis with mode and flat_pixel_count.
+        """
+        tic = time.perf_counter()
+        roi_x1, roi_x2, roi_y1, roi_y2 = roi
+        roi_pixels = np.ascontiguousarray(pixels[roi_y1:roi_y2, roi_x1:roi_x2, :3])
+        digest = hashlib.new(AnalysisConstants.CACHE_HASH, roi_pixels).digest()
+        self.hash_times.append(time.perf_counter() - tic)
+        return (digest, roi_pixels.shape, tuple(roi), mode, int(flat_pixel_count))
+
+    def get(self, key):
+        """
+        Returns the result cached under key, None on a miss or when disabled.
+        """
+        if not self.enabled:
+            self.stats["bypassed"] += 1
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def put(self, key, result):
+        """
+        Caches result under key and evicts the least recently used results
+        until the entry and byte bounds hold. A result larger than max_bytes
+        is not cached.
+        """
+        if not self.enabled:
+            return
+        size = len(pickle.dumps(result)) + len(key[0])
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (result, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.stats["evictions"] += 1
+
+    def _lookup(self, pixels, mode, flat_pixel_count, roi, use_cache):
+        """
+        Returns (key, cached result), key None when the cache is not used.
+        """
+        if not (use_cache and self.enabled):
+            self.stats["bypassed"] += 1
+            return None, None
+        key = self.frame_key(pixels, mode, flat_pixel_count, roi)
+        return key, self.get(key)
+
+    def analyze(self, pixels, mode, flat_pixel_count, compute, roi=DEFAULT_ROI, use_cache=True):
+        """
+        Returns the cached result of the frame, or compute() cached.
+
+        Args:
+        pixels (numpy.ndarray): The BGR frame the key is taken from.
+        compute (callable): Returns the analysis result on a miss.
+        use_cache (bool): False to compute the result afresh and not cache it.
+        """
+        key, result = self._lookup(pixels, mode, flat_pixel_count, roi, use_cache)
+        if result is None:
+            result = compute()
+            if key is not None:
+                self.put(key, result)
+        return result
+
+    async def analyze_async(
+        self, pixels, mode, flat_pixel_count, compute, roi=DEFAULT_ROI, use_cache=True
+    ):
+        """
+        Like analyze, for a compute that may return an awaitable (e.g. an
+        analysis run in an executor), which is awaited on a miss.
+        """
+        key, result = self._lookup(pixels, mode, flat_pixel_count, roi, use_cache)
+        if result is None:
+            result = compute()
+            if inspect.isawaitable(result):
+                result = await result
+            if key is not None:
+                self.put(key, result)
+        return result
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["entries"] = len(self.entries)
+        stats["bytes"] = self.bytes
+        if self.hash_times:
+            stats["hash_ms_mean"] = round(
+                sum(self.hash_times) / len(self.hash_times) * 1000, 3
+            )
+        return stats
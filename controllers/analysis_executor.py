@@ -0,0 +1,215 @@
+"""
+This module provides AnalysisExecutor, which runs the waveform analysis of the NumPy engine in a pool of worker processes, so a frame analysis never holds up the GUI event loop and several frames can be analyzed at once. The ROI of a frame is copied into a shared memory slot, the workers attach to each slot once and analyze the ROI in place, and only the FrameAnalysis is sent back. The time a frame waits for a slot and a worker and the time its analysis takes are kept separately.
+
+Usage:
+    executor = create_analysis_executor(2)
+    analysis = await executor.analyze(frame, CalculationConstants.NOISE_MODE, 100)
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+from multiprocessing import shared_memory
+import time
+
+import numpy as np
+
+from Constants import AnalysisConstants, CalculationConstants
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+
+ROI_SHAPE = (
+    CalculationConstants.ROI_COORDINATES_Y2 - CalculationConstants.ROI_COORDINATES_Y1,
+    CalculationConstants.ROI_COORDINATES_X2 - CalculationConstants.ROI_COORDINATES_X1,
+    3,
+)
+
+# the engine and the attached slots of a worker process
+worker_engine = None
+worker_slots = {}
+
+
+def initialize_worker():
+    global worker_engine
+    worker_engine = NumpyWaveformImageAnalysisController()
+    # build the trace color lookup table before the first frame arrives
+    worker_engine.cyan_lut()
+
+
+def warm_up():
+    return True
+
+
+def attach_slot(slot_name):
+    memory = worker_slots.get(slot_name)
+    if memory is None:
+        # workers share the resource tracker of the executor process, which
+        # removes the slots if it exits without closing them
+        memory = shared_memory.SharedMemory(name=slot_name)
+        worker_slots[slot_name] = memory
+    return memory
+
+
+def analyze_slot(slot_name, mode, flat_pixel_count):
+    """
+    Analyzes the ROI in the shared memory slot, in a worker process.
+
+    Returns:
+    tuple: The FrameAnalysis and the seconds the analysis took.
+    """
+    tic = time.perf_counter()
+    roi = np.ndarray(ROI_SHAPE, np.uint8, attach_slot(slot_name).buf)
+    analysis = worker_engine.analyze_mask(
+        worker_engine.cyan_mask(roi), mode, flat_pixel_count
+    )
+    del roi
+    return analysis, time.perf_counter() - tic
+
+
+class AnalysisExecutor:
+    """
+    Analyzes frames in worker processes.
+
+    A frame waits for a free shared memory slot, then for a worker. Cancelling
+    analyze() cancels the analysis if no worker has started it yet; a started
+    analysis runs to its end and its slot is freed then.
+    """
+
+    def __init__(self, workers=AnalysisConstants.WORKERS, slots=None):
+        """
+        Args:
+        workers (int): The number of worker processes.
+        slots (int): The number of shared memory slots, i.e. the frames that
+            can be queued or analyzed at once, twice the workers if None.
+        """
+        if workers < 1:
+            raise ValueError("An analysis executor needs at least one worker")
+        self.workers = workers
+        self.slot_count = slots or 2 * workers
+        self.pool = None
+        self.slots = []
+        self.free_slots = None
+        self.futures = set()
+        self.loader = NumpyWaveformImageAnalysisController()
+        self.queue_times = deque(maxlen=AnalysisConstants.HISTORY)
+        self.compute_times = deque(maxlen=AnalysisConstants.HISTORY)
+        self.stats = {"frames": 0, "cancelled": 0, "failures": 0}
+
+    def start(self):
+        """
+        Starts the worker processes and creates the shared memory slots. The
+        workers warm up (start and build their lookup table) in the background.
+        """
+        if self.pool is not None:
+            return self
+        size = int(np.prod(ROI_SHAPE))
+        self.slots = [shared_memory.SharedMemory(create=True, size=size) for _ in range(self.slot_count)]
+        self.pool = ProcessPoolExecutor(self.workers, initializer=initialize_worker)
+        for _ in range(self.workers):
+            self.pool.submit(warm_up)
+        logging.info(f"Analysis executor started with {self.workers} worker processes")
+        return self
+
+    def _release_slot(self, loop, slot, future):
+        self.futures.discard(future)
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self.free_slots.put_nowait, slot)
+
+    async def analyze(self, frame, mode, flat_pixel_count):
+        """
+        Returns the FrameAnalysis of a frame, analyzed in a worker process.
+
+        Args:
+        frame (numpy.ndarray, bytes-like or str): The BGR frame, or anything
+            NumpyWaveformImageAnalysisController.load_image takes. Only the
+            ROI is copied, so the frame can be reused once this returns or
+            awaits.
+        mode (int): The calculation type (SAT_MODE or NOISE_MODE).
+        flat_pixel_count (int): The columns the standard deviation is taken over.
+        """
+        if self.pool is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        if self.free_slots is None:
+            self.free_slots = asyncio.Queue()
+            for slot in range(self.slot_count):
+                self.free_slots.put_nowait(slot)
+        tic = time.perf_counter()
+        roi = self.loader._get_roi(
+            frame,
+            CalculationConstants.ROI_COORDINATES_X1,
+            CalculationConstants.ROI_COORDINATES_X2,
+            CalculationConstants.ROI_COORDINATES_Y1,
+            CalculationConstants.ROI_COORDINATES_Y2,
+        )
+        try:
+            slot = await self.free_slots.get()
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            raise
+        memory = self.slots[slot]
+        np.ndarray(ROI_SHAPE, np.uint8, memory.buf)[...] = roi
+        del roi
+        future = self.pool.submit(analyze_slot, memory.name, mode, flat_pixel_count)
+        self.futures.add(future)
+        # the slot is free once no worker can still read it
+        future.add_done_callback(lambda done: self._release_slot(loop, slot, done))
+        try:
+            analysis, compute_time = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            raise
+        except Exception:
+            self.stats["failures"] += 1
+            raise
+        self.stats["frames"] += 1
+        self.compute_times.append(compute_time)
+        self.queue_times.append(max(0.0, time.perf_counter() - tic - compute_time))
+        return analysis
+
+    def cancel_all(self):
+        """
+        Cancels the analyses no worker has started yet.
+        """
+        for future in list(self.futures):
+            future.cancel()
+
+    def close(self):
+        """
+        Stops the worker processes and removes the shared memory slots.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        for memory in self.slots:
+            memory.close()
+            memory.unlink()
+        self.slots = []
+        self.free_slots = None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["workers"] = self.workers
+        for name, times in (("queue", self.queue_times), ("compute", self.compute_times)):
+            if times:
+                stats[f"{name}_ms_mean"] = round(sum(times) / len(times) * 1000, 2)
+                stats[f"{name}_ms_max"] = round(max(times) * 1000, 2)
+        return stats
+
+
+def create_analysis_executor(workers=AnalysisConstants.WORKERS):
+    """
+    Creates and starts an AnalysisExecutor with workers worker processes.
+    Returns None if workers is 0 or the worker processes cannot be started,
+    the analysis then runs in a thread of the GUI process.
+    """
+    if workers <= 0:
+        return None
+    try:
+        return AnalysisExecutor(workers).start()
+    except Exception as e:
+        logging.warning(
+            f"Could not start the analysis worker processes, analyzing in the GUI process: {str(e)}"
+        )
+        return None
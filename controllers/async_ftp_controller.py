@@ -0,0 +1,274 @@
+"""
+This file contains the AsyncFTPController class, an asyncio implementation of the FTPController API. The control connection and the passive mode data connections run on asyncio streams, so a download does not block the event loop (and with it the GUI, Telnet commands and other coroutines). Every transfer records its throughput.
+"""
+import asyncio
+from collections import deque
+import ftplib
+import logging
+import re
+import time
+
+from Constants import FTPConstants
+
+PASV_RESPONSE = re.compile(r"(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)")
+
+
+class AsyncFTPController:
+    def __init__(self, host, username, password, port=21):
+        """
+        Initializes an instance of the AsyncFTPController class with the given host, username, and password.
+
+        Args:
+        - host (str): The hostname or IP address of the FTP server.
+        - username (str): The username to use for authentication.
+        - password (str): The password to use for authentication.
+        - port (int): The port of the FTP control connection.
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = FTPConstants.FTP_TIMEOUT
+        # (reader, writer) of the control connection, None when not connected
+        self.ftp = None
+        # the replies on the control connection come in the order of the
+        # commands, so a command sequence (e.g. PASV, RETR and the transfer
+        # reply) must not interleave with the commands of another coroutine
+        self.lock = asyncio.Lock()
+        self.transfers = deque(maxlen=FTPConstants.FTP_TRANSFER_HISTORY)
+
+    async def _read_response(self):
+        reader, _ = self.ftp
+        line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+        if not line:
+            raise EOFError("FTP control connection closed")
+        lines = [line]
+        # multi-line responses start with "xyz-" and end with "xyz "
+        if line[3:4] == b"-":
+            code = line[:3]
+            while not (line[:3] == code and line[3:4] == b" "):
+                line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+                if not line:
+                    raise EOFError("FTP control connection closed")
+                lines.append(line)
+        response = b"".join(lines).decode("latin-1").rstrip("\r\n")
+        logging.debug(f"FTP response: {response}")
+        return response
+
+    def _check_response(self, response, expected):
+        if response[:1] in expected:
+            return response
+        if response[:1] == "4":
+            raise ftplib.error_temp(response)
+        if response[:1] == "5":
+            raise ftplib.error_perm(response)
+        raise ftplib.error_reply(response)
+
+    async def _send_command(self, command, expected="2"):
+        _, writer = self.ftp
+        writer.write((command + "\r\n").encode("latin-1"))
+        await writer.drain()
+        return self._check_response(await self._read_response(), expected)
+
+    async def _open_data_connection(self):
+        response = await self._send_command("PASV")
+        match = PASV_RESPONSE.search(response)
+        if match is None:
+            raise ftplib.error_proto(response)
+        numbers = [int(number) for number in match.groups()]
+        # like ftplib, ignore the address in the response and reuse the control host
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, (numbers[4] << 8) + numbers[5]),
+            timeout=self.timeout,
+        )
+
+    async def connect(self):
+        """
+        Connects to the FTP server using the provided credentials.
+
+        Raises:
+        - Exception: If there is an error while connecting to the FTP server.
+        """
+        try:
+            async with self.lock:
+                self.ftp = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), timeout=self.timeout
+                )
+                self._check_response(await self._read_response(), "2")
+                response = await self._send_command("USER " + self.username, "23")
+                if response.startswith("3"):
+                    await self._send_command("PASS " + self.password)
+                await self._send_command("TYPE I")
+        except Exception as e:
+            self.drop_connection()
+            logging.error(f"Error while connecting to FTP: {str(e)}")
+            raise Exception(f"Error while connecting to FTP: {str(e)}") from e
+
+    async def get_into(self, remote_file, buffer):
+        """
+        Downloads a file from the FTP server into a preallocated bytearray,
+        extending it if the file is larger.
+
+        Args:
+        - remote_file (str): The path to the file on the FTP server.
+        - buffer (bytearray): The buffer to fill, starting at offset 0.
+
+        Returns:
+        - int: The number of bytes received.
+
+        Raises:
+        - ConnectionError: If the FTP connection is not established.
+        - Exception: If there is an error while downloading the file.
+        """
+        if not self.ftp:
+            raise ConnectionError("FTP connection is not established.")
+        try:
+            async with self.lock:
+                if not self.ftp:
+                    # closed while this transfer waited for its turn
+                    raise ConnectionError("FTP connection is not established.")
+                tic = time.perf_counter()
+                received = await self._retrieve_into(remote_file, buffer)
+                self._check_response(await self._read_response(), "2")
+                self._record_transfer(remote_file, received, time.perf_counter() - tic)
+            return received
+        except Exception as e:
+            logging.error(f"Error while getting file {remote_file}: {str(e)}")
+            raise Exception(f"Error while getting file {remote_file}: {str(e)}") from e
+
+    async def _retrieve_into(self, remote_file, buffer):
+        data_reader, data_writer = await self._open_data_connection()
+        try:
+            await self._send_command(f"RETR {remote_file}", "1")
+            received = 0
+            with memoryview(buffer) as view:
+                while True:
+                    chunk = await asyncio.wait_for(
+                        data_reader.read(FTPConstants.FTP_BLOCK_SIZE),
+                        timeout=self.timeout,
+                    )
+                    if not chunk:
+                        break
+                    fit = min(len(chunk), len(view) - received)
+                    view[received : received + fit] = chunk[:fit]
+                    received += fit
+                    if fit < len(chunk):
+                        chunk = chunk[fit:]
+                        break
+            # the buffer is full, append whatever is left of the file
+            while chunk:
+                buffer.extend(chunk)
+                received += len(chunk)
+                chunk = await asyncio.wait_for(
+                    data_reader.read(FTPConstants.FTP_BLOCK_SIZE),
+                    timeout=self.timeout,
+                )
+            return received
+        finally:
+            data_writer.close()
+            try:
+                await data_writer.wait_closed()
+            except OSError as e:
+                logging.debug(f"Error while closing FTP data connection: {str(e)}")
+
+    async def get_bytes(self, remote_file, size_hint=FTPConstants.BMP_FILE_SIZE):
+        """
+        Downloads a file from the FTP server into memory.
+
+        Returns:
+        - bytearray: The content of the file.
+        """
+        buffer = bytearray(size_hint)
+        received = await self.get_into(remote_file, buffer)
+        del buffer[received:]
+        return buffer
+
+    async def get_file(self, remote_file, local_file):
+        """
+        Downloads a file from the FTP server to the local file system.
+        """
+        data = await self.get_bytes(remote_file)
+        with open(local_file, "wb") as file:
+            file.write(data)
+
+    def _record_transfer(self, remote_file, size, seconds):
+        throughput = size / seconds / 1e6 if seconds > 0 else 0.0
+        self.transfers.append(
+            {
+                "file": remote_file,
+                "bytes": size,
+                "seconds": round(seconds, 4),
+                "mb_per_s": round(throughput, 2),
+            }
+        )
+        logging.debug(
+            f"FTP transfer of {remote_file}: {size} bytes in {round(seconds, 3)} s ({round(throughput, 2)} MB/s)"
+        )
+
+    def get_transfer_stats(self):
+        """
+        Returns the number of recorded transfers and their mean and minimum throughput in MB/s.
+        """
+        if not self.transfers:
+            return {"transfers": 0, "mean_mb_per_s": 0.0, "min_mb_per_s": 0.0}
+        total_bytes = sum(transfer["bytes"] for transfer in self.transfers)
+        total_seconds = sum(transfer["seconds"] for transfer in self.transfers)
+        return {
+            "transfers": len(self.transfers),
+            "mean_mb_per_s": round(total_bytes / total_seconds / 1e6, 2)
+            if total_seconds > 0
+            else 0.0,
+            "min_mb_per_s": min(transfer["mb_per_s"] for transfer in self.transfers),
+        }
+
+    async def is_connected(self):
+        """
+        Checks if the FTP connection is still alive.
+
+        Returns:
+        - bool: True if the connection is alive, False otherwise.
+        """
+        if self.ftp:
+            try:
+                async with self.lock:
+                    await self._send_command("NOOP")
+                return True
+            except Exception as e:
+                logging.error(f"FTP connection is not established: {str(e)}")
+                return False
+        return False
+
+    def drop_connection(self):
+        """
+        Discards the FTP connection without sending QUIT, e.g. after the connection broke.
+        """
+        if self.ftp:
+            try:
+                self.ftp[1].close()
+            except Exception as e:
+                logging.debug(f"Error while dropping FTP connection: {str(e)}")
+            finally:
+                self.ftp = None
+
+    async def close(self):
+        """
+        Closes the FTP connection.
+
+        Raises:
+        - ConnectionError: If the FTP connection is not established.
+        - Exception: If there is an error while closing the connection.
+        """
+        if self.ftp:
+            try:
+                async with self.lock:
+                    await self._send_command("QUIT")
+            except Exception as e:
+                logging.error(f"Error while closing FTP connection: {str(e)}")
+                raise Exception(f"Error while closing FTP connection: {str(e)}")
+            finally:
+                self.drop_connection()
+        else:
+            logging.error(
+                "Error closing FTP connection: FTP connection is not established."
+            )
+            raise ConnectionError("FTP connection is not established.")
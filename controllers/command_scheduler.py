@@ -0,0 +1,243 @@
+"""
+This module provides CommandScheduler, the single owner of a Telnet stream. The
+GUI slots run concurrently on one TelnetController, and the instrument answers
+the commands strictly in the order it receives them, so an exchange (write and
+the readuntil of its responses) must never interleave with another. The
+scheduler queues the requests, runs their exchanges one at a time in priority
+order, merges a request into an identical pending one, drops the requests whose
+deadline passed before their turn, and keeps the queue depth and wait time
+statistics.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+import itertools
+import logging
+import time
+from typing import Optional
+
+from Constants import TelnetConstants
+
+
+class CommandAbortedError(Exception):
+    """
+    Raised to the senders of the pending requests when the scheduler is aborted.
+    """
+
+
+@dataclass
+class CommandRequest:
+    commands: tuple
+    batch: bool  # sent with send_batch, a single command otherwise
+    priority: int
+    sequence: int
+    deadline: Optional[float]  # time.monotonic() after which it is not sent
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    senders: int = 1
+
+    @property
+    def is_query(self):
+        return all(command.rstrip().endswith("?") for command in self.commands)
+
+
+class CommandScheduler:
+    """
+    Runs the Telnet exchanges of a TelnetController one at a time.
+
+    Requests go in priority order (TelnetConstants.PRIORITY_*, the lowest
+    first), requests of one priority in the order they were submitted. A
+    request identical to a pending one is merged into it and both senders get
+    its responses, unless a write was queued after the pending one, so no
+    write is reordered around them.
+
+    Usage:
+        scheduler = CommandScheduler(exchange)
+        responses = await scheduler.submit(["WFM:SCALE:INTEN 0"], batch=True)
+    """
+
+    def __init__(self, exchange, deadline=TelnetConstants.TELNET_COMMAND_DEADLINE):
+        """
+        Args:
+        exchange (coroutine function): exchange(commands, batch) writes the
+            commands to the stream and returns their responses.
+        deadline (float): The default seconds a request may wait for and take
+            its turn, None for no deadline.
+        """
+        self.exchange = exchange
+        self.deadline = deadline
+        self.pending = []
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.worker = None
+        self.running = None  # the request being exchanged
+        self.wait_times = deque(maxlen=TelnetConstants.TELNET_COMMAND_HISTORY)
+        self.stats = {
+            "submitted": 0,
+            "merged": 0,
+            "exchanges": 0,
+            "expired": 0,
+            "aborted": 0,
+            "max_depth": 0,
+        }
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self.worker is None or self.worker.done() or self.worker.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.worker = loop.create_task(self._run())
+
+    def _find_merge(self, commands, batch):
+        for request in self.pending:
+            if request.commands != commands or request.batch != batch:
+                continue
+            # a query must not be answered from before a write queued after it
+            later = [other for other in self.pending if other.sequence > request.sequence]
+            if all(other.is_query for other in later):
+                return request
+        return None
+
+    async def submit(self, commands, batch=False, priority=TelnetConstants.PRIORITY_NORMAL, timeout=None):
+        """
+        Queues the commands and returns their responses once exchanged.
+
+        Args:
+        commands (list): The commands, a single one unless batch.
+        batch (bool): Send the commands as one pipelined batch.
+        priority (int): One of TelnetConstants.PRIORITY_*.
+        timeout (float): The deadline in seconds from now, the scheduler
+            default if None.
+
+        Returns:
+        list: The responses, one per command.
+
+        Raises:
+        asyncio.TimeoutError: If the deadline passed first. A request already
+            being exchanged still completes, so the stream stays in step.
+        CommandAbortedError: If the scheduler was aborted before its turn.
+        """
+        self._ensure_worker()
+        commands = tuple(commands)
+        timeout = self.deadline if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self.stats["submitted"] += 1
+
+        request = self._find_merge(commands, batch)
+        if request is not None:
+            self.stats["merged"] += 1
+            request.senders += 1
+            request.priority = min(request.priority, priority)
+            if request.deadline is not None:
+                request.deadline = None if deadline is None else max(request.deadline, deadline)
+        else:
+            request = CommandRequest(
+                commands,
+                batch,
+                priority,
+                next(self.sequence),
+                deadline,
+                asyncio.get_running_loop().create_future(),
+            )
+            self.pending.append(request)
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.depth())
+            self.wakeup.set()
+
+        if deadline is None:
+            return await asyncio.shield(request.future)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(request.future), max(0.0, deadline - time.monotonic())
+            )
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"Telnet command deadline passed: {commands[0]}")
+
+    def _next_request(self):
+        request = min(self.pending, key=lambda request: (request.priority, request.sequence))
+        self.pending.remove(request)
+        return request
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            request = self._next_request()
+            now = time.monotonic()
+            self.wait_times.append(now - request.enqueued_at)
+            if request.deadline is not None and now > request.deadline:
+                self.stats["expired"] += 1
+                logging.warning(f"Dropped Telnet command past its deadline: {request.commands[0]}")
+                if not request.future.done():
+                    request.future.set_exception(
+                        asyncio.TimeoutError(f"Telnet command deadline passed: {request.commands[0]}")
+                    )
+                    request.future.exception()
+                continue
+            self.running = request
+            try:
+                responses = await self.exchange(list(request.commands), request.batch)
+            except asyncio.CancelledError:
+                if not request.future.done():
+                    request.future.set_exception(CommandAbortedError("Telnet scheduler stopped"))
+                raise
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                if not request.future.done():
+                    request.future.set_result(responses)
+            finally:
+                self.running = None
+                self.stats["exchanges"] += 1
+            # nobody may be waiting any more, do not warn about unretrieved errors
+            if request.future.done() and not request.future.cancelled():
+                request.future.exception()
+
+    def depth(self):
+        """
+        Returns the number of requests waiting for their turn.
+        """
+        return len(self.pending)
+
+    def abort(self):
+        """
+        Fails every pending request with CommandAbortedError. The exchange
+        in progress, if any, completes.
+        """
+        for request in self.pending:
+            if not request.future.done():
+                request.future.set_exception(CommandAbortedError("Telnet commands aborted"))
+                request.future.exception()
+        self.stats["aborted"] += len(self.pending)
+        self.pending.clear()
+
+    async def stop(self, timeout=TelnetConstants.TELNET_CONNECTION_TIMEOUT):
+        """
+        Aborts the pending requests, waits at most timeout for the exchange in
+        progress and stops the worker.
+        """
+        self.abort()
+        worker, self.worker = self.worker, None
+        if worker is None or worker.done():
+            return
+        if self.running is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.running.future), timeout)
+            except Exception:
+                pass
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["depth"] = self.depth()
+        if self.wait_times:
+            wait_times = sorted(self.wait_times)
+            stats["wait_ms_mean"] = round(sum(wait_times) / len(wait_times) * 1000, 2)
+            stats["wait_ms_p95"] = round(wait_times[int(0.95 * (len(wait_times) - 1))] * 1000, 2)
+            stats["wait_ms_max"] = round(wait_times[-1] * 1000, 2)
+        return stats
@@ -1,20 +1,51 @@
 """
-This module provides a class DebugConsoleController that can be used to control the debug console . The class provides methods to move the cursor to specific coordinates, press keys, and adjust the light setting of the console. The module requires the pygetwindow and pyautogui libraries to be installed.
+This module provides a class DebugConsoleController that can be used to control the debug console . The class provides methods to move the cursor to specific coordinates, press keys, and adjust the light setting of the console. The input is sent through an InputBackend (controllers/input_backend.py), by default WinInputSimulator.dll.
 """
-from ctypes import c_int, c_ushort, c_wchar_p
 import logging
-from time import sleep
-from controllers.win_input_simulator import WinInputSimulator
+from Constants import DebugConsoleConstants, LightSearchConstants
+from controllers.input_backend import (
+    Click,
+    KeyRun,
+    Wait,
+    create_input_backend,
+    key_runs,
+)
 import threading
 
-special_keys = {
-    "enter": 0x0D,
-    "esc": 0x1B,
-    "home": 0x24,
-    "end": 0x23,
-    "up": 0x26,
-    "down": 0x28,
-}
+
+def plan_light_keys(target, current=None):
+    """
+    Returns the shortest key sequence that selects light level target in the
+    light setting list, without the final enter. The list opens at the
+    selected light level current, None if it is not known; home and end jump
+    to the first entry and to light level 256.
+
+    Args:
+    target (int): The light level to select (0-256).
+    current (int): The light level the list opens at, or None.
+
+    Returns:
+    list: The key names to press.
+    """
+    paths = [
+        ["home"] + ["down"] * (DebugConsoleConstants.LIGHT_LIST_OFFSET + target),
+        ["end"] + ["up"] * (LightSearchConstants.MAX_LIGHT_LEVEL - target),
+    ]
+    if current is not None:
+        # on a tie the relative path wins, it does not depend on the list ends
+        step = "down" if target > current else "up"
+        paths.insert(0, [step] * abs(target - current))
+    return min(paths, key=len)
+
+
+def nearest_end_key_count(target):
+    """
+    Returns the key presses of the fixed home or end path set_light_level used
+    before it tracked the selected light level, without the final enter.
+    """
+    if target < 128:
+        return 1 + DebugConsoleConstants.LIGHT_LIST_OFFSET + target
+    return 1 + LightSearchConstants.MAX_LIGHT_LEVEL - target
 
 
 class DebugConsoleController:
@@ -31,7 +62,10 @@ class DebugConsoleController:
     LIGHT_SETTING_Y (int): The y-coordinate of the light setting button.
     DELIVERY_SETTING_X (int): The x-coordinate of the delivery setting button.
     DELIVERY_SETTING_Y (int): The y-coordinate of the delivery setting button.
-    window (pygetwindow.Window): The window object of the debug console.
+    window (object): The window handle of the debug console.
+    backend (InputBackend): The backend the input is sent through.
+    light_level (int): The light level selected and delivered by this controller, None if not known.
+    stats (dict): Light level change counters, see get_stats.
     """
 
     # Constants:
@@ -54,13 +88,26 @@ class DebugConsoleController:
     DELIVERY_MASK_SETTING_Y = 211
     DELIVERY_INITIAL_SETTING_X = 670
     DELIVERY_INITIAL_SETTING_Y = 152
+    AGC_MODES = ("ON", "OFF", "WLI", "NBI", "RDI")
+    MASK_MODES = ("CROSS", "OFF", "ON")
 
-    def __init__(self):
+    def __init__(self, backend=None):
         """
         Initializes a new instance of the DebugConsoleController class.
+
+        Args:
+        backend (InputBackend): The input backend, WinInputSimulator.dll if None.
         """
         self.window = None
-        self.simulator = WinInputSimulator()
+        self.backend = backend or create_input_backend()
+        self.light_level = None
+        self.stats = {
+            "light_changes": 0,
+            "unchanged": 0,
+            "key_presses": 0,
+            "key_presses_saved": 0,
+            "activations_saved": 0,
+        }
 
     def activate(self):
         """
@@ -69,50 +116,38 @@ class DebugConsoleController:
         Returns:
         bool: True if the operation was successful, False otherwise.
         """
-        activate_status = self.simulator.activate(
-            c_wchar_p(self.WINDOW_TITLE), c_int(0)
-        )
-        if activate_status != self.simulator.SUCCESS:
-            logging.error(
-                "Failed to activate window!, Error code: " + str(activate_status)
-            )
-            return False
+        self.window = self.backend.activate(self.WINDOW_TITLE)
+        return self.window is not None
+
+    def run_script(self, actions):
+        """
+        Activates the debug console window once and runs the input actions.
 
-        self.window = self.simulator.get_windows(self.WINDOW_TITLE)[0]
-        return True
+        Args:
+        actions (list): Click, KeyRun and Wait actions (controllers/input_backend.py).
+
+        Returns:
+        bool: True if the operation was successful, False otherwise.
+        """
+        return self.activate() and self.backend.run(
+            self.WINDOW_TITLE, actions, activate=False
+        )
 
-    def move_and_click(self, x, y):
+    def move_and_click(self, x, y, activate=True):
         """
         Moves the cursor to the specified coordinates and performs a left mouse click.
 
         Args:
         x (int): The x-coordinate of the target location.
         y (int): The y-coordinate of the target location.
+        activate (bool): Activate the window first. False if the caller just did.
 
         Returns:
         bool: True if the operation was successful, False otherwise.
         """
-        self.activate()
-        # Convert window-relative coordinates to screen-relative
-        if self.window is None:
-            print("Window not found!")
-            return False
-
-        # Move the cursor
-        move_status = self.simulator.move_cursor(
-            c_wchar_p(self.WINDOW_TITLE), c_int(x), c_int(y), c_int(0)
-        )
-        if move_status != self.simulator.SUCCESS:
-            logging.error("Failed to move cursor!, Error code: " + str(move_status))
-            return False
-
-        # Perform a left mouse click
-        click_status = self.simulator.left_click(c_wchar_p(self.WINDOW_TITLE), c_int(0))
-        if click_status != self.simulator.SUCCESS:
-            logging.error("Failed to left click!, Error code: " + str(click_status))
-            return False
-
-        return True
+        if activate:
+            return self.run_script([Click(x, y)])
+        return self.backend.run(self.WINDOW_TITLE, [Click(x, y)], activate=False)
 
     def press_key(self, key):
         """
@@ -124,17 +159,36 @@ class DebugConsoleController:
         Returns:
         None
         """
-        # Press the key
-        key_code = special_keys.get(key.lower(), None)
-        if key_code is None:
-            key_code = ord(key)
+        if not self.backend.run(self.WINDOW_TITLE, [KeyRun(key)], activate=False):
+            return False
+
+    def select_setting(self, setting, keys, delivery, before=()):
+        """
+        Opens a setting list, selects an entry with the keys and delivers it,
+        as one input script.
+
+        Args:
+        setting (tuple): The (x, y) coordinates of the setting list.
+        keys (list): The key names that select the entry, without the final enter.
+        delivery (tuple): The (x, y) coordinates of the delivery button.
+        before (tuple): Actions to run first.
 
-        press_status = self.simulator.press_key(
-            c_wchar_p(self.WINDOW_TITLE), c_ushort(key_code), c_int(0)
+        Returns:
+        bool: True if the operation was successful, False otherwise.
+        """
+        return self.run_script(
+            list(before)
+            + [Click(*setting)]
+            + key_runs(list(keys) + ["enter"])
+            + [Click(*delivery)]
+        )
+
+    def select_light_setting(self, keys):
+        return self.select_setting(
+            (self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y),
+            keys,
+            (self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y),
         )
-        if press_status != self.simulator.SUCCESS:
-            logging.error("Failed to press key!, Error code: " + str(press_status))
-            return False
 
     # Util Functions
     def tune_up_light(self):
@@ -144,13 +198,8 @@ class DebugConsoleController:
         Returns:
         None
         """
-        self.activate()
-        self.move_and_click(self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y)
-        self.press_key("down")
-        self.press_key("enter")
-        self.move_and_click(
-            self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y
-        )
+        self.shift_light_level(1)
+        self.select_light_setting(["down"])
 
     def tune_down_light(self):
         """
@@ -159,13 +208,8 @@ class DebugConsoleController:
         Returns:
         None
         """
-        self.activate()
-        self.move_and_click(self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y)
-        self.press_key("up")
-        self.press_key("enter")
-        self.move_and_click(
-            self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y
-        )
+        self.shift_light_level(-1)
+        self.select_light_setting(["up"])
 
     def tune_to_target_level(self, target_level, current_level):
         """
@@ -178,8 +222,6 @@ class DebugConsoleController:
         Returns:
         None
         """
-
-        self.activate()
         # target level can only be 0 to 255
         if target_level > 255:
             target_level = 255
@@ -187,23 +229,11 @@ class DebugConsoleController:
             target_level = 0
 
         if target_level > current_level:
-            num_of_press = target_level - current_level
-            self.move_and_click(self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y)
-            for i in range(num_of_press):
-                self.press_key("down")
-            self.press_key("enter")
-            self.move_and_click(
-                self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y
-            )
+            self.light_level = target_level
+            self.select_light_setting(["down"] * (target_level - current_level))
         elif target_level < current_level:
-            num_of_press = current_level - target_level
-            self.move_and_click(self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y)
-            for i in range(num_of_press):
-                self.press_key("up")
-            self.press_key("enter")
-            self.move_and_click(
-                self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y
-            )
+            self.light_level = target_level
+            self.select_light_setting(["up"] * (current_level - target_level))
         else:
             pass
 
@@ -216,16 +246,8 @@ class DebugConsoleController:
         Returns:
         None
         """
-        self.activate()
-        self.move_and_click(self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y)
-        # press home button
-        self.press_key("home")
-        for i in range(5):
-            self.press_key("down")
-        self.press_key("enter")
-        self.move_and_click(
-            self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y
-        )
+        self.select_light_setting(plan_light_keys(0))
+        self.light_level = 0
 
     def set_AGC_mode(self, mode):
         """
@@ -237,63 +259,66 @@ class DebugConsoleController:
         Returns:
         None
         """
-        self.activate()
-        self.move_and_click(self.AGC_SETTING_X, self.AGC_SETTING_Y)
-        self.press_key("home")
-        num_of_press = 0
-        if mode == "ON":
-            num_of_press = 0
-        elif mode == "OFF":
-            num_of_press = 1
-        elif mode == "WLI":
-            num_of_press = 2
-        elif mode == "NBI":
-            num_of_press = 3
-        elif mode == "RDI":
-            num_of_press = 4
-        else:
+        if mode not in self.AGC_MODES:
             raise ValueError("Invalid AGC mode!")
 
-        for i in range(num_of_press):
-            self.press_key("down")
-        self.press_key("enter")
-        self.move_and_click(self.DELIVERY_AGC_SETTING_X, self.DELIVERY_AGC_SETTING_Y)
+        self.select_setting(
+            (self.AGC_SETTING_X, self.AGC_SETTING_Y),
+            ["home"] + ["down"] * self.AGC_MODES.index(mode),
+            (self.DELIVERY_AGC_SETTING_X, self.DELIVERY_AGC_SETTING_Y),
+        )
+
+    def deliver_initial_setting(self):
+        """
+        Delivers the initial setting, which the mask mode needs first.
 
-    def set_mask_mode(self, mode):
+        Returns:
+        bool: True if the operation was successful, False otherwise.
+        """
+        # the initial setting may reset the light setting list
+        self.forget_light_level()
+        return self.run_script(
+            [Click(self.DELIVERY_INITIAL_SETTING_X, self.DELIVERY_INITIAL_SETTING_Y)]
+        )
+
+    def set_mask_mode(self, mode, deliver_initial_setting=True):
         """
         Set the mask mode to the specified value.
         Args: CROSS, ON, OFF
+        deliver_initial_setting (bool): Deliver the initial setting first and wait
+            INITIAL_SETTING_WAIT for it. False if the caller has done so and
+            waited for the waveform to settle.
 
         Returns:
         None
         """
-        self.activate()
-        # need to press delivery initial setting first
-        self.move_and_click(
-            self.DELIVERY_INITIAL_SETTING_X, self.DELIVERY_INITIAL_SETTING_Y
-        )
-        sleep(1.5)
-        self.move_and_click(self.MASK_SETTING_X, self.MASK_SETTING_Y)
-        self.press_key("home")
-        num_of_press = 0
-        if mode == "CROSS":
-            num_of_press = 0
-        elif mode == "OFF":
-            num_of_press = 1
-        elif mode == "ON":
-            num_of_press = 2
-        else:
+        if mode not in self.MASK_MODES:
             raise ValueError("Invalid Mask mode!")
 
-        for i in range(num_of_press):
-            self.press_key("down")
-        self.press_key("enter")
-        self.move_and_click(self.DELIVERY_MASK_SETTING_X, self.DELIVERY_MASK_SETTING_Y)
+        before = ()
+        if deliver_initial_setting:
+            # need to press delivery initial setting first
+            self.forget_light_level()
+            before = (
+                Click(self.DELIVERY_INITIAL_SETTING_X, self.DELIVERY_INITIAL_SETTING_Y),
+                Wait(DebugConsoleConstants.INITIAL_SETTING_WAIT),
+            )
+        self.select_setting(
+            (self.MASK_SETTING_X, self.MASK_SETTING_Y),
+            ["home"] + ["down"] * self.MASK_MODES.index(mode),
+            (self.DELIVERY_MASK_SETTING_X, self.DELIVERY_MASK_SETTING_Y),
+            before=before,
+        )
 
     def set_light_level(self, target):
         """
         Sets the light level to the specified target value.
 
+        The light setting list opens at the selected light level, so once the
+        delivered level is known the keys are pressed from there when that is
+        shorter than starting from home or end (see plan_light_keys), and a
+        light level that is already delivered is not set again.
+
         Args:
         target (int): The target light level to set. Must be between 0 and 256.
 
@@ -303,29 +328,68 @@ class DebugConsoleController:
         Raises:
         ValueError: If the target value is less than 0 or greater than 256.
         """
-        self.activate()
         # the target range is 0 to 256
         if target > 256:
             raise ValueError("Target light level cannot be greater than 256!")
         elif target < 0:
             raise ValueError("Target light level cannot be less than 0!")
 
-        # set the light level, start from the nearest end (home or end represents 0 and 256)
-        self.move_and_click(self.LIGHT_SETTING_X, self.LIGHT_SETTING_Y)
-        if target < 128:
-            self.press_key("home")
-            for i in range(5):
-                self.press_key("down")  # to skip the initial setting
-            for i in range(target):
-                self.press_key("down")
-        else:
-            self.press_key("end")
-            for i in range(256 - target):
-                self.press_key("up")
-        self.press_key("enter")
-        self.move_and_click(
-            self.DELIVERY_LIGHT_SETTING_X, self.DELIVERY_LIGHT_SETTING_Y
+        # what the fixed nearest end path cost: 2 clicks, the keys and enter
+        nearest_end_keys = nearest_end_key_count(target) + 1
+        if target == self.light_level:
+            self.stats["unchanged"] += 1
+            self.stats["key_presses_saved"] += nearest_end_keys
+            self.stats["activations_saved"] += 3
+            logging.debug(f"Light level {target} is already delivered")
+            return
+
+        keys = plan_light_keys(target, self.light_level)
+        self.stats["light_changes"] += 1
+        self.stats["key_presses"] += len(keys) + 1
+        self.stats["key_presses_saved"] += nearest_end_keys - len(keys) - 1
+        # the window is activated once for both clicks
+        self.stats["activations_saved"] += 2
+        logging.debug(
+            f"Light level {self.light_level} -> {target}: {len(keys) + 1} key presses"
+        )
+
+        # unknown until the new level is delivered
+        self.light_level = None
+        if self.select_light_setting(keys):
+            self.light_level = target
+
+    def shift_light_level(self, steps):
+        """
+        Moves the tracked light level by steps, if it is known.
+        """
+        if self.light_level is not None:
+            self.light_level = max(
+                LightSearchConstants.MIN_LIGHT_LEVEL,
+                min(LightSearchConstants.MAX_LIGHT_LEVEL, self.light_level + steps),
+            )
+
+    def forget_light_level(self):
+        """
+        Forgets the tracked light level, e.g. after the light setting was
+        changed outside this controller. The next set_light_level starts from
+        home or end.
+        """
+        self.light_level = None
+
+    def get_stats(self):
+        """
+        Returns the light level change statistics, including the key presses
+        and the estimated seconds saved compared with always starting from
+        home or end, and the input backend statistics.
+        """
+        stats = dict(self.stats)
+        stats["seconds_saved"] = round(
+            stats["key_presses_saved"] * DebugConsoleConstants.KEY_PRESS_TIME
+            + stats["activations_saved"] * DebugConsoleConstants.ACTIVATE_TIME,
+            3,
         )
+        stats["backend"] = self.backend.get_stats()
+        return stats
 
     def stop_tasks(self):
         threading.Thread(target=self._stop_threads).start()
@@ -2,10 +2,13 @@
     This file contains the FTPController class that can be used to control an FTP server. The class provides methods to connect to the server, download files, and close the connection. The module requires the ftplib library to be installed.
 """
 from ftplib import FTP
+import ftplib
 import logging
 
+from Constants import FTPConstants
+
 class FTPController:
-    def __init__(self,host, username, password):
+    def __init__(self,host, username, password, port=21):
         """
         Initializes an instance of the FTPController class with the given host, username, and password.
 
@@ -13,8 +16,10 @@ class FTPController:
         - host (str): The hostname or IP address of the FTP server.
         - username (str): The username to use for authentication.
         - password (str): The password to use for authentication.
+        - port (int): The port of the FTP control connection.
         """
         self.host = host
+        self.port = port
         self.username = username
         self.password = password
         self.ftp = None
@@ -27,7 +32,8 @@ class FTPController:
         - Exception: If there is an error while connecting to the FTP server.
         """
         try:
-            self.ftp = FTP(self.host)
+            self.ftp = FTP()
+            self.ftp.connect(self.host, self.port)
             self.ftp.login(self.username,self.password)
             self.ftp.set_pasv(True) # passive mode means the server initiates the data connection
         except Exception as e:
@@ -53,8 +59,68 @@ class FTPController:
                 self.ftp.retrbinary(f'RETR {remote_file}', file.write)
         except Exception as e:
             logging.error(f"Error while getting file {remote_file}: {str(e)}")
-            raise Exception(f"Error while getting file {remote_file}: {str(e)}")
+            raise Exception(f"Error while getting file {remote_file}: {str(e)}") from e
     
+    def get_into(self, remote_file, buffer):
+        """
+        Downloads a file from the FTP server into a preallocated bytearray.
+        The data connection is read straight into the buffer, so nothing is
+        written to disk and no intermediate chunks are copied. If the file is
+        larger than the buffer, the buffer is extended.
+
+        Args:
+        - remote_file (str): The path to the file on the FTP server.
+        - buffer (bytearray): The buffer to fill, starting at offset 0.
+
+        Returns:
+        - int: The number of bytes received.
+
+        Raises:
+        - ConnectionError: If the FTP connection is not established.
+        - Exception: If there is an error while downloading the file.
+        """
+        if not self.ftp:
+            raise ConnectionError("FTP connection is not established.")
+        try:
+            self.ftp.voidcmd("TYPE I")
+            received = 0
+            with self.ftp.transfercmd(f"RETR {remote_file}") as conn:
+                with memoryview(buffer) as view:
+                    while received < len(view):
+                        count = conn.recv_into(view[received:])
+                        if not count:
+                            break
+                        received += count
+                if received == len(buffer):
+                    # the buffer is full, read whatever is left of the file
+                    while True:
+                        chunk = conn.recv(FTPConstants.FTP_BLOCK_SIZE)
+                        if not chunk:
+                            break
+                        buffer.extend(chunk)
+                        received += len(chunk)
+            self.ftp.voidresp()
+            return received
+        except Exception as e:
+            logging.error(f"Error while getting file {remote_file}: {str(e)}")
+            raise Exception(f"Error while getting file {remote_file}: {str(e)}") from e
+
+    def get_bytes(self, remote_file, size_hint=FTPConstants.BMP_FILE_SIZE):
+        """
+        Downloads a file from the FTP server into memory.
+
+        Args:
+        - remote_file (str): The path to the file on the FTP server.
+        - size_hint (int): The expected file size, used to preallocate the buffer.
+
+        Returns:
+        - bytearray: The content of the file.
+        """
+        buffer = bytearray(size_hint)
+        received = self.get_into(remote_file, buffer)
+        del buffer[received:]
+        return buffer
+
     def is_connected(self):
         """
         Checks if the FTP connection is still alive.
@@ -64,13 +130,26 @@ class FTPController:
         """
         if self.ftp:
             try:
-                # An empty string will be returned if the connection is alive
-                return self.ftp.voidcmd("NOOP") == ''
-            except Exception as e:
-                logging.error(f"FTP connection is not established: {str(e)}")
+                # voidcmd raises unless the server answers with a 2xx reply
+                self.ftp.voidcmd("NOOP")
+                return True
+            except ftplib.all_errors as e:
+                logging.warning(f"FTP connection is not alive: {str(e)}")
                 return False
         return False
     
+    def drop_connection(self):
+        """
+        Discards the FTP connection without sending QUIT, e.g. after the connection broke.
+        """
+        if self.ftp:
+            try:
+                self.ftp.close()
+            except Exception as e:
+                logging.debug(f"Error while dropping FTP connection: {str(e)}")
+            finally:
+                self.ftp = None
+
     def close(self):
         """
         Closes the FTP connection.
@@ -1,12 +1,222 @@
+"""
+This module provides the FTPSession class, a long-lived FTP connection shared by all captures of an instrument session. The connection is opened on first use and kept open afterwards; its health is only checked after it has been idle for a while or after a transfer failed, and a broken connection is re-established transparently.
+"""
+import asyncio
+import ftplib
+import logging
+import time
+
+from Constants import FTPConstants
+
+# errors that mean the control connection is unusable, as opposed to e.g. a
+# missing remote file (ftplib.error_perm), which leaves the connection intact
+CONNECTION_ERRORS = (
+    OSError,
+    EOFError,
+    ftplib.error_temp,
+    ftplib.error_reply,
+    ftplib.error_proto,
+)
+
+
 class FTPSession:
-    def __init__(self,ftp_client):
+    def __init__(
+        self,
+        ftp_client,
+        keep_alive=True,
+        health_check_idle_time=FTPConstants.FTP_HEALTH_CHECK_IDLE_TIME,
+    ):
+        """
+        Initializes an FTPSession around the given FTPController.
+
+        Args:
+        - ftp_client (FTPController): The FTP client the session owns.
+        - keep_alive (bool): Keep the connection open between uses. If False the
+          connection is closed when the with block exits.
+        - health_check_idle_time (float): Idle time in seconds after which the
+          connection is checked with NOOP before it is reused.
+        """
         self.ftp_client = ftp_client
-    
+        self.keep_alive = keep_alive
+        self.health_check_idle_time = health_check_idle_time
+        self.last_used = None
+        self.stats = {
+            "uses": 0,
+            "connects": 0,
+            "reuses": 0,
+            "health_checks": 0,
+            "reconnects": 0,
+            "failures": 0,
+        }
+
     def __enter__(self):
-        if not self.ftp_client.is_connected():
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.last_used = time.monotonic()
+        if exc is not None and self._is_connection_error(exc):
+            self._discard()
+        if not self.keep_alive:
+            self.close()
+
+    def _is_connection_error(self, e):
+        return isinstance(e, CONNECTION_ERRORS) or isinstance(
+            e.__cause__, CONNECTION_ERRORS
+        )
+
+    def _discard(self):
+        self.stats["failures"] += 1
+        self.ftp_client.drop_connection()
+        self.last_used = None
+
+    def _is_idle(self):
+        return (
+            self.last_used is not None
+            and time.monotonic() - self.last_used > self.health_check_idle_time
+        )
+
+    def acquire(self):
+        """
+        Makes sure the FTP connection is usable and returns the FTP client.
+        The connection is only checked with NOOP after it has been idle for
+        longer than health_check_idle_time.
+        """
+        self.stats["uses"] += 1
+        if self.ftp_client.ftp is None:
             self.ftp_client.connect()
+            self.stats["connects"] += 1
+        elif self._is_idle():
+            self.stats["health_checks"] += 1
+            if self.ftp_client.is_connected():
+                self.stats["reuses"] += 1
+            else:
+                self.ftp_client.drop_connection()
+                self.ftp_client.connect()
+                self.stats["reconnects"] += 1
+        else:
+            self.stats["reuses"] += 1
+        self.last_used = time.monotonic()
         return self.ftp_client
-    
-    def __exit__(self, exc_type, exc,tb):
-        if self.ftp_client.is_connected():
-            self.ftp_client.close()
\ No newline at end of file
+
+    def call(self, operation, *args):
+        """
+        Runs the named FTPController operation on the session connection.
+        If the connection turns out to be broken, it is re-established and the
+        operation is retried once.
+        """
+        try:
+            return getattr(self.acquire(), operation)(*args)
+        except Exception as e:
+            if not self._is_connection_error(e):
+                raise
+            logging.warning(f"FTP connection lost, reconnecting: {str(e)}")
+            self._discard()
+            self.stats["reconnects"] += 1
+            return getattr(self.acquire(), operation)(*args)
+        finally:
+            self.last_used = time.monotonic()
+
+    def get_file(self, remote_file, local_file):
+        return self.call("get_file", remote_file, local_file)
+
+    def get_into(self, remote_file, buffer):
+        return self.call("get_into", remote_file, buffer)
+
+    def get_bytes(self, remote_file, size_hint=FTPConstants.BMP_FILE_SIZE):
+        return self.call("get_bytes", remote_file, size_hint)
+
+    def get_stats(self):
+        """
+        Returns the connection reuse statistics of the session.
+        """
+        stats = dict(self.stats)
+        stats["reuse_ratio"] = (
+            round(stats["reuses"] / stats["uses"], 3) if stats["uses"] else 0.0
+        )
+        return stats
+
+    def close(self):
+        """
+        Closes the session connection if it is open.
+        """
+        if self.ftp_client.ftp is not None:
+            try:
+                self.ftp_client.close()
+            except Exception as e:
+                logging.error(f"Error while closing FTP session: {str(e)}")
+        self.last_used = None
+        logging.debug(f"FTP session statistics: {self.get_stats()}")
+
+
+class AsyncFTPSession(FTPSession):
+    """
+    The FTPSession counterpart for AsyncFTPController: the same reuse, lazy
+    health check and reconnect policy, with coroutine methods.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # concurrent callers must not both connect or health check
+        self.acquire_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.last_used = time.monotonic()
+        if exc is not None and self._is_connection_error(exc):
+            self._discard()
+        if not self.keep_alive:
+            await self.close()
+
+    async def acquire(self):
+        async with self.acquire_lock:
+            self.stats["uses"] += 1
+            if self.ftp_client.ftp is None:
+                await self.ftp_client.connect()
+                self.stats["connects"] += 1
+            elif self._is_idle():
+                self.stats["health_checks"] += 1
+                if await self.ftp_client.is_connected():
+                    self.stats["reuses"] += 1
+                else:
+                    self.ftp_client.drop_connection()
+                    await self.ftp_client.connect()
+                    self.stats["reconnects"] += 1
+            else:
+                self.stats["reuses"] += 1
+            self.last_used = time.monotonic()
+        return self.ftp_client
+
+    async def call(self, operation, *args):
+        try:
+            return await getattr(await self.acquire(), operation)(*args)
+        except Exception as e:
+            if not self._is_connection_error(e):
+                raise
+            logging.warning(f"FTP connection lost, reconnecting: {str(e)}")
+            self._discard()
+            self.stats["reconnects"] += 1
+            return await getattr(await self.acquire(), operation)(*args)
+        finally:
+            self.last_used = time.monotonic()
+
+    async def get_file(self, remote_file, local_file):
+        return await self.call("get_file", remote_file, local_file)
+
+    async def get_into(self, remote_file, buffer):
+        return await self.call("get_into", remote_file, buffer)
+
+    async def get_bytes(self, remote_file, size_hint=FTPConstants.BMP_FILE_SIZE):
+        return await self.call("get_bytes", remote_file, size_hint)
+
+    async def close(self):
+        if self.ftp_client.ftp is not None:
+            try:
+                await self.ftp_client.close()
+            except Exception as e:
+                logging.error(f"Error while closing FTP session: {str(e)}")
+        self.last_used = None
+        logging.debug(f"FTP session statistics: {self.get_stats()}")
@@ -0,0 +1,243 @@
+"""
+This module provides the input backends the DebugConsoleController drives the debug console window with. A backend runs a whole action script (clicks, key runs with repeat counts and waits) in one call, activating the window once per script. WinInputBackend sends the input through WinInputSimulator.dll, FakeInputBackend only records the input and its estimated duration, so scripts can be run and timed without Windows.
+"""
+from ctypes import c_int, c_ushort, c_wchar_p
+from dataclasses import dataclass
+import itertools
+import logging
+from time import sleep
+
+from Constants import DebugConsoleConstants
+from controllers.win_input_simulator import WinInputSimulator
+
+special_keys = {
+    "enter": 0x0D,
+    "esc": 0x1B,
+    "home": 0x24,
+    "end": 0x23,
+    "up": 0x26,
+    "down": 0x28,
+}
+
+
+@dataclass
+class Click:
+    x: int
+    y: int
+
+
+@dataclass
+class KeyRun:
+    key: str
+    count: int = 1
+
+
+@dataclass
+class Wait:
+    seconds: float
+
+
+def key_runs(keys):
+    """
+    Returns the key names as KeyRuns, consecutive presses of one key merged.
+    """
+    return [KeyRun(key, len(list(group))) for key, group in itertools.groupby(keys)]
+
+
+def key_code(key):
+    code = special_keys.get(key.lower(), None)
+    if code is None:
+        code = ord(key)
+    return code
+
+
+class InputBackend:
+    """
+    Sends mouse and keyboard input to a window.
+
+    Usage:
+        backend.run(window_title, [Click(x, y), KeyRun("down", 12), KeyRun("enter"), Wait(0.5)])
+    """
+
+    def __init__(self):
+        self.stats = {
+            "scripts": 0,
+            "activations": 0,
+            "clicks": 0,
+            "key_presses": 0,
+            "waits": 0,
+            "failures": 0,
+        }
+
+    def activate(self, window_title):
+        """
+        Activates the window.
+
+        Returns:
+        object: The window handle, or None if the window could not be activated.
+        """
+        raise NotImplementedError
+
+    def perform(self, window_title, action):
+        """
+        Performs one action on the active window.
+
+        Returns:
+        bool: True if the action was successful, False otherwise.
+        """
+        raise NotImplementedError
+
+    def run(self, window_title, actions, activate=True):
+        """
+        Runs the action script on the window. The script stops at the first
+        action that fails.
+
+        Args:
+        window_title (str): The title of the window.
+        actions (list): Click, KeyRun and Wait actions.
+        activate (bool): Activate the window first. False if the caller just did.
+
+        Returns:
+        bool: True if all actions were successful, False otherwise.
+        """
+        self.stats["scripts"] += 1
+        if activate and self.activate(window_title) is None:
+            self.stats["failures"] += 1
+            return False
+        for action in actions:
+            if isinstance(action, Click):
+                self.stats["clicks"] += 1
+            elif isinstance(action, KeyRun):
+                self.stats["key_presses"] += action.count
+            elif isinstance(action, Wait):
+                self.stats["waits"] += 1
+            else:
+                raise ValueError(f"Invalid input action {action}")
+            if not self.perform(window_title, action):
+                self.stats["failures"] += 1
+                return False
+        return True
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+class WinInputBackend(InputBackend):
+    """
+    Sends the input through WinInputSimulator.dll. The DLL finds the window by
+    its title on every call, so no window handle is kept.
+    """
+
+    def __init__(self, simulator=None):
+        """
+        Args:
+        simulator (WinInputSimulator): The loaded DLL wrapper, loaded here if None.
+        """
+        super().__init__()
+        self.simulator = simulator or WinInputSimulator()
+
+    def activate(self, window_title):
+        self.stats["activations"] += 1
+        activate_status = self.simulator.activate(c_wchar_p(window_title), c_int(0))
+        if activate_status != self.simulator.SUCCESS:
+            logging.error(
+                "Failed to activate window!, Error code: " + str(activate_status)
+            )
+            return None
+        windows = self.simulator.get_windows(window_title)
+        if not windows:
+            logging.error("Window not found!")
+            return None
+        return windows[0]
+
+    def perform(self, window_title, action):
+        title = c_wchar_p(window_title)
+        if isinstance(action, Click):
+            move_status = self.simulator.move_cursor(
+                title, c_int(action.x), c_int(action.y), c_int(0)
+            )
+            if move_status != self.simulator.SUCCESS:
+                logging.error("Failed to move cursor!, Error code: " + str(move_status))
+                return False
+            click_status = self.simulator.left_click(title, c_int(0))
+            if click_status != self.simulator.SUCCESS:
+                logging.error("Failed to left click!, Error code: " + str(click_status))
+                return False
+        elif isinstance(action, KeyRun):
+            code = c_ushort(key_code(action.key))
+            for _ in range(action.count):
+                press_status = self.simulator.press_key(title, code, c_int(0))
+                if press_status != self.simulator.SUCCESS:
+                    logging.error("Failed to press key!, Error code: " + str(press_status))
+                    return False
+        else:
+            sleep(action.seconds)
+        return True
+
+
+class FakeInputBackend(InputBackend):
+    """
+    Records the input instead of sending it and adds up how long it would have
+    taken, for tests, benchmarks and tuning runs without Windows. Waits are
+    not slept unless real_time is True.
+    """
+
+    def __init__(
+        self,
+        key_press_time=DebugConsoleConstants.KEY_PRESS_TIME,
+        click_time=DebugConsoleConstants.CLICK_TIME,
+        activate_time=DebugConsoleConstants.ACTIVATE_TIME,
+        real_time=False,
+    ):
+        """
+        Args:
+        key_press_time (float): Seconds one key press takes.
+        click_time (float): Seconds one click takes.
+        activate_time (float): Seconds one window activation takes.
+        real_time (bool): Sleep for the waits of the scripts.
+        """
+        super().__init__()
+        self.key_press_time = key_press_time
+        self.click_time = click_time
+        self.activate_time = activate_time
+        self.real_time = real_time
+        self.actions = []  # (window title, action) in the order performed
+        self.seconds = 0.0
+
+    def activate(self, window_title):
+        self.stats["activations"] += 1
+        self.seconds += self.activate_time
+        return window_title
+
+    def perform(self, window_title, action):
+        self.actions.append((window_title, action))
+        if isinstance(action, Click):
+            self.seconds += self.click_time
+        elif isinstance(action, KeyRun):
+            self.seconds += action.count * self.key_press_time
+        else:
+            self.seconds += action.seconds
+            if self.real_time:
+                sleep(action.seconds)
+        return True
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["seconds"] = round(self.seconds, 3)
+        return stats
+
+
+def create_input_backend(backend="dll"):
+    """
+    Creates the input backend selected by backend.
+
+    Args:
+    backend (str): "dll" for WinInputSimulator.dll or "fake" for the recording
+        FakeInputBackend. The fake backend sends no input, so it is only used
+        when asked for; if the DLL cannot be loaded the error is raised.
+    """
+    if backend == "dll":
+        return WinInputBackend()
+    if backend == "fake":
+        return FakeInputBackend()
+    raise ValueError("Invalid input backend. Backend must be dll or fake.")
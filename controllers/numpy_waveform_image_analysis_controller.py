@@ -0,0 +1,463 @@
+"""
+This module provides a class NumpyWaveformImageAnalysisController, a pure NumPy implementation of the waveform image analysis done by WaveformImageAnalysisLib.dll. It exposes the same API as WaveformImageAnalysisController, but every image argument can either be a file path or an in-memory BGR pixel array (H x W x 3, uint8), so a frame only has to be decoded once and the analysis also runs off Windows. analyze_stack analyzes the frames of a multi-frame sample together, in one pass over the stacked ROIs.
+"""
+import logging
+import time
+
+import numpy as np
+from PIL import Image
+
+from Constants import CalculationConstants, LV5600Constants
+from controllers.waveform_image_analysis_controller import (
+    FrameAnalysis,
+    StackAnalysis,
+)
+from utils.bmp_utils import decode_bmp, map_bmp
+
+# the trace color lookup tables by HSV range, see cyan_lut
+CYAN_LUTS = {}
+
+
+class NumpyWaveformImageAnalysisController:
+    """
+    Pure NumPy waveform image analysis engine.
+
+    The waveform trace is found the same way as in the DLL: the ROI is converted
+    to HSV and thresholded between HSV_LOWER and HSV_UPPER (through a lookup
+    table of the 2^24 colors, see cyan_lut), the column of the trace
+    is the median column of the cyan pixels in the top TOP_ROW_COUNT rows, and the
+    level is taken from the cyan pixels around that column.
+    """
+
+    IMAGE_LOAD_ERROR = "Image could not be loaded"
+    NO_CYAN_PIXEL_ERROR = "No cyan pixel found"
+    INVALID_PARAMETER_ERROR = "Invalid parameter"
+
+    # OpenCV 8-bit HSV ranges: H 0-180, S 0-255, V 0-255
+    HSV_LOWER = (0, 200, 200)
+    HSV_UPPER = (100, 255, 255)
+    requires_file = False
+    TOP_ROW_COUNT = 10
+    MV_COLUMN_HALF_WIDTH = 5
+    # classify the trace colors with the lookup table instead of converting them
+    USE_LUT = True
+    # the share of bright pixels above which the whole ROI is looked up
+    DENSE_CANDIDATE_SHARE = 0.3
+    # classify only the pixels that pass the V range (the max channel)
+    V_PREFILTER = True
+
+    def __init__(self):
+        logging.info("NumPy waveform image analysis engine loaded successfully")
+
+    def _fail(self, message):
+        logging.error(message)
+        raise Exception(message)
+
+    def load_image(self, image):
+        """
+        Returns the image as a BGR pixel array.
+        A BMP file is memory mapped, so slicing the ROI of the array reads only
+        the ROI; other formats are decoded with PIL.
+
+        Args:
+        image (str, bytes-like or numpy.ndarray): A file path, the content of a
+            BMP file, or an H x W x 3 BGR pixel array.
+        """
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            try:
+                return decode_bmp(image)
+            except Exception as e:
+                logging.error(f"Error while decoding image: {str(e)}")
+                self._fail(self.IMAGE_LOAD_ERROR)
+        if isinstance(image, np.ndarray):
+            if image.ndim != 3 or image.shape[2] < 3:
+                self._fail(self.IMAGE_LOAD_ERROR)
+            return image
+        try:
+            return map_bmp(image)
+        except (OSError, ValueError):
+            # not an uncompressed BMP (or unreadable), PIL tells which
+            pass
+        try:
+            with Image.open(image) as img:
+                rgb = np.asarray(img.convert("RGB"))
+        except Exception as e:
+            logging.error(f"Error while loading image {image}: {str(e)}")
+            self._fail(self.IMAGE_LOAD_ERROR)
+        return rgb[:, :, ::-1]
+
+    def _get_roi(self, image, roi_x1, roi_x2, roi_y1, roi_y2):
+        if roi_x1 >= roi_x2 or roi_y1 >= roi_y2:
+            self._fail(self.INVALID_PARAMETER_ERROR)
+        pixels = self.load_image(image)
+        height, width = pixels.shape[:2]
+        if roi_x1 < 0 or roi_y1 < 0 or roi_x2 > width or roi_y2 > height:
+            self._fail(self.INVALID_PARAMETER_ERROR)
+        return pixels[roi_y1:roi_y2, roi_x1:roi_x2, :3]
+
+    def in_hsv_range(self, b, g, r):
+        """
+        Returns which of the pixels (int32 channel arrays) are between
+        HSV_LOWER and HSV_UPPER. Uses the same integer HSV conversion as
+        OpenCV's COLOR_BGR2HSV, so the result matches cv::inRange on the
+        converted image.
+        """
+        v = np.maximum(np.maximum(r, g), b)
+        diff = v - np.minimum(np.minimum(r, g), b)
+
+        # saturation: diff * round((255 << 12) / v), rounded back to 8 bits
+        v_safe = np.where(v == 0, 1, v)
+        sdiv = np.where(v == 0, 0, np.rint((255 << 12) / v_safe)).astype(np.int32)
+        s = (diff * sdiv + (1 << 11)) >> 12
+
+        # hue: sector offset plus the scaled difference of the other two channels
+        h = np.where(
+            v == r, g - b, np.where(v == g, b - r + 2 * diff, r - g + 4 * diff)
+        )
+        diff_safe = np.where(diff == 0, 1, diff)
+        hdiv = np.where(diff == 0, 0, np.rint((180 << 12) / (6 * diff_safe))).astype(
+            np.int32
+        )
+        h = (h * hdiv + (1 << 11)) >> 12
+        h = np.where(h < 0, h + 180, h)
+
+        return (
+            (v >= self.HSV_LOWER[2])
+            & (v <= self.HSV_UPPER[2])
+            & (s >= self.HSV_LOWER[1])
+            & (s <= self.HSV_UPPER[1])
+            & (h >= self.HSV_LOWER[0])
+            & (h <= self.HSV_UPPER[0])
+        )
+
+    def cyan_lut(self):
+        """
+        Returns the trace color lookup table of the HSV range: for every
+        packed color b | g << 8 | r << 16, whether it is a trace pixel. It is
+        built once per HSV range and shared by all engines.
+        """
+        key = (tuple(self.HSV_LOWER), tuple(self.HSV_UPPER))
+        lut = CYAN_LUTS.get(key)
+        if lut is None:
+            tic = time.perf_counter()
+            lut = np.empty(1 << 24, bool)
+            channel = np.arange(256, dtype=np.int32)
+            g, b = np.meshgrid(channel, channel, indexing="ij")
+            g, b = g.ravel(), b.ravel()
+            for r in range(256):
+                lut[r << 16 : (r + 1) << 16] = self.in_hsv_range(
+                    b, g, np.full_like(g, r)
+                )
+            CYAN_LUTS[key] = lut
+            logging.info(
+                f"Trace color lookup table built in {round(time.perf_counter() - tic, 2)} s"
+            )
+        return lut
+
+    def cyan_mask(self, roi):
+        """
+        Returns a boolean mask of the trace pixels in a BGR ROI, or in a stack
+        of them (N x H x W x 3), matching cv::inRange on the HSV converted ROI.
+        Only the pixels bright enough to pass the V range are classified (every
+        pixel if V_PREFILTER is False), by their packed color in the cyan_lut
+        (or converted with in_hsv_range if USE_LUT is False).
+        """
+        if not self.V_PREFILTER:
+            b, g, r = (roi[..., channel].astype(np.int32) for channel in range(3))
+            if self.USE_LUT:
+                return self.cyan_lut()[b | (g << 8) | (r << 16)]
+            return self.in_hsv_range(b, g, r)
+        v = np.maximum(np.maximum(roi[..., 2], roi[..., 1]), roi[..., 0])
+        mask = (v >= self.HSV_LOWER[2]) & (v <= self.HSV_UPPER[2])
+        # a flat index is much faster to find than an N-dimensional one
+        flat_candidates = np.flatnonzero(mask)
+        if flat_candidates.size == 0:
+            return mask
+        if self.USE_LUT and flat_candidates.size > mask.size * self.DENSE_CANDIDATE_SHARE:
+            # gathering the candidates costs more than looking up every pixel
+            return self.cyan_lut()[
+                roi[..., 0].astype(np.int32)
+                | (roi[..., 1].astype(np.int32) << 8)
+                | (roi[..., 2].astype(np.int32) << 16)
+            ]
+        pixels = roi[np.unravel_index(flat_candidates, mask.shape)].astype(np.int32)
+        b, g, r = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+        if self.USE_LUT:
+            is_trace = self.cyan_lut()[b | (g << 8) | (r << 16)]
+        else:
+            is_trace = self.in_hsv_range(b, g, r)
+        mask.reshape(-1)[flat_candidates] = is_trace
+        return mask
+
+    def _find_trace_column(self, mask):
+        rows = np.flatnonzero(mask.any(axis=1))
+        if rows.size < self.TOP_ROW_COUNT:
+            self._fail(self.NO_CYAN_PIXEL_ERROR)
+        columns = np.sort(np.nonzero(mask[rows[: self.TOP_ROW_COUNT]])[1])
+        return int(columns[columns.size // 2])
+
+    def _rows_around_column(self, mask, column, half_width):
+        # the DLL scans the columns column - half_width to column + half_width
+        # - 1 (both GetCurrentMV and GetCurrentStdev), so the window is too
+        window = mask[:, max(column - half_width, 0) : max(column + half_width, 0)]
+        rows = np.nonzero(window)[0]
+        if rows.size == 0:
+            self._fail(self.NO_CYAN_PIXEL_ERROR)
+        return rows
+
+    def _check_flat_pixel_count(self, flat_pixel_count):
+        """
+        Returns flat_pixel_count as an int, truncated like the DLL does. Fewer
+        than 2 pixels leave no column to take the standard deviation over.
+        """
+        flat_pixel_count = int(flat_pixel_count)
+        if flat_pixel_count < 2:
+            self._fail(self.INVALID_PARAMETER_ERROR)
+        return flat_pixel_count
+
+    def _check_calculation_type(self, calculation_type):
+        if calculation_type not in (
+            CalculationConstants.SAT_MODE,
+            CalculationConstants.NOISE_MODE,
+        ):
+            self._fail(self.INVALID_PARAMETER_ERROR)
+
+    def _trace_row(self, mask, calculation_type, column=None):
+        self._check_calculation_type(calculation_type)
+        if column is None:
+            column = self._find_trace_column(mask)
+        rows = self._rows_around_column(mask, column, self.MV_COLUMN_HALF_WIDTH)
+        if calculation_type == CalculationConstants.SAT_MODE:
+            return float(rows.min())
+        return float(rows.mean())
+
+    def _row_to_cursor(self, row, roi_y1, roi_y2):
+        return (1.0 - row / (roi_y2 - roi_y1)) * LV5600Constants.MAX_CURSOR_VALUE
+
+    def _cursor_to_mv(self, cursor):
+        return round(float(self._cursors_to_mvs(cursor)), 1)
+
+    def _cursors_to_mvs(self, cursors):
+        # same rounding as the DLL: half away from zero to 1 decimal place
+        mvs = cursors * CalculationConstants.CURSOR_TO_MV_FACTOR
+        return np.round(np.sign(mvs) * np.floor(np.abs(mvs) * 10 + 0.5) / 10, 1)
+
+    def get_current_mv(
+        self, image_path, calculation_type, roi_x1, roi_x2, roi_y1, roi_y2
+    ):
+        roi = self._get_roi(image_path, roi_x1, roi_x2, roi_y1, roi_y2)
+        row = self._trace_row(self.cyan_mask(roi), calculation_type)
+        return self._cursor_to_mv(self._row_to_cursor(row, roi_y1, roi_y2))
+
+    def get_current_cursor_level(
+        self, image_path, calculation_type, roi_x1, roi_x2, roi_y1, roi_y2
+    ):
+        roi = self._get_roi(image_path, roi_x1, roi_x2, roi_y1, roi_y2)
+        row = self._trace_row(self.cyan_mask(roi), calculation_type)
+        cursor = self._row_to_cursor(row, roi_y1, roi_y2)
+        return round(float(np.sign(cursor) * np.floor(abs(cursor) + 0.5)))
+
+    def classify_waveform(
+        self,
+        current_mv,
+        current_sd,
+        target,
+        target_tolerance,
+        flat_sd_threshold,
+        calculation_type,
+    ):
+        """
+        Returns 0 (over saturated), 1 (under saturated) or 2 (just saturated).
+        A flat waveform is always classified as over saturated.
+        """
+        self._check_calculation_type(calculation_type)
+
+        is_flat = flat_sd_threshold > current_sd
+        lower_bound = (1 - target_tolerance) * target
+        upper_bound = (1 + target_tolerance) * target
+        logging.debug(f"target range: {lower_bound} - {upper_bound}")
+
+        if is_flat or current_mv >= upper_bound:
+            return 0
+        if current_mv <= lower_bound:
+            return 1
+        return 2
+
+    def compute_mv_cursor(self, image_path, mode):
+        mv = self.get_current_mv(
+            image_path,
+            mode,
+            CalculationConstants.ROI_COORDINATES_X1,
+            CalculationConstants.ROI_COORDINATES_X2,
+            CalculationConstants.ROI_COORDINATES_Y1,
+            CalculationConstants.ROI_COORDINATES_Y2,
+        )
+        cursor = mv / CalculationConstants.CURSOR_TO_MV_FACTOR
+
+        return mv, cursor
+
+    def get_current_stdev(
+        self,
+        image_path,
+        flat_pixel_count,
+        roi_x1,
+        roi_x2,
+        roi_y1,
+        roi_y2,
+        calculation_type,
+    ):
+        """
+        Returns the standard deviation of the trace rows in the flat_pixel_count
+        columns centred on the trace column.
+        """
+        flat_pixel_count = self._check_flat_pixel_count(flat_pixel_count)
+        roi = self._get_roi(image_path, roi_x1, roi_x2, roi_y1, roi_y2)
+        mask = self.cyan_mask(roi)
+        column = self._find_trace_column(mask)
+        rows = self._rows_around_column(mask, column, flat_pixel_count // 2)
+        return float(rows.std())
+
+    def analyze_frame(self, image_path, mode, flat_pixel_count):
+        """
+        Returns the FrameAnalysis of one frame.
+        The image is decoded, converted and scanned for the trace once, and both
+        the mV level and the standard deviation are taken from the same mask.
+        """
+        roi = self._get_roi(
+            image_path,
+            CalculationConstants.ROI_COORDINATES_X1,
+            CalculationConstants.ROI_COORDINATES_X2,
+            CalculationConstants.ROI_COORDINATES_Y1,
+            CalculationConstants.ROI_COORDINATES_Y2,
+        )
+        return self.analyze_mask(self.cyan_mask(roi), mode, flat_pixel_count)
+
+    def analyze_mask(self, mask, mode, flat_pixel_count):
+        """
+        Returns the FrameAnalysis of a trace mask of the default ROI, as
+        returned by cyan_mask.
+        """
+        flat_pixel_count = self._check_flat_pixel_count(flat_pixel_count)
+        column = self._find_trace_column(mask)
+        row = self._trace_row(mask, mode, column)
+        mv = self._cursor_to_mv(
+            self._row_to_cursor(
+                row,
+                CalculationConstants.ROI_COORDINATES_Y1,
+                CalculationConstants.ROI_COORDINATES_Y2,
+            )
+        )
+        sd = float(self._rows_around_column(mask, column, flat_pixel_count // 2).std())
+        return FrameAnalysis(mv, mv / CalculationConstants.CURSOR_TO_MV_FACTOR, sd, mode)
+
+    def _get_roi_stack(self, frames):
+        x1, x2 = CalculationConstants.ROI_COORDINATES_X1, CalculationConstants.ROI_COORDINATES_X2
+        y1, y2 = CalculationConstants.ROI_COORDINATES_Y1, CalculationConstants.ROI_COORDINATES_Y2
+        if isinstance(frames, np.ndarray):
+            if frames.ndim != 4 or frames.shape[3] < 3:
+                self._fail(self.IMAGE_LOAD_ERROR)
+            if frames.shape[2] < x2 or frames.shape[1] < y2:
+                self._fail(self.INVALID_PARAMETER_ERROR)
+            return frames[:, y1:y2, x1:x2, :3]
+        return np.stack([self._get_roi(frame, x1, x2, y1, y2) for frame in frames])
+
+    def _window_row_counts(self, pixels, columns, half_width, shape):
+        """
+        Returns the number of trace pixels in every row of the half_width
+        columns left and right of the trace column of every frame (N x H),
+        the stacked equivalent of _rows_around_column.
+
+        Args:
+        pixels (tuple): The frame, row and column indices of the trace pixels.
+        columns (numpy.ndarray): The trace column of every frame.
+        shape (tuple): The shape (N, H, W) of the stacked mask.
+        """
+        frame_count, height, _ = shape
+        frames, rows, pixel_columns = pixels
+        lows = np.maximum(columns - half_width, 0)[frames]
+        highs = np.maximum(columns + half_width, 0)[frames]
+        inside = (pixel_columns >= lows) & (pixel_columns < highs)
+        counts = np.bincount(
+            frames[inside] * height + rows[inside], minlength=frame_count * height
+        ).reshape(frame_count, height)
+        if (counts.sum(axis=1) == 0).any():
+            self._fail(self.NO_CYAN_PIXEL_ERROR)
+        return counts
+
+    def analyze_stack(self, frames, mode, flat_pixel_count):
+        """
+        Returns the StackAnalysis of the frames of one sample. The frames are
+        an N x H x W x 3 BGR array or a list of images (see load_image). The
+        ROIs are stacked and thresholded, and the trace column, level and
+        standard deviation of every frame are found in one pass over the
+        stack, with the same results as analyze_frame on every frame.
+        """
+        self._check_calculation_type(mode)
+        flat_pixel_count = self._check_flat_pixel_count(flat_pixel_count)
+        roi = self._get_roi_stack(frames)
+        if roi.shape[0] == 0:
+            self._fail(self.INVALID_PARAMETER_ERROR)
+        mask = self.cyan_mask(roi)
+        frame_count, height, width = mask.shape
+        # the trace is a thin line, everything after the thresholding works on
+        # the coordinates of its pixels
+        pixels = np.unravel_index(np.flatnonzero(mask), mask.shape)
+        frames, rows, pixel_columns = pixels
+
+        # the median column of the cyan pixels in the top TOP_ROW_COUNT rows
+        row_has_trace = (
+            np.bincount(frames * height + rows, minlength=frame_count * height).reshape(
+                frame_count, height
+            )
+            > 0
+        )
+        if (row_has_trace.sum(axis=1) < self.TOP_ROW_COUNT).any():
+            self._fail(self.NO_CYAN_PIXEL_ERROR)
+        top_rows = row_has_trace & (np.cumsum(row_has_trace, axis=1) <= self.TOP_ROW_COUNT)
+        in_top_rows = top_rows[frames, rows]
+        # sorted by frame, then column
+        keys = np.sort(frames[in_top_rows] * width + pixel_columns[in_top_rows])
+        counts = np.bincount(frames[in_top_rows], minlength=frame_count)
+        starts = np.cumsum(counts) - counts
+        columns = keys[starts + counts // 2] - np.arange(frame_count) * width
+
+        row_numbers = np.arange(height)
+        level_counts = self._window_row_counts(
+            pixels, columns, self.MV_COLUMN_HALF_WIDTH, mask.shape
+        )
+        if mode == CalculationConstants.SAT_MODE:
+            rows = np.argmax(level_counts > 0, axis=1).astype(float)
+        else:
+            rows = (level_counts @ row_numbers) / level_counts.sum(axis=1)
+
+        flat_counts = self._window_row_counts(
+            pixels, columns, flat_pixel_count // 2, mask.shape
+        )
+        totals = flat_counts.sum(axis=1)
+        means = (flat_counts @ row_numbers) / totals
+        deviations = (row_numbers[None, :] - means[:, None]) ** 2
+        sds = np.sqrt((flat_counts * deviations).sum(axis=1) / totals)
+
+        mvs = self._cursors_to_mvs(
+            self._row_to_cursor(
+                rows,
+                CalculationConstants.ROI_COORDINATES_Y1,
+                CalculationConstants.ROI_COORDINATES_Y2,
+            )
+        )
+        cursors = mvs / CalculationConstants.CURSOR_TO_MV_FACTOR
+        analyses = [
+            FrameAnalysis(mv, cursor, sd, mode)
+            for mv, cursor, sd in zip(mvs.tolist(), cursors.tolist(), sds.tolist())
+        ]
+        # the same statistics as summarize_analyses, over the arrays
+        return StackAnalysis(
+            analyses,
+            round(float(mvs.mean()), 1),
+            float(np.median(mvs)),
+            float(mvs.max()),
+            float(sds.max()),
+            float(sds.mean()),
+            float(np.median(sds)),
+            mode,
+        )
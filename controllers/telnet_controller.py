@@ -2,9 +2,149 @@ import asyncio
 from typing import Optional
 import telnetlib3
 from Constants import TelnetConstants
+from controllers.command_scheduler import CommandScheduler
 import logging
 
 
+class TelnetBatchError(Exception):
+    """
+    Raised when one command of a pipelined batch fails.
+
+    Attributes:
+        index (int): The position of the failing command in the batch.
+        command (str): The failing command.
+        responses (list): The responses received before the failure.
+    """
+
+    def __init__(self, index, command, error, responses):
+        super().__init__(f"Error while sending command {command!r}: {str(error)}")
+        self.index = index
+        self.command = command
+        self.error = error
+        self.responses = responses
+
+
+# the instrument settings the shadow keeps, by command head
+SHADOWED_SETTINGS = {
+    "WFM:LINE_SELECT",
+    "WFM:LINE_NUMBER",
+    "WFM:MATRIX:YCBCR",
+    "WFM:MODE:RGB:R",
+    "WFM:MODE:RGB:G",
+    "WFM:MODE:RGB:B",
+    "WFM:CURSOR",
+    "WFM:CURSOR:REF",
+    "WFM:CURSOR:DELTA",
+    "WFM:CURSOR:UNIT:X",
+    "WFM:CURSOR:UNIT:Y",
+    "WFM:CURSOR:VALUE",
+    "WFM:SCALE:INTEN",
+    "SYS:LCD:BACKLIGHT",
+}
+# commands after which the instrument settings are unknown
+INVALIDATING_COMMANDS = {"SYS:INITIALIZE:ALL", "RCLL", "INPUT_CHANGE"}
+
+
+class InstrumentShadow:
+    """
+    The instrument settings last written through a TelnetController, so that
+    a write setting a value the instrument already has can be skipped.
+
+    The shadow only knows what was written through it: it is cleared on
+    connect and by the commands that reset or recall the settings
+    (INVALIDATING_COMMANDS), and a setting whose write failed is forgotten.
+    Call invalidate() after the settings were changed any other way, e.g. on
+    the front panel.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.stats = {"writes": 0, "suppressed": 0, "invalidations": 0}
+
+    @staticmethod
+    def parse(command):
+        """
+        Returns the head and the argument of command.
+        """
+        head, _, argument = command.strip().partition(" ")
+        return head.upper(), argument.strip()
+
+    def is_redundant(self, command, values=None):
+        """
+        Returns True if command sets a shadowed setting to the value it has.
+        """
+        head, argument = self.parse(command)
+        values = self.values if values is None else values
+        return (
+            head in SHADOWED_SETTINGS
+            and argument not in ("", "?")
+            and values.get(head) == argument
+        )
+
+    def apply(self, command, values=None):
+        """
+        Updates the shadow for command, written successfully.
+        """
+        head, argument = self.parse(command)
+        values = self.values if values is None else values
+        if head in INVALIDATING_COMMANDS:
+            values.clear()
+        elif head in SHADOWED_SETTINGS and argument not in ("", "?"):
+            values[head] = argument
+
+    def forget(self, command):
+        """
+        Forgets the setting of command, whose write failed.
+        """
+        head, _ = self.parse(command)
+        if head in INVALIDATING_COMMANDS:
+            self.values.clear()
+        self.values.pop(head, None)
+
+    def invalidate(self):
+        self.values.clear()
+        self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        total = stats["writes"] + stats["suppressed"]
+        stats["suppressed_ratio"] = round(stats["suppressed"] / total, 3) if total else 0.0
+        return stats
+
+
+class TelnetPipeline:
+    """
+    Collects commands and sends them to the Telnet server as a single batch.
+
+    Usage:
+        async with telnet_client.pipeline() as pipe:
+            pipe.add(command_1)
+            pipe.add(command_2)
+        responses = pipe.responses
+    """
+
+    def __init__(self, telnet_client):
+        self.telnet_client = telnet_client
+        self.commands = []
+        self.responses = []
+
+    def add(self, command):
+        self.commands.append(command)
+        return self
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        self.responses = await self.telnet_client.send_batch(commands)
+        return self.responses
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None and self.commands:
+            await self.execute()
+
+
 class TelnetController:
     """
     A class that handles Telnet connections and commands.
@@ -18,9 +158,13 @@ class TelnetController:
         writer (Optional[telnetlib3.StreamWriter]): The Telnet writer object.
         end_string (bytes): The string that marks the end of a Telnet response.
         connection_timeout (float): The maximum time to wait for a Telnet connection.
+        shadow (Optional[InstrumentShadow]): The settings last written, None
+            if every write is sent.
+        scheduler (Optional[CommandScheduler]): Serializes the commands of
+            concurrent callers, None if the caller does.
     """
 
-    def __init__(self, host, port, username, password):
+    def __init__(self, host, port, username, password, shadow=True, scheduled=True):
         self.host = host
         self.port = port
         self.username = username
@@ -29,6 +173,8 @@ class TelnetController:
         self.writer = None
         self.end_string = TelnetConstants.TELNET_END_STRING
         self.connection_timeout = TelnetConstants.TELNET_CONNECTION_TIMEOUT
+        self.shadow = InstrumentShadow() if shadow else None
+        self.scheduler = CommandScheduler(self._exchange) if scheduled else None
 
     async def login(self):
         """
@@ -52,6 +198,8 @@ class TelnetController:
         Connects to the Telnet server using the provided host and port.
         If the connection times out, raises a ConnectionError.
         """
+        # the settings may have changed while disconnected
+        self.invalidate_shadow()
         try:
             self.reader, self.writer = await asyncio.wait_for(
                 telnetlib3.open_connection(self.host, self.port),
@@ -62,15 +210,37 @@ class TelnetController:
         except Exception as e:
             raise Exception(f"Error while connecting to telnet: {str(e)}")
 
-    async def send_command(self, command):
+    async def send_command(
+        self, command, priority=TelnetConstants.PRIORITY_NORMAL, timeout=None
+    ):
         """
         Sends a command to the Telnet server and returns the response.
+        With a scheduler the command waits for its turn by priority, see
+        CommandScheduler.submit for priority and timeout.
+        A write the shadow knows to be redundant is not sent, its response is
+        the bare end_string.
         If the writer or reader is None, raises a ConnectionError.
         If the command times out, raises a TimeoutError.
         """
+        if self.scheduler is None:
+            return await self._send_command_now(command)
+        responses = await self.scheduler.submit([command], False, priority, timeout)
+        return responses[0]
+
+    async def _exchange(self, commands, batch):
+        if batch:
+            return await self._send_batch_now(commands)
+        return [await self._send_command_now(commands[0])]
+
+    async def _send_command_now(self, command):
         if self.writer is None or self.reader is None:
             raise ConnectionError("Error sending command: writer or reader is None")
 
+        if self.shadow is not None and self.shadow.is_redundant(command):
+            self.shadow.stats["suppressed"] += 1
+            logging.debug(f"Skipped redundant command {command}")
+            return self.end_string
+
         response = None
         try:
             self.writer.write(command + "\r\n")
@@ -78,15 +248,137 @@ class TelnetController:
                 self.reader.readuntil(self.end_string), timeout=self.connection_timeout
             )
         except Exception as e:
+            if self.shadow is not None:
+                self.shadow.forget(command)
             raise Exception(f"Error while sending command: {str(e)}")
 
+        self._update_shadow(command, response)
         return response
 
+    def _update_shadow(self, command, response):
+        if self.shadow is None:
+            return
+        self.shadow.stats["writes"] += 1
+        text = response.decode("latin-1") if isinstance(response, bytes) else str(response)
+        if "ERROR" in text.upper():
+            self.shadow.forget(command)
+        else:
+            self.shadow.apply(command)
+
+    def invalidate_shadow(self):
+        """
+        Forgets the instrument settings, so the next writes are all sent.
+        """
+        if self.shadow is not None:
+            self.shadow.invalidate()
+
+    def get_shadow_stats(self):
+        """
+        Returns how many writes were sent and how many were suppressed as redundant.
+        """
+        return self.shadow.get_stats() if self.shadow is not None else {}
+
+    async def send_batch(
+        self, commands, priority=TelnetConstants.PRIORITY_NORMAL, timeout=None
+    ):
+        """
+        Sends a sequence of commands in a single write and returns their responses.
+        The responses are matched back to the commands in order, since the server
+        answers every command with exactly one end_string terminated response.
+        Writes the shadow knows to be redundant, given the commands before them,
+        are not sent, their response is the bare end_string.
+        If the writer or reader is None, raises a ConnectionError.
+        If a command fails or times out, raises a TelnetBatchError for that command.
+        With a scheduler the batch waits for its turn as a whole.
+        """
+        commands = list(commands)
+        if self.scheduler is None or not commands:
+            return await self._send_batch_now(commands)
+        return await self.scheduler.submit(commands, True, priority, timeout)
+
+    async def _send_batch_now(self, commands):
+        if self.writer is None or self.reader is None:
+            raise ConnectionError("Error sending command: writer or reader is None")
+
+        commands = list(commands)
+        responses = []
+        if not commands:
+            return responses
+
+        suppressed = set()
+        if self.shadow is not None:
+            # what the settings will be once the earlier commands are applied
+            values = dict(self.shadow.values)
+            for index, command in enumerate(commands):
+                if self.shadow.is_redundant(command, values):
+                    suppressed.add(index)
+                else:
+                    self.shadow.apply(command, values)
+            self.shadow.stats["suppressed"] += len(suppressed)
+        sent = [command for index, command in enumerate(commands) if index not in suppressed]
+
+        if sent:
+            try:
+                self.writer.write("".join(command + "\r\n" for command in sent))
+            except Exception as e:
+                if self.shadow is not None:
+                    self.shadow.invalidate()
+                raise TelnetBatchError(0, commands[0], e, responses)
+
+        for index, command in enumerate(commands):
+            if index in suppressed:
+                responses.append(self.end_string)
+                continue
+            try:
+                response = await asyncio.wait_for(
+                    self.reader.readuntil(self.end_string),
+                    timeout=self.connection_timeout,
+                )
+            except Exception as e:
+                if self.shadow is not None:
+                    # the rest of the batch may or may not have been applied
+                    self.shadow.invalidate()
+                raise TelnetBatchError(index, command, e, responses)
+            self._update_shadow(command, response)
+            responses.append(response)
+
+        return responses
+
+    def pipeline(self):
+        """
+        Returns a TelnetPipeline that sends its commands with send_batch.
+        """
+        return TelnetPipeline(self)
+
+    def get_scheduler_stats(self):
+        """
+        Returns the queue depth and wait time statistics of the scheduler.
+        """
+        return self.scheduler.get_stats() if self.scheduler is not None else {}
+
+    async def abort(self, commands=()):
+        """
+        Fails the commands still waiting for their turn with
+        CommandAbortedError and sends commands, e.g. restoring the instrument
+        on terminate, as a batch at TelnetConstants.PRIORITY_ABORT, right
+        after the exchange in progress. Returns their responses.
+        If a command fails or times out, raises a TelnetBatchError for that command.
+        """
+        if self.scheduler is not None:
+            self.scheduler.abort()
+        commands = list(commands)
+        if not commands:
+            return []
+        return await self.send_batch(commands, TelnetConstants.PRIORITY_ABORT)
+
     async def close(self):
         """
-        Closes the Telnet connection.
+        Closes the Telnet connection. The commands still waiting for their
+        turn are aborted first.
         If the writer is None, raises a ConnectionError.
         """
+        if self.scheduler is not None:
+            await self.scheduler.stop()
         try:
             if self.writer is not None:
                 self.writer.close()
@@ -1,9 +1,82 @@
 from ctypes import c_char_p, c_int, c_float, cdll
+from dataclasses import dataclass
 import logging
+import statistics
 
 from Constants import CalculationConstants
 
 
+@dataclass
+class FrameAnalysis:
+    """
+    The result of analyzing one captured frame.
+
+    Attributes:
+    mv (float): The waveform level in mV, rounded to 1 decimal place.
+    cursor (float): The cursor level matching mv.
+    sd (float): The standard deviation of the trace around its centre column.
+    mode (int): The calculation type used (SAT_MODE or NOISE_MODE).
+    """
+
+    mv: float
+    cursor: float
+    sd: float
+    mode: int
+
+
+@dataclass
+class StackAnalysis:
+    """
+    The result of analyzing the frames of one multi-frame sample.
+
+    Attributes:
+    frames (list): The FrameAnalysis of every frame, in order.
+    mv (float): The mean waveform level in mV, rounded to 1 decimal place.
+    mv_median (float): The median waveform level in mV.
+    mv_max (float): The highest waveform level in mV.
+    sd (float): The highest standard deviation, what the flatness check uses.
+    sd_mean (float): The mean standard deviation.
+    sd_median (float): The median standard deviation.
+    mode (int): The calculation type used (SAT_MODE or NOISE_MODE).
+    """
+
+    frames: list
+    mv: float
+    mv_median: float
+    mv_max: float
+    sd: float
+    sd_mean: float
+    sd_median: float
+    mode: int
+
+    @property
+    def cursor(self):
+        return self.mv / CalculationConstants.CURSOR_TO_MV_FACTOR
+
+
+def summarize_analyses(analyses):
+    """
+    Returns the StackAnalysis of the FrameAnalyses of one sample, averaged the
+    way the GUI always did: the mean mV rounded to 1 decimal place and the
+    highest standard deviation.
+    """
+    analyses = list(analyses)
+    if not analyses:
+        raise ValueError("No frame analysis to summarize")
+    mvs = [analysis.mv for analysis in analyses]
+    sds = [analysis.sd for analysis in analyses]
+    return StackAnalysis(
+        analyses,
+        round(sum(mvs) / len(mvs), 1),
+        statistics.median(mvs),
+        max(mvs),
+        max(sds),
+        sum(sds) / len(sds),
+        statistics.median(sds),
+        analyses[0].mode,
+    )
+
+
 class WaveformImageAnalysisController:
     DLL_error_code = {
         -100: "Unknown error",
@@ -11,6 +84,8 @@ class WaveformImageAnalysisController:
         -102: "No cyan pixel found",
         -103: "Invalid parameter",
     }
+    # the DLL reads every image from disk
+    requires_file = True
 
     def __init__(self):
         self.myDLL = cdll.LoadLibrary("lib\\WaveformImageAnalysisLib.dll")
@@ -120,6 +195,32 @@ class WaveformImageAnalysisController:
 
         return mv, cursor
 
+    def analyze_frame(self, image_path, mode, flat_pixel_count):
+        """
+        Returns the FrameAnalysis of one frame.
+        The DLL loads the image on every call, so this still decodes it twice.
+        """
+        mv, cursor = self.compute_mv_cursor(image_path, mode)
+        sd = self.get_current_stdev(
+            image_path,
+            flat_pixel_count,
+            CalculationConstants.ROI_COORDINATES_X1,
+            CalculationConstants.ROI_COORDINATES_X2,
+            CalculationConstants.ROI_COORDINATES_Y1,
+            CalculationConstants.ROI_COORDINATES_Y2,
+            mode,
+        )
+        return FrameAnalysis(mv, cursor, sd, mode)
+
+    def analyze_stack(self, frames, mode, flat_pixel_count):
+        """
+        Returns the StackAnalysis of the frames (image paths). The DLL analyzes
+        one image per call, so this is analyze_frame on every frame.
+        """
+        return summarize_analyses(
+            self.analyze_frame(frame, mode, flat_pixel_count) for frame in frames
+        )
+
     def get_current_stdev(
             self,
             image_path,
@@ -141,4 +242,30 @@ class WaveformImageAnalysisController:
         )
         self._check_error(result)
         # make sure the result is round to 1 decimal place
-        return result
\ No newline at end of file
+        return result
+
+
+def create_waveform_image_analysis_controller(backend="dll"):
+    """
+    Creates the waveform image analysis engine selected by backend.
+
+    Args:
+    backend (str): "dll" for WaveformImageAnalysisLib.dll or "numpy" for the
+        pure NumPy engine. If the DLL cannot be loaded (e.g. not on Windows),
+        the NumPy engine is used instead.
+    """
+    if backend == "dll":
+        try:
+            return WaveformImageAnalysisController()
+        except Exception as e:
+            logging.warning(
+                f"Could not load waveform image analysis DLL, falling back to NumPy engine: {str(e)}"
+            )
+    elif backend != "numpy":
+        raise ValueError("Invalid analysis backend. Backend must be dll or numpy.")
+
+    from controllers.numpy_waveform_image_analysis_controller import (
+        NumpyWaveformImageAnalysisController,
+    )
+
+    return NumpyWaveformImageAnalysisController()
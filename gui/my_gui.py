@@ -1,7 +1,11 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+import inspect
 import logging
 import os
 import time
+import numpy as np
 from PyQt5.QtWidgets import (
     QMainWindow,
     QMessageBox,
@@ -13,16 +17,27 @@ from PyQt5.QtWidgets import (
 
 
 from PyQt5 import QtCore, uic
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtGui import QImage, QPixmap
 from qasync import asyncSlot
-from Constants import CalculationConstants, FTPConstants
+from Constants import (
+    CalculationConstants,
+    DebugConsoleConstants,
+    FTPConstants,
+    LightSearchConstants,
+    TelnetConstants,
+)
 from config.application_config import AppConfig
+from controllers.analysis_cache import AnalysisCache
+from controllers.analysis_executor import create_analysis_executor
 from controllers.debug_console_controller import DebugConsoleController
+from controllers.input_backend import create_input_backend
+from controllers.async_ftp_controller import AsyncFTPController
 from controllers.ftp_controller import FTPController
-from controllers.ftp_session_controller import FTPSession
+from controllers.ftp_session_controller import AsyncFTPSession, FTPSession
 from controllers.telnet_controller import TelnetController
 from controllers.waveform_image_analysis_controller import (
-    WaveformImageAnalysisController,
+    create_waveform_image_analysis_controller,
+    summarize_analyses,
 )
 from gui.about_dialog import AboutDialog
 from gui.ftp_settings_dialog import FTPSettingsDialog
@@ -33,8 +48,22 @@ from gui.target_tolerance_dialog import TargetToleranceDialog
 from gui.telnet_settings_dialog import TelnetSettingsDialog
 
 from tasks.connection_tasks import ConnectionTask
-from tasks.lv5600_tasks import LV5600Tasks
-from utils.decorators import time_it_async, time_it_sync
+from tasks.calibration_tasks import LightCalibrationCache
+from tasks.light_search_tasks import (
+    CallbackMeasurement,
+    DebugConsoleActuator,
+    LevelMeasurement,
+    STRATEGIES,
+    LightLevelSearch,
+    ModelBasedStrategy,
+    QueryMeasurement,
+    SettleDetector,
+    SearchEvents,
+    SequentialSampler,
+)
+from tasks.lv5600_tasks import CapturePipeline, LV5600Tasks
+from utils.bmp_utils import decode_bmp
+from utils.decorators import time_it_async
 
 
 class LoginWindow(QMainWindow):
@@ -84,6 +113,12 @@ class MainWindow(QMainWindow):
         self.setupLogging()
         self.setupEvents()
 
+    def getCalibrationFilePath(self):
+        return os.path.join(
+            self.app_config_handler.get_local_file_path(),
+            LightSearchConstants.CALIBRATION_FILE_NAME,
+        )
+
     def getLocalFilePath(self):
         local_file_path = os.path.join(
             self.app_config_handler.get_local_file_path(),
@@ -130,17 +165,72 @@ class MainWindow(QMainWindow):
             self.app_config_handler.get_telnet_password(),
         )
 
-        self.ftp_client = FTPController(
+        self.setupFTPSession()
+        self.capture_buffer = bytearray(FTPConstants.BMP_FILE_SIZE)
+        self.current_frame = None
+        self.current_sample_count = 0
+
+        
+        self.wfm_image_analysis_controller = create_waveform_image_analysis_controller(
+            self.app_config_handler.get_analysis_backend()
+        )
+        # the NumPy engine analyzes in worker processes, the DLL reads files in this one
+        self.analysis_executor = None
+        if not self.wfm_image_analysis_controller.requires_file:
+            self.analysis_executor = create_analysis_executor(
+                self.app_config_handler.get_analysis_workers()
+            )
+        # results of frames already analyzed, e.g. when the screen did not change
+        self.analysis_cache = AnalysisCache(
+            enabled=self.app_config_handler.get_analysis_cache()
+        )
+
+        self.debug_console_controller = DebugConsoleController(
+            create_input_backend(self.app_config_handler.get_input_backend())
+        )
+        # one worker, so the debug console scripts of concurrent slots run one
+        # after another instead of interleaving their key presses
+        self.debug_console_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="debug_console"
+        )
+        self.light_search = None
+        # whether the instrument answers the level query is found out on first use
+        self.query_measurement = QueryMeasurement(
+            lambda: LV5600Tasks.query_level(self.telnet_client)
+        )
+        # waits for the waveform after light source changes, sampling with
+        # single captures or level queries, see useSettleMeasurement
+        self.settle_capture_measurement = CallbackMeasurement(self.measureForLightLevelSearch)
+        self.settle_query_measurement = QueryMeasurement(
+            lambda: LV5600Tasks.query_level(
+                self.telnet_client, TelnetConstants.PRIORITY_LOW
+            ),
+            self.settle_capture_measurement,
+        )
+        self.settle_detector = SettleDetector(self.settle_capture_measurement)
+        # the OCB settings last delivered, unknown until delivered
+        self.agc_setting = None
+        self.mask_mode = None
+
+
+    def setupFTPSession(self):
+        # the asyncio transport keeps the event loop responsive during downloads
+        if self.app_config_handler.get_ftp_transport() == "async":
+            ftp_controller_class, ftp_session_class = AsyncFTPController, AsyncFTPSession
+        else:
+            ftp_controller_class, ftp_session_class = FTPController, FTPSession
+        self.ftp_client = ftp_controller_class(
             self.app_config_handler.get_ftp_address(),
             self.app_config_handler.get_ftp_username(),
             self.app_config_handler.get_ftp_password(),
+            self.app_config_handler.get_ftp_port(),
         )
+        self.ftp_session = ftp_session_class(self.ftp_client)
 
-        
-        self.wfm_image_analysis_controller = WaveformImageAnalysisController()
-
-        self.debug_console_controller = DebugConsoleController()
-
+    def closeFTPSession(self):
+        result = self.ftp_session.close()
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(result)
 
     def setupLogging(self):
         self.log_handler = LogHandler(self.textBrowser_console)
@@ -169,13 +259,25 @@ class MainWindow(QMainWindow):
 
         if reply == QMessageBox.Yes:
             self.telnet_client.close()
-            self.ftp_client.close()
+            self.closeFTPSession()
+            if self.analysis_executor is not None:
+                self.analysis_executor.close()
+            self.debug_console_executor.shutdown(wait=False, cancel_futures=True)
             event.accept()
         else:
             event.ignore()
 
-    def display_image(self, local_file_path):
-        pixmap = QPixmap(local_file_path)
+    def display_image(self, image):
+        # image is either a file path or an H x W x 3 BGR frame
+        if isinstance(image, np.ndarray):
+            image = np.ascontiguousarray(image)
+            height, width = image.shape[:2]
+            qimage = QImage(
+                image.data, width, height, image.strides[0], QImage.Format_BGR888
+            )
+            pixmap = QPixmap.fromImage(qimage)
+        else:
+            pixmap = QPixmap(image)
         new_size = self.graphicsView.size()
         pixmap = pixmap.scaled(new_size, QtCore.Qt.KeepAspectRatio)
 
@@ -233,13 +335,18 @@ class MainWindow(QMainWindow):
     @asyncSlot()
     async def terminate(self):
         logging.warning("You have clicked the terminate button")
+        if self.telnet_client.writer is not None:
+            # drop the commands still waiting and show the scale and cursor a
+            # capture may have hidden, ahead of anything queued meanwhile
+            await LV5600Tasks.abort(self.telnet_client)
         await self.telnet_client.close()
-        try:
-            self.ftp_client.close()
-        except Exception as e:
-            logging.error(f"Error while closing FTP connection: {str(e)}")
+        result = self.ftp_session.close()
+        if inspect.isawaitable(result):
+            await result
 
         self.debug_console_controller.stop_tasks()
+        if self.analysis_executor is not None:
+            self.analysis_executor.cancel_all()
         self.label_establish_connection.setText(
             "Telnet Disconnected at: " + time.strftime("%H:%M:%S", time.localtime())
         )
@@ -256,6 +363,12 @@ class MainWindow(QMainWindow):
         except Exception as e:
             logging.error(f"Error while establishing connection: {str(e)}")
             return
+        # the instrument may have changed, ask the level query again
+        self.query_measurement.supported = None
+        self.settle_detector.supported = None
+        self.settle_query_measurement.supported = None
+        # the debug console may have been used by hand meanwhile
+        await self.runDebugConsole(self.debug_console_controller.forget_light_level)
 
         self.label_establish_connection.setText(
             "Telnet Connected at: " + time.strftime("%H:%M:%S", time.localtime())
@@ -292,11 +405,8 @@ class MainWindow(QMainWindow):
         self.ftp_settings_dialog = FTPSettingsDialog(self.app_config_handler)
         self.ftp_settings_dialog.exec_()
         # update ftp client
-        self.ftp_client = FTPController(
-            self.app_config_handler.get_ftp_address(),
-            self.app_config_handler.get_ftp_username(),
-            self.app_config_handler.get_ftp_password(),
-        )
+        self.closeFTPSession()
+        self.setupFTPSession()
 
     def editLocalFilePath(self):
         local_file_path = QFileDialog.getExistingDirectory(self, "Select Directory")
@@ -324,92 +434,247 @@ class MainWindow(QMainWindow):
                 logging.error(f"Error while sending line number: {str(e)}")
                 return
 
-    @time_it_sync
-    def deliverMaskMode(self, _=None):
+    async def runDebugConsole(self, method, *args):
+        # the key presses run in the debug console worker thread, so the event
+        # loop keeps running and no two scripts interleave
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.debug_console_executor, partial(method, *args)
+        )
+
+    def useSettleMeasurement(self):
+        # the level query is only sent where it is enabled, the settle samples
+        # are single captures otherwise
+        if self.app_config_handler.get_measurement_source() == "query":
+            self.settle_detector.measurement = self.settle_query_measurement
+        else:
+            self.settle_detector.measurement = self.settle_capture_measurement
+
+    async def waitForSettle(self, max_wait=None):
+        # wait until the waveform follows a light source change
+        if self.app_config_handler.get_settle_mode() == "detect":
+            self.useSettleMeasurement()
+            return await self.settle_detector.wait(
+                max_wait=max_wait, fallback_time=max_wait
+            )
+        settle_time = LightSearchConstants.SETTLE_TIME if max_wait is None else max_wait
+        await asyncio.sleep(settle_time)
+        return settle_time
+
+    @asyncSlot()
+    @time_it_async
+    async def deliverMaskMode(self, _=None):
         selected_mode = self.comboBox_mask_mode.currentText()
         logging.info(f"Selected Mask Mode: {selected_mode}")
+        # part of the light calibration key
+        self.mask_mode = selected_mode
         if selected_mode == "Mask On":
-            self.debug_console_controller.set_mask_mode("ON")
+            mode = "ON"
         elif selected_mode == "Mask Off":
-            self.debug_console_controller.set_mask_mode("OFF")
+            mode = "OFF"
         elif selected_mode == "Mask Cross":
-            self.debug_console_controller.set_mask_mode("CROSS")
+            mode = "CROSS"
+        else:
+            return
+        # the mask mode needs the initial setting delivered and applied first
+        await self.runDebugConsole(self.debug_console_controller.deliver_initial_setting)
+        settle_time = await self.waitForSettle(DebugConsoleConstants.INITIAL_SETTING_WAIT)
+        logging.info(f"Initial setting applied after {settle_time} s")
+        await self.runDebugConsole(
+            self.debug_console_controller.set_mask_mode, mode, False
+        )
 
-    @time_it_sync
-    def deliverAgcSetting(self, _=None):
+    @asyncSlot()
+    @time_it_async
+    async def deliverAgcSetting(self, _=None):
         selected_setting = self.comboBox_agc_setting.currentText()
         logging.info(f"Selected AGC Setting: {selected_setting}")
+        # part of the light calibration key
+        self.agc_setting = selected_setting
         if selected_setting == "WLI Mode":
-            self.debug_console_controller.set_AGC_mode("WLI")
+            mode = "WLI"
         elif selected_setting == "NBI Mode":
-            self.debug_console_controller.set_AGC_mode("NBI")
+            mode = "NBI"
         elif selected_setting == "RDI Mode":
-            self.debug_console_controller.set_AGC_mode("RDI")
+            mode = "RDI"
         elif selected_setting == "AGC On":
-            self.debug_console_controller.set_AGC_mode("ON")
+            mode = "ON"
         elif selected_setting == "AGC Off":
-            self.debug_console_controller.set_AGC_mode("OFF")
+            mode = "OFF"
+        else:
+            return
+        await self.runDebugConsole(self.debug_console_controller.set_AGC_mode, mode)
 
-    @time_it_sync
-    def deliverLightLevel(self, _=None):
+    @asyncSlot()
+    @time_it_async
+    async def deliverLightLevel(self, _=None):
         selected_light_level = self.spinBox_light_level.value()
         logging.info(f"Selected Light Level: {selected_light_level}")
-        self.debug_console_controller.set_light_level(selected_light_level)
+        await self.runDebugConsole(
+            self.debug_console_controller.set_light_level, selected_light_level
+        )
+
+    def getFrameSource(self):
+        # the DLL can only read images from disk, the NumPy engine uses the frame in memory
+        if self.wfm_image_analysis_controller.requires_file:
+            return self.getLocalFilePath()
+        return self.current_frame
 
     @asyncSlot()
-    async def capture_image_to_local(self):
-        with FTPSession(self.ftp_client) as ftp_client:
+    async def capture_frame(self, hide_scale_and_cursor=True):
+        """
+        Captures the LV5600 screen into the capture buffer and returns it as a
+        BGR frame. The frame is a view on the buffer and is only valid until
+        the next capture. It is written to the local file path only if captures
+        are archived or the analysis engine needs a file.
+        """
+        # release the previous frame so the buffer can grow if it has to
+        self.current_frame = None
+        if hide_scale_and_cursor:
             # turn off scale and cursor
             await LV5600Tasks.scale_and_cursor(self.telnet_client, False)
-            await LV5600Tasks.capture_n_send_bmp(
-                self.telnet_client, ftp_client, self.getLocalFilePath()
-            )
+        data = await LV5600Tasks.capture_n_fetch_bmp(
+            self.telnet_client, self.ftp_session, self.capture_buffer
+        )
+        if hide_scale_and_cursor:
             await LV5600Tasks.scale_and_cursor(self.telnet_client, True)
 
+        if (
+            self.app_config_handler.get_archive_captures()
+            or self.wfm_image_analysis_controller.requires_file
+        ):
+            with open(self.getLocalFilePath(), "wb") as file:
+                file.write(data)
+
+        self.current_frame = decode_bmp(data)
+        return self.current_frame
+
     @asyncSlot()
-    async def compute_average_mv_sd(self, mode, num_sample=3):
-        total_mv = 0
-        max_sd = 0
-        for i in range(num_sample):
-            await self.capture_image_to_local()
-            self.display_image(self.getLocalFilePath())
-            mv, cursor = self.wfm_image_analysis_controller.compute_mv_cursor(
-                self.getLocalFilePath(), mode
-            )
+    async def compute_average_mv_sd(self, mode, num_sample=None, display=True, stop=None):
+        # stop(analyses) -> bool ends the capturing early, see CapturePipeline.run
+        if num_sample is None:
+            num_sample = self.app_config_handler.get_max_average_count()
+        flat_pixel_count = self.app_config_handler.get_flatness_check_pixel()
+        archive_captures = self.app_config_handler.get_archive_captures()
+
+        def decode(data, slot):
+            if self.wfm_image_analysis_controller.requires_file:
+                # one file per capture buffer, so the next frame does not
+                # overwrite the one being analyzed
+                root, ext = os.path.splitext(self.getLocalFilePath())
+                file_path = f"{root}_{slot}{ext}"
+                with open(file_path, "wb") as file:
+                    file.write(data)
+                return file_path
+            if archive_captures:
+                with open(self.getLocalFilePath(), "wb") as file:
+                    file.write(data)
+            return decode_bmp(data)
+
+        # a fixed number of frames is analyzed in one pass over the stacked
+        # frames, early stopping needs every frame analyzed as it arrives
+        stacked = stop is None and not self.wfm_image_analysis_controller.requires_file
+        if stacked:
+
+            def analyze(frame):
+                # the pipeline reuses its buffers, keep a copy of the frame
+                return np.array(frame)
+
+        elif self.analysis_executor is not None:
+
+            async def analyze(frame):
+                return await self.analysis_executor.analyze(frame, mode, flat_pixel_count)
+
+        else:
+
+            def analyze(frame):
+                return self.wfm_image_analysis_controller.analyze_frame(
+                    frame, mode, flat_pixel_count
+                )
 
-            flat_pixel_count = self.app_config_handler.get_flatness_check_pixel()
-            sd = self.wfm_image_analysis_controller.get_current_stdev(
-                self.getLocalFilePath(),
-                flat_pixel_count,
-                CalculationConstants.ROI_COORDINATES_X1,
-                CalculationConstants.ROI_COORDINATES_X2,
-                CalculationConstants.ROI_COORDINATES_Y1,
-                CalculationConstants.ROI_COORDINATES_Y2,
-                mode,
+        def on_result(index, frame, analysis):
+            if display:
+                self.display_image(frame)
+            # the pipeline reuses its buffers, keep a copy of the last frame
+            self.current_frame = (
+                np.array(frame) if isinstance(frame, np.ndarray) else frame
             )
 
-            total_mv += mv
-            if sd > max_sd:
-                max_sd = sd
+        # capture the samples with the next capture overlapping the download
+        # and analysis of the previous one
+        await LV5600Tasks.scale_and_cursor(self.telnet_client, False)
+        pipeline = CapturePipeline(
+            self.telnet_client,
+            self.ftp_session,
+            analyze,
+            decode,
+            on_result,
+            cache=None if stacked else self.analysis_cache,
+            cache_context=(mode, flat_pixel_count),
+        )
+        try:
+            results = await pipeline.run(num_sample, stop)
+        finally:
+            await LV5600Tasks.scale_and_cursor(self.telnet_client, True)
 
-        res_mv = round(total_mv / num_sample, 1)
-        res_sd = max_sd
-        res_cursor = res_mv / CalculationConstants.CURSOR_TO_MV_FACTOR
+        if stacked:
+            loop = asyncio.get_running_loop()
+            summary = await loop.run_in_executor(
+                None,
+                partial(
+                    self.wfm_image_analysis_controller.analyze_stack,
+                    np.stack(results),
+                    mode,
+                    flat_pixel_count,
+                ),
+            )
+        else:
+            summary = summarize_analyses(results)
+        self.current_sample_count = len(results)
+        res_mv = summary.mv
+        res_sd = summary.sd
+        res_cursor = summary.cursor
 
-        logging.info(f"Average mV Value for current waveform: {res_mv} mV")
+        logging.info(
+            f"Average mV Value for current waveform: {res_mv} mV "
+            f"(median {summary.mv_median} mV, max {summary.mv_max} mV)"
+        )
         logging.info(f"Maximum Standard Deviation of mid pixels: {res_sd} ")
 
         return res_mv, res_cursor, res_sd
 
+    async def analyzeCurrentFrame(self, mode, use_cache=True):
+        # off the GUI thread, in a worker process if there are any
+        flat_pixel_count = self.app_config_handler.get_flatness_check_pixel()
+        if self.analysis_executor is not None:
+            compute = partial(
+                self.analysis_executor.analyze, self.current_frame, mode, flat_pixel_count
+            )
+        else:
+            compute = partial(
+                asyncio.get_running_loop().run_in_executor,
+                None,
+                partial(
+                    self.wfm_image_analysis_controller.analyze_frame,
+                    self.getFrameSource(),
+                    mode,
+                    flat_pixel_count,
+                ),
+            )
+        return await self.analysis_cache.analyze_async(
+            self.current_frame, mode, flat_pixel_count, compute, use_cache=use_cache
+        )
+
     @asyncSlot()
     @time_it_async
     async def capture_sat_value(self):
         logging.info("-------------------- Capturing Saturation --------------------")
-        self.debug_console_controller.set_light_level(200)
-        await self.capture_image_to_local()
-        mv, cursor = self.wfm_image_analysis_controller.compute_mv_cursor(
-            self.getLocalFilePath(), CalculationConstants.NOISE_MODE
-        ) #changed to noise mode
+        await self.runDebugConsole(self.debug_console_controller.set_light_level, 200)
+        settle_time = await self.waitForSettle()
+        logging.info(f"Waveform settled after {settle_time} s")
+        await self.capture_frame()
+        analysis = await self.analyzeCurrentFrame(CalculationConstants.NOISE_MODE) #changed to noise mode
+        mv, cursor = analysis.mv, analysis.cursor
 
         self.app_config_handler.set_target_saturation(mv)
         self.app_config_handler.save_config_to_file()
@@ -419,7 +684,7 @@ class MainWindow(QMainWindow):
 
         # display the image on the GUI
 
-        self.display_image(self.getLocalFilePath())
+        self.display_image(self.current_frame)
 
         logging.info(f"Saturation Value: {mv} mV")
         self.lcdNumber_sat_target_value.display(mv)
@@ -433,11 +698,23 @@ class MainWindow(QMainWindow):
     async def classifySat(self):
         # capture an image and classify it
         logging.info("-------------------- Classifying Saturation --------------------")
-        mv, cursor, sd = await self.compute_average_mv_sd(CalculationConstants.NOISE_MODE) # CHANGED TO NOISE MODE
-
         target = self.app_config_handler.get_target_saturation()
         tolerance = self.app_config_handler.get_target_tolerance()
         flat_sv_threshold = self.app_config_handler.get_flatness_check_sv_threshold()
+        # capture only until the classification is certain
+        sampler = SequentialSampler(self.app_config_handler.get_max_average_count())
+        mv, cursor, sd = await self.compute_average_mv_sd(
+            CalculationConstants.NOISE_MODE,
+            stop=lambda analyses: sampler.is_decided(
+                analyses,
+                (1 - tolerance) * target,
+                (1 + tolerance) * target,
+                flat_sv_threshold,
+            ),
+        ) # CHANGED TO NOISE MODE
+        logging.info(
+            f"Classified after {self.current_sample_count} of {sampler.max_samples} captures"
+        )
         class_ = self.wfm_image_analysis_controller.classify_waveform(
             mv,
             sd,
@@ -459,94 +736,132 @@ class MainWindow(QMainWindow):
         # turn on scale and cursor
         await LV5600Tasks.scale_and_cursor(self.telnet_client, True, cursor)
         # display the image on the GUI
-        await LV5600Tasks.capture_n_send_bmp(
-            self.telnet_client, self.ftp_client, self.getLocalFilePath()
-        )
-        self.display_image(self.getLocalFilePath())
+        await self.capture_frame(False)
+        self.display_image(self.current_frame)
         logging.info("Current waveform is: " + class_)
         logging.info(
             "-------------------- Saturation Value Classified --------------------"
         )
 
-    @asyncSlot()
-    @time_it_async
-    async def setSat(self):
-        await self.capture_sat_value()
-        logging.info("-------------------- Setting Saturation --------------------")
-        final_mv = 0
-
-        light_level_upper_bound = 256
-        light_level_lower_bound = 0
-        checked_light_levels = set()
-
-        target = self.app_config_handler.get_target_saturation()
-        tolerance = self.app_config_handler.get_target_tolerance()
-        flat_sv_threshold = self.app_config_handler.get_flatness_check_sv_threshold()
-
-        while light_level_lower_bound < light_level_upper_bound:
-            middle_light_level = (
-                light_level_upper_bound + light_level_lower_bound
-            ) // 2
-
-            if middle_light_level in checked_light_levels:
-                logging.info("Oscillation detected")
-                logging.info(
-                    f"Light Level {middle_light_level} has been checked before"
-                )
-                logging.info("Handing over to precision mode")
-                final_mv = await self.adjust_light_level_precisely(
-                    CalculationConstants.NOISE_MODE, middle_light_level, target
-                ) # CHANGED TO NOISE MODE
-                break
-
-            self.debug_console_controller.set_light_level(middle_light_level)
-            time.sleep(0.2)
-            logging.info(f"Current Light Level: {middle_light_level}")
-
-            # Using average mv computation when the difference is less than or equal to 4
-            if light_level_upper_bound - light_level_lower_bound <= 8:
-                mv, cursor, sd = await self.compute_average_mv_sd(
-                    CalculationConstants.NOISE_MODE
-                ) # CHANGED TO NOISE MODE
-            else:
-                await self.capture_image_to_local()
-                self.display_image(self.getLocalFilePath())
-                mv, cursor, sd = await self.compute_average_mv_sd(
-                    CalculationConstants.NOISE_MODE, 1
-                ) # CHANGED TO NOISE MODE
-
-            final_mv = mv
-            await LV5600Tasks.scale_and_cursor(self.telnet_client, True, cursor)
-            class_ = self.wfm_image_analysis_controller.classify_waveform(
-                mv,
-                sd,
-                target,
-                tolerance,
-                flat_sv_threshold,
-                CalculationConstants.NOISE_MODE,
-            ) # CHANGED TO SAT MODE
+    def createLightLevelSearch(self):
+        strategy_name = self.app_config_handler.get_search_strategy()
+        if strategy_name not in STRATEGIES:
+            logging.warning(f"Unknown search strategy {strategy_name}, using {ModelBasedStrategy.name}")
+            strategy_name = ModelBasedStrategy.name
+        capture_measurement = CallbackMeasurement(self.measureForLightLevelSearch)
+        if self.app_config_handler.get_measurement_source() == "query":
+            # read the level with a Telnet query, capturing only if the
+            # instrument cannot answer it
+            self.query_measurement.fallback = capture_measurement
+            measurement = self.query_measurement
+        else:
+            measurement = capture_measurement
+        self.useSettleMeasurement()
+        light_search = LightLevelSearch(
+            measurement,
+            DebugConsoleActuator(
+                self.debug_console_controller, self.debug_console_executor
+            ),
+            self.wfm_image_analysis_controller,
+            self.app_config_handler.get_target_tolerance(),
+            self.app_config_handler.get_flatness_check_sv_threshold(),
+            strategy=STRATEGIES[strategy_name](),
+            confirm=self.confirmLightLevelSearch,
+            sampler=SequentialSampler(self.app_config_handler.get_max_average_count()),
+            calibration=LightCalibrationCache(self.getCalibrationFilePath()),
+            settle=self.settle_detector
+            if self.app_config_handler.get_settle_mode() == "detect"
+            else None,
+        )
+        light_search.subscribe(self.onLightLevelSearchEvent)
+        return light_search
+
+    async def measureForLightLevelSearch(self, mode, num_sample, stop=None):
+        # frames are displayed once per probe by onLightLevelSearchEvent
+        mv, cursor, sd = await self.compute_average_mv_sd(mode, num_sample, False, stop)
+        return LevelMeasurement(mv, sd, self.current_frame, self.current_sample_count)
+
+    async def onLightLevelSearchEvent(self, event):
+        if event.kind == SearchEvents.MEASURED:
+            if event.measurement.frame is not None:
+                self.display_image(event.measurement.frame)
+            # put the cursor on the measured level
+            await LV5600Tasks.scale_and_cursor(
+                self.telnet_client,
+                True,
+                event.measurement.mv / CalculationConstants.CURSOR_TO_MV_FACTOR,
+            )
 
-            checked_light_levels.add(middle_light_level)
-            await LV5600Tasks.scale_and_cursor(self.telnet_client, True, cursor)
+    async def confirmLightLevelSearch(self, event):
+        await LV5600Tasks.scale_and_cursor(
+            self.telnet_client,
+            True,
+            self.light_search.target / CalculationConstants.CURSOR_TO_MV_FACTOR,
+        )
+        reply = QMessageBox.question(
+            self,
+            "Message",
+            event.message,
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No,
+        )
+        return reply == QMessageBox.Yes
 
-            if class_ == 0:  # over saturated
-                light_level_upper_bound = middle_light_level
-            elif class_ == 1:
-                light_level_lower_bound = middle_light_level
-            elif class_ == 2:
-                await self.capture_image_to_local()
-                self.display_image(self.getLocalFilePath())
-                break
+    async def runLightLevelSearch(self, target):
+        self.light_search = self.createLightLevelSearch()
+        calibration_key = LightCalibrationCache.make_key(
+            self.app_config_handler.get_calibration_scope(),
+            CalculationConstants.NOISE_MODE,
+            self.agc_setting,
+            self.mask_mode,
+            self.app_config_handler.get_line_number(),
+        )
+        result = await self.light_search.run(
+            target, CalculationConstants.NOISE_MODE, calibration_key
+        )
+        if result.warm_started:
+            logging.info(f"Light level search started from the stored light response {calibration_key}")
+        logging.info(f"Debug console statistics: {self.debug_console_controller.get_stats()}")
+        logging.info(
+            f"Waited {result.settle_seconds} s for the waveform to settle, {self.settle_detector.get_stats()}"
+        )
+        logging.info(f"Telnet write statistics: {self.telnet_client.get_shadow_stats()}")
+        logging.info(f"Telnet queue statistics: {self.telnet_client.get_scheduler_stats()}")
+        if self.analysis_executor is not None:
+            logging.info(f"Analysis executor statistics: {self.analysis_executor.get_stats()}")
+        logging.info(f"Analysis cache statistics: {self.analysis_cache.get_stats()}")
+        final_mv = result.mv if result.mv is not None else 0
 
         await LV5600Tasks.scale_and_cursor(
             self.telnet_client,
             True,
             final_mv / CalculationConstants.CURSOR_TO_MV_FACTOR,
         )
-        await LV5600Tasks.capture_n_send_bmp(
-            self.telnet_client, self.ftp_client, self.getLocalFilePath()
-        )
-        self.display_image(self.getLocalFilePath())
+        await self.capture_frame(False)
+        self.display_image(self.current_frame)
+        if self.light_search.measurement is self.query_measurement and self.query_measurement.supported:
+            await self.verifyQueriedLevel(final_mv)
+        return final_mv
+
+    async def verifyQueriedLevel(self, queried_mv):
+        # compare the queried level with the level in the display capture,
+        # analyzed afresh so a cached result cannot hide a wrong analysis
+        captured_mv = (
+            await self.analyzeCurrentFrame(CalculationConstants.NOISE_MODE, use_cache=False)
+        ).mv
+        difference = captured_mv - queried_mv
+        logging.info(f"Queried level {queried_mv} mV, captured level {captured_mv} mV")
+        if abs(difference) > self.app_config_handler.get_target_tolerance() * queried_mv:
+            logging.warning(
+                f"Queried level differs from the captured level by {round(difference, 2)} mV"
+            )
+
+    @asyncSlot()
+    @time_it_async
+    async def setSat(self):
+        await self.capture_sat_value()
+        logging.info("-------------------- Setting Saturation --------------------")
+        await self.runLightLevelSearch(self.app_config_handler.get_target_saturation())
         logging.info("-------------------- Saturation Value Set --------------------")
 
     @asyncSlot()
@@ -565,7 +880,7 @@ class MainWindow(QMainWindow):
         await LV5600Tasks.scale_and_cursor(self.telnet_client, True, cursor)
 
         # display the image on the GUI
-        self.display_image(self.getLocalFilePath())
+        self.display_image(self.current_frame)
 
         logging.info(f"N1 Value: {mv} mV")
         self.lcdNumber_n1value.display(mv)
@@ -578,70 +893,8 @@ class MainWindow(QMainWindow):
     @time_it_async
     async def setNoiseValue(self, offset):
         logging.info("-------------------- Setting Noise Value --------------------")
-
-        light_level_upper_bound = 256
-        light_level_lower_bound = 0
-        checked_light_levels = set()
-
         target = self.app_config_handler.get_target_noise() + offset
-        tolerance = self.app_config_handler.get_target_tolerance()
-        flat_sv_threshold = self.app_config_handler.get_flatness_check_sv_threshold()
-
-        final_mv = 0
-        while light_level_lower_bound < light_level_upper_bound:
-            middle_light_level = (
-                light_level_upper_bound + light_level_lower_bound
-            ) // 2
-
-            if middle_light_level in checked_light_levels:
-                logging.info("Oscillation detected")
-                logging.info(
-                    f"Light Level {middle_light_level} has been checked before"
-                )
-                logging.info("Handing over to precision mode")
-                final_mv = await self.adjust_light_level_precisely(
-                    CalculationConstants.NOISE_MODE, middle_light_level, target
-                )
-
-                break
-
-            self.debug_console_controller.set_light_level(middle_light_level)
-            time.sleep(0.2)
-            logging.info(f"Current Light Level: {middle_light_level}")
-
-            if light_level_upper_bound - light_level_lower_bound <= 8:
-                mv, cursor, sd = await self.compute_average_mv_sd(
-                    CalculationConstants.NOISE_MODE
-                )
-            else:
-                await self.capture_image_to_local()
-                self.display_image(self.getLocalFilePath())
-                mv, cursor, sd = await self.compute_average_mv_sd(
-                    CalculationConstants.NOISE_MODE, 1
-                )
-
-            final_mv = mv
-            await LV5600Tasks.scale_and_cursor(self.telnet_client, True, cursor)
-            class_ = self.wfm_image_analysis_controller.classify_waveform(
-                mv,
-                sd,
-                target,
-                tolerance,
-                flat_sv_threshold,
-                CalculationConstants.NOISE_MODE,
-            )
-
-            checked_light_levels.add(middle_light_level)
-            await LV5600Tasks.scale_and_cursor(self.telnet_client, True, cursor)
-
-            if class_ == 0:
-                light_level_upper_bound = middle_light_level
-            elif class_ == 1:
-                light_level_lower_bound = middle_light_level
-            elif class_ == 2:
-                await self.capture_image_to_local()
-                self.display_image(self.getLocalFilePath())
-                break
+        final_mv = await self.runLightLevelSearch(target)
 
         if offset > 0:
             self.lcdNumber_n1p20value.display(final_mv)
@@ -649,100 +902,4 @@ class MainWindow(QMainWindow):
             self.lcdNumber_n1m20value.display(final_mv)
         else:
             self.lcdNumber_n1value.display(final_mv)
-
-        await LV5600Tasks.scale_and_cursor(
-            self.telnet_client,
-            True,
-            final_mv / CalculationConstants.CURSOR_TO_MV_FACTOR,
-        )
-        await LV5600Tasks.capture_n_send_bmp(
-            self.telnet_client, self.ftp_client, self.getLocalFilePath()
-        )
-        self.display_image(self.getLocalFilePath())
         logging.info("-------------------- Noise Value Set --------------------")
-
-    @asyncSlot()
-    async def adjust_light_level_precisely(self, mode, current_light_level, target):
-        logging.debug("Adjusting light level precisely")
-        logging.debug("Target: " + str(target) + " mV")
-        logging.debug("Current Light Level: " + str(current_light_level))
-
-        checked_light_levels = set()
-        differences = {}
-
-        tolerance = self.app_config_handler.get_target_tolerance()
-        flat_pixel_count = self.app_config_handler.get_flatness_check_pixel()
-        flat_sv_threshold = self.app_config_handler.get_flatness_check_sv_threshold()
-
-        final_mv = 0
-
-        while True:
-            self.debug_console_controller.set_light_level(current_light_level)
-
-            # use averaging
-            mv, cursor, sd = await self.compute_average_mv_sd(mode)
-            difference_from_target = mv - target
-            differences[current_light_level] = difference_from_target
-            final_mv = mv
-
-            # if the current light level has been checked before
-            if current_light_level in checked_light_levels:
-                logging.info("Oscillation detected")
-                logging.info(
-                    f"Light Level {current_light_level} has been checked before"
-                )
-                # find the closest level to the target, should be absulute value
-                closest_level = min(
-                    differences.keys(), key=lambda x: abs(differences[x])
-                )
-                logging.info(f"Closest level: {closest_level}")
-                logging.info(f"Closest mV difference: {differences[closest_level]}")
-
-                current_light_level = closest_level
-                self.debug_console_controller.set_light_level(current_light_level)
-
-                # message for dialog box to whether increase or decrease the target distance
-                # need to check the difference is positive or negative
-                if differences[closest_level] < 0:
-                    message = f"Current light level is too low. The closest level is {closest_level}. The difference is {round(differences[closest_level],2)} mV. Move the scope closer to the target?"
-                    # turn on scale and cursor
-                else:
-                    message = f"Current light level is too high. The closest level is {closest_level}. The difference is {round(differences[closest_level],2)} mV. Move the scope further away from the target?"
-
-                await LV5600Tasks.scale_and_cursor(
-                    self.telnet_client,
-                    True,
-                    target / CalculationConstants.CURSOR_TO_MV_FACTOR,
-                )
-                # pop-up
-                reply = QMessageBox.question(
-                    self,
-                    "Message",
-                    message,
-                    QMessageBox.Yes | QMessageBox.No,
-                    QMessageBox.No,
-                )
-
-                if reply == QMessageBox.Yes:
-                    checked_light_levels.clear()
-                    differences.clear()
-                    continue
-                else:
-                    logging.info("User has chosen to stop the process")
-                    break
-
-            class_ = self.wfm_image_analysis_controller.classify_waveform(
-                mv, sd, target, tolerance, flat_sv_threshold, mode
-            )
-
-            # add the current light level to the checked set
-            checked_light_levels.add(current_light_level)
-
-            if class_ == 0:
-                current_light_level -= 1
-                logging.info(f"Current Light Level: {current_light_level}")
-            elif class_ == 1:
-                current_light_level += 1
-                logging.info(f"Current Light Level: {current_light_level}")
-            elif class_ == 2:
-                return final_mv
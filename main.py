@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import multiprocessing
 import os
 from PyQt5.QtWidgets import QApplication
 from qasync import QEventLoop
@@ -49,5 +50,7 @@ async def main():
         loop.run_forever()
 
 if __name__ == '__main__':
+    # the analysis worker processes start from the packaged executable too
+    multiprocessing.freeze_support()
     asyncio.run(main())
 
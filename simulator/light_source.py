@@ -0,0 +1,220 @@
+"""
+This module provides SimulatedLightSource, a stand-in for the OCB endoscope processor and its light source that DebugConsoleController drives through GUI automation. It offers the same methods as DebugConsoleController (set_light_level, set_AGC_mode, set_mask_mode, tune_to_target_level, ...), and its light output follows the settings with a nonlinear response, a fixed error per light level, flicker, a dead time, a settle time constant and hysteresis. Passed to LV5600Simulator, the output drives the level of the simulated waveform, so complete automation runs can be profiled without the bench.
+
+Usage:
+    light_source = SimulatedLightSource(LightSourceConfig(settle_time=0.05))
+    async with LV5600Simulator(config, light_source) as simulator:
+        light_source.set_light_level(120)
+"""
+from dataclasses import dataclass
+import math
+import time
+from typing import Optional
+
+import numpy as np
+
+from Constants import LightSearchConstants
+from controllers.debug_console_controller import DebugConsoleController
+
+# the light output relative to WLI of the AGC modes, OFF is white light without AGC
+AGC_MODE_GAINS = {"ON": 1.0, "OFF": 1.0, "WLI": 1.0, "NBI": 0.45, "RDI": 0.7}
+# the share of the scene left lit by the mask modes
+MASK_MODE_GAINS = {"OFF": 1.0, "ON": 0.85, "CROSS": 0.92}
+
+
+@dataclass
+class LightSourceConfig:
+    response_gamma: float = 1.15  # curvature of the light output over the light level setting
+    level_error: float = 0.01  # relative standard deviation of the fixed output error of every light level
+    flicker: float = 0.003  # relative standard deviation of the output from frame to frame
+    dead_time: float = 0.05  # seconds the output keeps its old level after a change
+    settle_time: float = 0.04  # time constant in seconds of the output after a change
+    hysteresis: float = 0.5  # light levels the output lags behind in the direction of the last change
+    latency: float = 0.0  # seconds a setting change takes, like the debug console automation
+    agc_mode: str = "OFF"
+    mask_mode: str = "OFF"
+    agc_target: float = 120.0  # the output the AGC pulls the picture towards
+    agc_strength: float = 0.6  # 0 for no compensation, 1 for a constant picture level
+    seed: Optional[int] = None
+
+
+class SimulatedLightSource:
+    """
+    A simulated OCB light source. output_level() is the light level equivalent
+    of the picture brightness at the time of the call, which
+    WaveformModel.signal_mv turns into the waveform level.
+
+    Attributes:
+    light_level (int): The delivered light level setting.
+    agc_mode (str): The delivered AGC mode.
+    mask_mode (str): The delivered mask mode.
+    """
+
+    def __init__(self, config=None, clock=time.monotonic):
+        """
+        Args:
+        config (LightSourceConfig): The response model, the defaults if None.
+        clock (callable): Returns the time in seconds, replaceable for simulated time.
+        """
+        self.config = config or LightSourceConfig()
+        self.clock = clock
+        self.rng = np.random.default_rng(self.config.seed)
+        self.level_errors = self.rng.normal(
+            0.0, self.config.level_error, LightSearchConstants.MAX_LIGHT_LEVEL + 1
+        )
+        self.light_level = 0
+        self.agc_mode = self.config.agc_mode
+        self.mask_mode = self.config.mask_mode
+        self.direction = 0  # the sign of the last light level change
+        self.changed_at = self.clock()
+        self.start_output = self.steady_output()
+        self.stats = {"light_changes": 0, "agc_changes": 0, "mask_changes": 0}
+
+    def steady_output(self):
+        """
+        Returns the output the current settings settle at, without flicker.
+        """
+        level = max(0.0, self.light_level - self.config.hysteresis * self.direction)
+        output = (
+            255
+            * (level / 255) ** self.config.response_gamma
+            * (1 + self.level_errors[self.light_level])
+        )
+        output *= AGC_MODE_GAINS[self.agc_mode] * MASK_MODE_GAINS[self.mask_mode]
+        if self.agc_mode != "OFF" and output > 0:
+            # the camera gain pulls the picture towards the AGC target
+            strength = self.config.agc_strength
+            output = self.config.agc_target**strength * output ** (1 - strength)
+        return output
+
+    def settled_output(self, now=None):
+        """
+        Returns the output at time now on its way from the output at the last
+        change to the steady output, without flicker. The output starts to
+        move dead_time after the change.
+        """
+        now = self.clock() if now is None else now
+        elapsed = now - self.changed_at - self.config.dead_time
+        if elapsed < 0:
+            return self.start_output
+        target = self.steady_output()
+        if self.config.settle_time <= 0:
+            return target
+        return target + (self.start_output - target) * math.exp(
+            -elapsed / self.config.settle_time
+        )
+
+    def output_level(self, now=None):
+        """
+        Returns the light output at time now, by default the current time, as
+        a light level equivalent.
+        """
+        output = self.settled_output(now) * (
+            1 + self.rng.normal(0.0, self.config.flicker)
+        )
+        return max(0.0, output)
+
+    def _change(self, apply):
+        if self.config.latency > 0:
+            time.sleep(self.config.latency)
+        now = self.clock()
+        # the output moves on from wherever the last change left it
+        self.start_output = self.settled_output(now)
+        apply()
+        self.changed_at = now
+
+    def activate(self):
+        return True
+
+    def set_light_level(self, target):
+        """
+        Sets the light level to the specified target value.
+
+        Args:
+        target (int): The target light level to set. Must be between 0 and 256.
+
+        Raises:
+        ValueError: If the target value is less than 0 or greater than 256.
+        """
+        if target > 256:
+            raise ValueError("Target light level cannot be greater than 256!")
+        elif target < 0:
+            raise ValueError("Target light level cannot be less than 0!")
+        if target == self.light_level:
+            return
+
+        def apply():
+            self.direction = 1 if target > self.light_level else -1
+            self.light_level = int(target)
+
+        self.stats["light_changes"] += 1
+        self._change(apply)
+
+    def tune_up_light(self):
+        self.set_light_level(min(self.light_level + 1, LightSearchConstants.MAX_LIGHT_LEVEL))
+
+    def tune_down_light(self):
+        self.set_light_level(max(self.light_level - 1, LightSearchConstants.MIN_LIGHT_LEVEL))
+
+    def tune_to_target_level(self, target_level, current_level):
+        """
+        Moves the light level by target_level - current_level steps from the
+        delivered light level, like the relative key presses of the debug
+        console, so a wrong current_level ends off the target.
+        """
+        target_level = max(0, min(255, target_level))
+        self.set_light_level(
+            max(
+                LightSearchConstants.MIN_LIGHT_LEVEL,
+                min(
+                    LightSearchConstants.MAX_LIGHT_LEVEL,
+                    self.light_level + target_level - current_level,
+                ),
+            )
+        )
+
+    def reset_light_level(self):
+        self.set_light_level(0)
+
+    def set_AGC_mode(self, mode):
+        """
+        Sets the AGC mode to the specified value.
+
+        Args:
+        mode (str): The mode to be set, can be ON, OFF, WLI, NBI, RDI
+        """
+        if mode not in DebugConsoleController.AGC_MODES:
+            raise ValueError("Invalid AGC mode!")
+
+        def apply():
+            self.agc_mode = mode
+
+        self.stats["agc_changes"] += 1
+        self._change(apply)
+
+    def deliver_initial_setting(self):
+        return True
+
+    def set_mask_mode(self, mode, deliver_initial_setting=True):
+        """
+        Set the mask mode to the specified value.
+        Args: CROSS, ON, OFF
+        """
+        if mode not in DebugConsoleController.MASK_MODES:
+            raise ValueError("Invalid Mask mode!")
+
+        def apply():
+            self.mask_mode = mode
+
+        self.stats["mask_changes"] += 1
+        self._change(apply)
+
+    def forget_light_level(self):
+        # the simulated light source always knows its light level
+        pass
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def stop_tasks(self):
+        pass
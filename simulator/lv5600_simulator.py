@@ -0,0 +1,619 @@
+"""
+This module provides LV5600Simulator, a local asyncio stand-in for the Leader LV5600 waveform monitor. It speaks the Telnet dialect TelnetController expects ("login: " and "Password: " prompts, every response terminated by "$"), accepts the commands built by commands/command_utils.py and serves a synthetic cap_bmp.bmp over FTP. The level of the waveform follows a simulated light level, and the round trip time, jitter and FTP bandwidth are configurable, so that capture and tuning performance can be measured on any machine. Given a SimulatedLightSource (simulator/light_source.py), the waveform follows its light output instead, with settling, hysteresis and the AGC and mask modes.
+
+Usage:
+    python -m simulator.lv5600_simulator --telnet-port 2323 --ftp-port 2121 --rtt 0.01 --bandwidth 12e6
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass, fields
+import logging
+import random
+import struct
+import time
+from typing import Optional
+
+import numpy as np
+
+from Constants import (
+    CalculationConstants,
+    FTPConstants,
+    LV5600Constants,
+    TelnetConstants,
+)
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from simulator.light_source import LightSourceConfig, SimulatedLightSource
+
+# Telnet option negotiation bytes
+IAC = 255
+SB = 250
+SE = 240
+WILL = 251
+WONT = 252
+DO = 253
+DONT = 254
+
+# the flatness check pixel count of the level query, the GUI default
+MEASURE_FLAT_PIXEL_COUNT = 100
+
+# the setting commands of commands/command_utils.py, answered from a settings table
+SETTING_COMMANDS = {
+    "WFM:LINE_SELECT",
+    "WFM:LINE_NUMBER",
+    "WFM:MATRIX:YCBCR",
+    "WFM:MODE:RGB:R",
+    "WFM:MODE:RGB:G",
+    "WFM:MODE:RGB:B",
+    "WFM:CURSOR",
+    "WFM:CURSOR:REF",
+    "WFM:CURSOR:DELTA",
+    "WFM:CURSOR:UNIT:X",
+    "WFM:CURSOR:UNIT:Y",
+    "WFM:CURSOR:VALUE",
+    "WFM:SCALE:INTEN",
+    "INPUT_CHANGE",
+    "RCLL",
+    "SYS:LCD:BACKLIGHT",
+}
+
+
+@dataclass
+class SimulatorConfig:
+    host: str = "127.0.0.1"
+    telnet_port: int = 2323  # 0 picks a free port
+    ftp_port: int = 2121  # 0 picks a free port
+    username: str = "LV5600"
+    password: str = "LV5600"
+    rtt: float = 0.0  # seconds added to every Telnet command and FTP reply
+    jitter: float = 0.0  # maximum random extra delay in seconds
+    bandwidth: float = 0.0  # FTP transfer rate in bytes/s, 0 for unlimited
+    make_time: float = 0.0  # seconds MAKE CAP_BMP takes to write the file
+    light_level: int = 0
+    dark_mv: float = 10.0  # waveform level at light level 0
+    gain_mv: float = 5.0  # waveform level added per light level step (at gamma 1)
+    gamma: float = 1.0  # curvature of the light level to waveform level response
+    saturation_mv: float = 763.3  # the waveform is clipped at this level
+    noise_mv: float = 8.0  # standard deviation of the waveform across the line
+    plateau: float = 0.6  # fraction of the line at full level
+    level_query: bool = True  # answer WFM:MEASURE:LEVEL ?, like firmware supporting it
+    light_source: bool = False  # simulate the OCB light source response (simulator/light_source.py)
+    seed: Optional[int] = None
+
+
+class WaveformModel:
+    """
+    Turns a light level into a waveform and renders it as a 24-bit screen
+    capture, with the trace drawn in cyan inside the analysis ROI so that the
+    waveform image analysis engines read back the simulated level.
+    """
+
+    WIDTH = 1920
+    HEIGHT = 1080
+    TRACE_COLOR = (255, 255, 0)  # BGR
+    TRACE_THICKNESS = 2
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = np.random.default_rng(config.seed)
+        self.header = self._bmp_header()
+        self.profile = self._line_profile()
+
+    def _bmp_header(self):
+        image_size = self.WIDTH * self.HEIGHT * 3
+        return b"BM" + struct.pack(
+            "<IHHIIiiHHIIiiII",
+            54 + image_size,
+            0,
+            0,
+            54,
+            40,
+            self.WIDTH,
+            self.HEIGHT,
+            1,
+            24,
+            0,
+            image_size,
+            2835,
+            2835,
+            0,
+            0,
+        )
+
+    def _line_profile(self):
+        # relative brightness along the line: a plateau in the middle of the
+        # image falling off to black towards the edges, like a lit scene
+        columns = (
+            CalculationConstants.ROI_COORDINATES_X2
+            - CalculationConstants.ROI_COORDINATES_X1
+        )
+        distance = np.abs(np.linspace(-1.0, 1.0, columns))
+        ramp = np.clip((distance - self.config.plateau) / (1.0 - self.config.plateau), 0.0, 1.0)
+        return np.cos(ramp * np.pi / 2) ** 2
+
+    def signal_mv(self, light_level):
+        """
+        Returns the unclipped light dependent part of the waveform level in mV.
+        """
+        return (
+            self.config.gain_mv * 255 * (max(light_level, 0) / 255) ** self.config.gamma
+        )
+
+    def level_mv(self, light_level):
+        """
+        Returns the noise free waveform level in mV in the middle of the line
+        for a light level.
+        """
+        return min(
+            self.config.dark_mv + self.signal_mv(light_level),
+            self.config.saturation_mv,
+        )
+
+    def sample(self, light_level):
+        """
+        Returns the waveform level in mV of every ROI column for one capture.
+        The noise is added before clipping, so a saturated waveform is flat.
+        """
+        levels = (
+            self.config.dark_mv
+            + self.signal_mv(light_level) * self.profile
+            + self.rng.normal(0.0, self.config.noise_mv, self.profile.size)
+        )
+        return np.clip(levels, 0.0, self.config.saturation_mv)
+
+    def render_mask(self, levels):
+        """
+        Returns the trace pixels of the waveform levels as a boolean mask of the ROI.
+        """
+        height = CalculationConstants.ROI_COORDINATES_Y2 - CalculationConstants.ROI_COORDINATES_Y1
+        cursor = levels / CalculationConstants.CURSOR_TO_MV_FACTOR
+        rows = np.rint((1 - cursor / LV5600Constants.MAX_CURSOR_VALUE) * height)
+        # centre the trace on the level
+        rows = rows.astype(np.intp) - self.TRACE_THICKNESS // 2
+        rows = np.clip(rows, 0, height - self.TRACE_THICKNESS)
+        columns = np.arange(levels.size)
+        mask = np.zeros((height, levels.size), bool)
+        for offset in range(self.TRACE_THICKNESS):
+            mask[rows + offset, columns] = True
+        return mask
+
+    def render_bmp(self, levels):
+        """
+        Returns the content of a BMP file showing the waveform levels.
+        """
+        pixels = np.zeros((self.HEIGHT, self.WIDTH, 3), np.uint8)
+        roi = pixels[
+            CalculationConstants.ROI_COORDINATES_Y1 : CalculationConstants.ROI_COORDINATES_Y2,
+            CalculationConstants.ROI_COORDINATES_X1 : CalculationConstants.ROI_COORDINATES_X2,
+        ]
+        roi[self.render_mask(levels)] = self.TRACE_COLOR
+        # BMP rows are stored bottom-up
+        return self.header + pixels[::-1].tobytes()
+
+
+class TelnetLineParser:
+    """
+    Splits the bytes received from a Telnet client into command lines and
+    refuses every option the client offers or asks for.
+    """
+
+    def __init__(self):
+        self.line = bytearray()
+        self.state = None
+
+    def feed(self, data):
+        """
+        Returns the lines completed by data and the negotiation replies to send.
+        """
+        lines = []
+        replies = bytearray()
+        for byte in data:
+            if self.state == "iac":
+                if byte in (WILL, WONT, DO, DONT):
+                    self.state = byte
+                elif byte == SB:
+                    self.state = "sb"
+                else:
+                    if byte == IAC:
+                        self.line.append(IAC)
+                    self.state = None
+            elif self.state in (WILL, DO):
+                replies += bytes([IAC, DONT if self.state == WILL else WONT, byte])
+                self.state = None
+            elif self.state in (WONT, DONT):
+                self.state = None
+            elif self.state == "sb":
+                if byte == IAC:
+                    self.state = "sb_iac"
+            elif self.state == "sb_iac":
+                self.state = None if byte == SE else "sb"
+            elif byte == IAC:
+                self.state = "iac"
+            elif byte in (0x0D, 0x0A):
+                lines.append(self.line.decode("ascii", "replace"))
+                self.line = bytearray()
+            elif byte != 0:
+                self.line.append(byte)
+        return lines, bytes(replies)
+
+
+class LV5600Simulator:
+    """
+    Simulated LV5600 with a Telnet and an FTP server.
+
+    Usage:
+        async with LV5600Simulator(SimulatorConfig(telnet_port=0, ftp_port=0)) as simulator:
+            telnet_client = TelnetController(simulator.config.host, simulator.config.telnet_port, ...)
+            simulator.set_light_level(120)
+
+    SIM:LIGHT, SIM:AGC and SIM:MASK set the light level, AGC mode and mask
+    mode over Telnet; the modes need a light source.
+    """
+
+    def __init__(self, config=None, light_source=None):
+        """
+        Args:
+            config (SimulatorConfig): The simulator settings, the defaults if None.
+            light_source (SimulatedLightSource): The light source the waveform
+                follows. None for the light level alone, unless
+                config.light_source asks for a default light source.
+        """
+        self.config = config or SimulatorConfig()
+        self.model = WaveformModel(self.config)
+        self.analysis = NumpyWaveformImageAnalysisController()
+        self.random = random.Random(self.config.seed)
+        self.light_level = 0
+        self.light_source = None
+        if light_source is not None:
+            # a light source passed in keeps its settings
+            self.light_source = light_source
+            self.light_level = light_source.light_level
+        else:
+            if self.config.light_source:
+                self.light_source = SimulatedLightSource(
+                    LightSourceConfig(seed=self.config.seed)
+                )
+            self.set_light_level(self.config.light_level)
+        self.settings = {}
+        self.captured_levels = None
+        self.files = {}
+        self.telnet_server = None
+        self.ftp_server = None
+        self.connections = set()
+        self.stats = {
+            "commands": 0,
+            "captures": 0,
+            "queries": 0,
+            "transfers": 0,
+            "bytes_sent": 0,
+        }
+
+    async def start(self):
+        """
+        Starts the Telnet and FTP servers. Ports configured as 0 are replaced
+        by the ports actually bound.
+        """
+        self.telnet_server = await asyncio.start_server(
+            self._handle_telnet, self.config.host, self.config.telnet_port
+        )
+        self.config.telnet_port = self.telnet_server.sockets[0].getsockname()[1]
+        self.ftp_server = await asyncio.start_server(
+            self._handle_ftp, self.config.host, self.config.ftp_port
+        )
+        self.config.ftp_port = self.ftp_server.sockets[0].getsockname()[1]
+        logging.info(
+            f"LV5600 simulator listening on {self.config.host}, "
+            f"Telnet port {self.config.telnet_port}, FTP port {self.config.ftp_port}"
+        )
+
+    async def stop(self):
+        for server in (self.telnet_server, self.ftp_server):
+            if server is not None:
+                server.close()
+        # drop the client connections that are still open
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        for server in (self.telnet_server, self.ftp_server):
+            if server is not None:
+                await server.wait_closed()
+        self.telnet_server = None
+        self.ftp_server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def set_light_level(self, light_level):
+        """
+        Sets the simulated light level, clamped to 0-255 like the debug console.
+        """
+        self.light_level = max(0, min(255, int(light_level)))
+        if self.light_source is not None:
+            self.light_source.set_light_level(self.light_level)
+
+    def current_light_level(self):
+        """
+        Returns the light level the waveform shows now, the light source
+        output if there is a light source.
+        """
+        if self.light_source is not None:
+            return self.light_source.output_level()
+        return self.light_level
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    async def _delay(self):
+        delay = self.config.rtt + self.random.uniform(0.0, self.config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def execute(self, line):
+        """
+        Executes one Telnet command line and returns the response text
+        (without the trailing prompt).
+        """
+        self.stats["commands"] += 1
+        head, _, argument = line.strip().partition(" ")
+        head = head.upper()
+        argument = argument.strip()
+
+        if head == "CAP:REFRESH":
+            self.captured_levels = self.model.sample(self.current_light_level())
+            self.stats["captures"] += 1
+            return ""
+        if head == "MAKE":
+            if argument != "CAP_BMP":
+                return f"ERROR: {argument} is not simulated"
+            if self.captured_levels is None:
+                self.captured_levels = self.model.sample(self.current_light_level())
+            if self.config.make_time > 0:
+                await asyncio.sleep(self.config.make_time)
+            loop = asyncio.get_running_loop()
+            self.files[FTPConstants.FTP_FILE_NAME_BMP] = await loop.run_in_executor(
+                None, self.model.render_bmp, self.captured_levels
+            )
+            return ""
+        if head == "WFM:MEASURE:LEVEL" and self.config.level_query:
+            if argument != "?":
+                return f"ERROR: {head} is a query"
+            # the level of a live frame, as the capture analysis would read it
+            analysis = self.analysis.analyze_mask(
+                self.model.render_mask(self.model.sample(self.current_light_level())),
+                CalculationConstants.NOISE_MODE,
+                MEASURE_FLAT_PIXEL_COUNT,
+            )
+            self.stats["queries"] += 1
+            return f"{analysis.mv:.1f},{analysis.sd:.2f}"
+        if head == "SYS:INITIALIZE:ALL":
+            self.settings.clear()
+            return ""
+        if head == "SIM:LIGHT":
+            if argument == "?":
+                if self.light_source is not None:
+                    # the light source may be set directly, like the debug console
+                    return str(self.light_source.light_level)
+                return str(self.light_level)
+            try:
+                self.set_light_level(int(argument))
+            except ValueError:
+                return f"ERROR: invalid light level {argument}"
+            return ""
+        if head in ("SIM:AGC", "SIM:MASK"):
+            if self.light_source is None:
+                return f"ERROR: {head} needs a light source"
+            if head == "SIM:AGC":
+                mode, set_mode = self.light_source.agc_mode, self.light_source.set_AGC_mode
+            else:
+                mode, set_mode = self.light_source.mask_mode, self.light_source.set_mask_mode
+            if argument == "?":
+                return mode
+            try:
+                set_mode(argument.upper())
+            except ValueError:
+                return f"ERROR: invalid mode {argument}"
+            return ""
+        if head not in SETTING_COMMANDS:
+            return f"ERROR: unknown command {head}"
+        if argument == "?":
+            return self.settings.get(head, "")
+        self.settings[head] = argument
+        return ""
+
+    async def _handle_telnet(self, reader, writer):
+        parser = TelnetLineParser()
+        lines = []
+
+        async def next_line():
+            while True:
+                while lines:
+                    line = lines.pop(0)
+                    if line:
+                        return line
+                data = await reader.read(1024)
+                if not data:
+                    return None
+                new_lines, replies = parser.feed(data)
+                lines.extend(new_lines)
+                if replies:
+                    writer.write(replies)
+
+        end_string = TelnetConstants.TELNET_END_STRING
+        self.connections.add(asyncio.current_task())
+        try:
+            writer.write(b"login: ")
+            username = await next_line()
+            writer.write(b"Password: ")
+            password = await next_line()
+            if username != self.config.username or password != self.config.password:
+                writer.write(b"\r\nLogin incorrect\r\n")
+                return
+            writer.write(b"\r\nLV5600 simulator\r\n" + end_string)
+            while True:
+                line = await next_line()
+                if line is None:
+                    break
+                await self._delay()
+                response = await self.execute(line)
+                writer.write(response.encode("ascii") + b"\r\n" + end_string)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def _open_passive(self):
+        accepted = asyncio.get_running_loop().create_future()
+
+        def on_connect(reader, writer):
+            if accepted.done():
+                writer.close()
+            else:
+                accepted.set_result((reader, writer))
+
+        server = await asyncio.start_server(on_connect, self.config.host, 0)
+        return server, accepted
+
+    async def _send_file(self, writer, data):
+        block_size = FTPConstants.FTP_BLOCK_SIZE
+        tic = time.perf_counter()
+        with memoryview(data) as view:
+            for offset in range(0, len(view), block_size):
+                writer.write(view[offset : offset + block_size])
+                await writer.drain()
+                if self.config.bandwidth > 0:
+                    due = (offset + block_size) / self.config.bandwidth
+                    elapsed = time.perf_counter() - tic
+                    if due > elapsed:
+                        await asyncio.sleep(due - elapsed)
+        self.stats["transfers"] += 1
+        self.stats["bytes_sent"] += len(data)
+
+    async def _handle_ftp(self, reader, writer):
+        def reply(text):
+            writer.write((text + "\r\n").encode("latin-1"))
+
+        username = None
+        logged_in = False
+        passive = None
+        self.connections.add(asyncio.current_task())
+        try:
+            reply("220 LV5600 simulator")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode("latin-1").strip().partition(" ")
+                command = command.upper()
+                await self._delay()
+
+                if command == "USER":
+                    username = argument
+                    reply("331 Password required")
+                elif command == "PASS":
+                    logged_in = (username, argument) == (
+                        self.config.username,
+                        self.config.password,
+                    )
+                    reply("230 Logged in" if logged_in else "530 Login incorrect")
+                elif command == "QUIT":
+                    reply("221 Goodbye")
+                    break
+                elif command == "NOOP":
+                    reply("200 NOOP ok")
+                elif not logged_in:
+                    reply("530 Not logged in")
+                elif command == "TYPE":
+                    reply("200 Type set")
+                elif command == "SYST":
+                    reply("215 UNIX Type: L8")
+                elif command == "PWD":
+                    reply('257 "/"')
+                elif command == "CWD":
+                    reply("250 Directory changed")
+                elif command == "SIZE":
+                    data = self.files.get(argument.lstrip("/"))
+                    reply(f"213 {len(data)}" if data is not None else "550 No such file")
+                elif command == "PASV":
+                    if passive is not None:
+                        passive[0].close()
+                    passive = await self._open_passive()
+                    port = passive[0].sockets[0].getsockname()[1]
+                    address = self.config.host.replace(".", ",")
+                    reply(
+                        f"227 Entering Passive Mode ({address},{port >> 8},{port & 0xFF})"
+                    )
+                elif command == "RETR":
+                    if passive is None:
+                        reply("425 Use PASV first")
+                        continue
+                    server, accepted = passive
+                    passive = None
+                    data = self.files.get(argument.lstrip("/"))
+                    if data is None:
+                        server.close()
+                        reply("550 No such file or directory.")
+                        continue
+                    reply("150 Opening BINARY mode data connection")
+                    try:
+                        _, data_writer = await asyncio.wait_for(
+                            accepted, timeout=FTPConstants.FTP_TIMEOUT
+                        )
+                    except asyncio.TimeoutError:
+                        reply("425 Can't open data connection")
+                        continue
+                    finally:
+                        server.close()
+                    try:
+                        await self._send_file(data_writer, data)
+                    finally:
+                        data_writer.close()
+                    reply("226 Transfer complete")
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            if passive is not None:
+                passive[0].close()
+            writer.close()
+
+
+async def run_simulator(config):
+    async with LV5600Simulator(config):
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LV5600 Telnet and FTP simulator")
+    for field in fields(SimulatorConfig):
+        if field.type is bool:
+            parser.add_argument(
+                "--" + field.name.replace("_", "-"),
+                action=argparse.BooleanOptionalAction,
+                default=field.default,
+            )
+            continue
+        parser.add_argument(
+            "--" + field.name.replace("_", "-"),
+            type=int if field.name == "seed" else field.type,
+            default=field.default,
+        )
+    logging.basicConfig(level=logging.INFO)
+    config = SimulatorConfig(**vars(parser.parse_args()))
+    try:
+        asyncio.run(run_simulator(config))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
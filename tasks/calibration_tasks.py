@@ -0,0 +1,162 @@
+"""
+This module provides LightCalibrationCache, a persisted store of the light level to mV response measured by earlier light level searches, and the curve helpers used to fit and invert such a response. A search for a scope, calculation mode, AGC and mask setting and line number that has been tuned before can start from the light level the stored response predicts instead of searching the whole light level range.
+"""
+import json
+import logging
+import math
+import os
+import time
+
+from Constants import LightSearchConstants
+
+
+def fit_monotone(points):
+    """
+    Returns the (light level, mV) points sorted by light level with the mV
+    made non decreasing by pooling adjacent violators.
+    """
+    blocks = []  # [light level sum, mV sum, count]
+    for light_level, mv in sorted(points):
+        blocks.append([light_level, mv, 1])
+        while len(blocks) > 1 and (
+            blocks[-2][1] / blocks[-2][2] > blocks[-1][1] / blocks[-1][2]
+        ):
+            light_level_sum, mv_sum, count = blocks.pop()
+            blocks[-1][0] += light_level_sum
+            blocks[-1][1] += mv_sum
+            blocks[-1][2] += count
+    return [(block[0] / block[2], block[1] / block[2]) for block in blocks]
+
+
+def interpolate_power_law(points, x):
+    """
+    Returns y at x for the (x, y) points, sorted by x with y non decreasing,
+    taking the curve as piecewise power law (linear in log-log space), which
+    follows the camera gamma. Outside the points the secant of the two closest
+    points is extended; a single point is taken as proportional. Returns None
+    if the points cannot tell.
+    """
+    points = [(math.log(px), math.log(py)) for px, py in points if px > 0 and py > 0]
+    if x <= 0 or not points:
+        return None
+    x = math.log(x)
+    if len(points) == 1:
+        px, py = points[0]
+        return math.exp(py + x - px)
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if x0 <= x <= x1 and x1 > x0:
+            return math.exp(y0 + (x - x0) * (y1 - y0) / (x1 - x0))
+    (x0, y0), (x1, y1) = points[:2] if x < points[0][0] else points[-2:]
+    if x1 <= x0:
+        return None
+    return math.exp(y0 + (x - x0) * (y1 - y0) / (x1 - x0))
+
+
+def predict_light_level(points, target):
+    """
+    Returns the light level the monotone (light level, mV) points predict for
+    target mV, or None.
+    """
+    return interpolate_power_law([(mv, light_level) for light_level, mv in points], target)
+
+
+def predict_mv(points, light_level):
+    """
+    Returns the mV the monotone (light level, mV) points predict at light_level, or None.
+    """
+    return interpolate_power_law(points, light_level)
+
+
+class LightCalibrationCache:
+    """
+    The light level to mV responses of earlier searches, stored in a JSON file.
+
+    Usage:
+        cache = LightCalibrationCache(file_path)
+        key = LightCalibrationCache.make_key(scope, mode, agc, mask, line_number)
+        points = cache.get(key)  # [(light level, mV)], or None
+        cache.put(key, points)
+    """
+
+    def __init__(
+        self,
+        file_path,
+        max_age=LightSearchConstants.CALIBRATION_MAX_AGE,
+        max_points=LightSearchConstants.CALIBRATION_MAX_POINTS,
+    ):
+        """
+        Args:
+            file_path (str): The JSON file the responses are stored in. None keeps them in memory only.
+            max_age (float): Seconds after which a stored response has expired.
+            max_points (int): The most measurements kept per response, the most recent ones.
+        """
+        self.file_path = file_path
+        self.max_age = max_age
+        self.max_points = max_points
+        self.entries = {}
+        self.load()
+
+    @staticmethod
+    def make_key(scope, mode, agc, mask, line_number):
+        return "|".join(str(part) for part in (scope, mode, agc, mask, line_number))
+
+    def load(self):
+        if self.file_path is None or not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path) as file:
+                self.entries = json.load(file)
+        except Exception as e:
+            # a broken cache only costs a cold start
+            logging.warning(f"Error while loading light calibration {self.file_path}: {str(e)}")
+            self.entries = {}
+
+    def save(self):
+        if self.file_path is None:
+            return
+        try:
+            # write a new file and swap it in, so a crash cannot leave half a file
+            temp_path = self.file_path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump(self.entries, file, indent=2)
+            os.replace(temp_path, self.file_path)
+        except Exception as e:
+            logging.warning(f"Error while saving light calibration {self.file_path}: {str(e)}")
+
+    def get(self, key):
+        """
+        Returns the stored (light level, mV) points for key, or None if there
+        are none or they have expired.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry["updated"]
+        if age > self.max_age:
+            logging.info(f"Light calibration {key} expired ({round(age)} s old)")
+            self.invalidate(key)
+            return None
+        return [tuple(point) for point in entry["points"]]
+
+    def put(self, key, points, replace=False):
+        """
+        Stores the (light level, mV) points for key, merged with the stored
+        ones unless replace is True. A new measurement at a stored light level
+        replaces the old one.
+        """
+        merged = {} if replace else {
+            light_level: mv for light_level, mv in self.get(key) or []
+        }
+        for light_level, mv in points:
+            # move the level to the end, the most recent points are kept
+            merged.pop(light_level, None)
+            merged[light_level] = mv
+        self.entries[key] = {
+            "updated": time.time(),
+            "points": [list(point) for point in list(merged.items())[-self.max_points :]],
+        }
+        self.save()
+
+    def invalidate(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.save()
@@ -0,0 +1,861 @@
+"""
+This module provides LightLevelSearch, a headless engine that tunes the light level until the waveform reaches a target level. Which light levels are probed is decided by a pluggable SearchStrategy, the light level is set through a LightActuator and the waveform is measured through a MeasurementBackend, so the same search runs against the instrument, the simulator or the benchmark bench. Progress is reported as SearchEvents to the subscribed listeners.
+"""
+import asyncio
+from dataclasses import dataclass
+import inspect
+import logging
+import math
+import time
+
+from Constants import CalculationConstants, LightSearchConstants
+from tasks.calibration_tasks import fit_monotone, predict_light_level, predict_mv
+
+
+class SearchEvents:
+    STARTED = "started"
+    MEASURED = "measured"
+    OSCILLATION = "oscillation"
+    FINISHED = "finished"
+
+
+@dataclass
+class LevelMeasurement:
+    mv: float
+    sd: float
+    frame: object = None  # the last captured frame, for display
+    samples: int = 1  # the number of captures averaged
+
+
+@dataclass
+class SearchEvent:
+    kind: str
+    light_level: int = None
+    measurement: LevelMeasurement = None
+    class_: int = None
+    message: str = ""
+
+
+@dataclass
+class SearchResult:
+    light_level: int
+    mv: float
+    converged: bool
+    probes: int
+    captures: int
+    seconds: float
+    frames_saved: int = 0
+    warm_started: bool = False  # started from a stored light response
+    settle_seconds: float = 0.0  # waited for the waveform to settle after light level changes
+
+
+class MeasurementBackend:
+    """
+    Measures the waveform at the current light level.
+    """
+
+    async def measure(self, mode, num_sample, stop=None):
+        """
+        Returns a LevelMeasurement with the mean mV and the maximum standard
+        deviation of up to num_sample captures. stop(analyses) -> bool is
+        called with the analyses (mv, sd) captured so far after every capture;
+        once it returns True no further captures are taken.
+        """
+        raise NotImplementedError
+
+
+class CallbackMeasurement(MeasurementBackend):
+    """
+    A MeasurementBackend calling an async function measure(mode, num_sample, stop).
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    async def measure(self, mode, num_sample, stop=None):
+        return await self.callback(mode, num_sample, stop)
+
+
+class QueryMeasurement(MeasurementBackend):
+    """
+    Measures the waveform with an instrument query returning the level
+    directly (e.g. LV5600Tasks.query_level), a few bytes instead of a screen
+    capture per sample. If the instrument cannot answer the query, or the
+    calculation mode is not NOISE_MODE, the fallback backend measures instead;
+    an unanswered query is not asked again.
+
+    The measurements carry no frame, screen captures are left to display and
+    verification.
+    """
+
+    def __init__(
+        self,
+        query,
+        fallback=None,
+        interval=LightSearchConstants.QUERY_INTERVAL,
+        supported=None,
+    ):
+        """
+        Args:
+            query (callable): async query() -> (mv, sd).
+            fallback (MeasurementBackend): Measures when the query is not supported.
+            interval (float): Seconds between two queries, so consecutive
+                samples come from different frames.
+            supported (bool): Whether the query is known to work, None to find out.
+        """
+        self.query = query
+        self.fallback = fallback
+        self.interval = interval
+        self.supported = supported
+
+    async def _query(self):
+        try:
+            mv, sd = await self.query()
+        except Exception as e:
+            if self.supported:
+                raise
+            logging.warning(f"Level query not supported, capturing instead: {str(e)}")
+            self.supported = False
+            return None
+        self.supported = True
+        return LevelMeasurement(mv, sd)
+
+    async def measure(self, mode, num_sample, stop=None):
+        analyses = []
+        if self.supported is not False and mode == CalculationConstants.NOISE_MODE:
+            while len(analyses) < num_sample:
+                if analyses and self.interval > 0:
+                    await asyncio.sleep(self.interval)
+                analysis = await self._query()
+                if analysis is None:
+                    break
+                analyses.append(analysis)
+                if stop is not None and stop(analyses):
+                    break
+        if not analyses:
+            if self.fallback is None:
+                raise Exception("Level query not supported and no fallback measurement")
+            return await self.fallback.measure(mode, num_sample, stop)
+        mv = round(sum(analysis.mv for analysis in analyses) / len(analyses), 1)
+        return LevelMeasurement(
+            mv, max(analysis.sd for analysis in analyses), samples=len(analyses)
+        )
+
+
+class LightActuator:
+    """
+    Sets the light level of the light source.
+    """
+
+    async def set_light_level(self, light_level):
+        raise NotImplementedError
+
+
+class DebugConsoleActuator(LightActuator):
+    """
+    Sets the light level through the debug console. The key presses run in a
+    worker thread, so the event loop keeps running meanwhile.
+    """
+
+    def __init__(self, debug_console_controller, executor=None):
+        """
+        Args:
+            debug_console_controller (DebugConsoleController): Sends the key presses.
+            executor (concurrent.futures.Executor): Runs the key presses. Pass
+                the single worker executor every other debug console call
+                runs in, so no two scripts interleave. None for the default
+                executor of the event loop.
+        """
+        self.debug_console_controller = debug_console_controller
+        self.executor = executor
+
+    async def set_light_level(self, light_level):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.executor, self.debug_console_controller.set_light_level, light_level
+        )
+
+
+class SettleDetector:
+    """
+    Waits after a light source change until the waveform has settled, instead
+    of sleeping for the worst case. The light source only starts to move after
+    a dead time, in which the waveform still agrees with itself at the old
+    level, so nothing is sampled for min_wait. Quick single sample
+    measurements (a level query or one capture) are then taken interval apart, and
+    the waveform has settled once two successive ones agree within the
+    tolerance, or after max_wait.
+    The waits never block the event loop. If the measurement fails, e.g. the
+    instrument does not answer the level query, the detector sleeps
+    fallback_time from then on.
+
+    Usage:
+        settle = SettleDetector(QueryMeasurement(query))
+        await actuator.set_light_level(light_level)
+        seconds = await settle.wait()
+    """
+
+    def __init__(
+        self,
+        measurement,
+        max_wait=LightSearchConstants.SETTLE_MAX_WAIT,
+        min_wait=LightSearchConstants.SETTLE_MIN_WAIT,
+        interval=LightSearchConstants.SETTLE_INTERVAL,
+        tolerance_mv=LightSearchConstants.SETTLE_TOLERANCE_MV,
+        relative_tolerance=LightSearchConstants.SETTLE_RELATIVE_TOLERANCE,
+        fallback_time=LightSearchConstants.SETTLE_TIME,
+    ):
+        """
+        Args:
+            measurement (MeasurementBackend): Takes the settle samples, one per call.
+            max_wait (float): The most seconds to wait.
+            min_wait (float): Seconds before the first sample, longer than
+                the dead time of the light source.
+            interval (float): Seconds between two samples, longer than the
+                light source takes to move noticeably.
+            tolerance_mv (float): mV two settled samples may differ by, above the sample noise.
+            relative_tolerance (float): The same relative to the level, if larger.
+            fallback_time (float): Seconds to sleep if the measurement fails.
+        """
+        self.measurement = measurement
+        self.max_wait = max_wait
+        self.min_wait = min_wait
+        self.interval = interval
+        self.tolerance_mv = tolerance_mv
+        self.relative_tolerance = relative_tolerance
+        self.fallback_time = fallback_time
+        self.supported = None
+        self.settle_times = []
+        self.timeouts = 0
+
+    async def _sample(self, mode):
+        try:
+            return (await self.measurement.measure(mode, 1)).mv
+        except Exception as e:
+            logging.warning(f"Settle detection not possible, sleeping instead: {str(e)}")
+            self.supported = False
+            return None
+
+    async def wait(
+        self, mode=CalculationConstants.NOISE_MODE, max_wait=None, fallback_time=None
+    ):
+        """
+        Waits until the waveform has settled and returns the seconds waited.
+
+        Args:
+            mode (str): The calculation mode of the samples.
+            max_wait (float): Overrides the most seconds to wait.
+            fallback_time (float): Overrides the seconds to sleep without detection.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        fallback_time = self.fallback_time if fallback_time is None else fallback_time
+        tic = time.perf_counter()
+        previous = None
+        settled = False
+        if self.supported is not False:
+            await asyncio.sleep(min(self.min_wait, max_wait))
+        while self.supported is not False:
+            mv = await self._sample(mode)
+            if mv is None:
+                break
+            self.supported = True
+            if previous is not None and abs(mv - previous) <= max(
+                self.tolerance_mv, self.relative_tolerance * abs(mv)
+            ):
+                settled = True
+                break
+            previous = mv
+            remaining = max_wait - (time.perf_counter() - tic)
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(self.interval, remaining))
+        if self.supported is False:
+            # whatever was spent on the failed sample counts towards the sleep
+            remaining = min(fallback_time, max_wait) - (time.perf_counter() - tic)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+        seconds = round(time.perf_counter() - tic, 3)
+        if self.supported and not settled:
+            self.timeouts += 1
+            logging.warning(f"Waveform not settled after {seconds} s")
+        else:
+            logging.debug(f"Waveform settled after {seconds} s")
+        self.settle_times.append(seconds)
+        return seconds
+
+    def get_stats(self):
+        """
+        Returns the number of waits, their mean and maximum seconds and how
+        many ran into max_wait.
+        """
+        count = len(self.settle_times)
+        return {
+            "waits": count,
+            "mean_seconds": round(sum(self.settle_times) / count, 3) if count else 0.0,
+            "max_seconds": max(self.settle_times) if count else 0.0,
+            "timeouts": self.timeouts,
+        }
+
+
+class SequentialSampler:
+    """
+    Decides after every capture whether the captures so far classify the
+    waveform with confidence, so a probe takes only as many captures as its
+    decision needs instead of a fixed number.
+
+    The decision is confident when the confidence interval of the mean mV lies
+    completely above, below or inside the target range, or when the waveform
+    is flat (always over saturated). The capture to capture mV deviation is
+    pooled over all averaged probes of a search, starting from MV_NOISE_PRIOR.
+    """
+
+    def __init__(
+        self,
+        max_samples=LightSearchConstants.MAX_AVERAGE_COUNT,
+        confidence_z=LightSearchConstants.CONFIDENCE_Z,
+        noise_prior_mv=LightSearchConstants.MV_NOISE_PRIOR,
+        noise_prior_weight=LightSearchConstants.MV_NOISE_PRIOR_WEIGHT,
+    ):
+        self.max_samples = max_samples
+        self.confidence_z = confidence_z
+        self.noise_prior_mv = noise_prior_mv
+        self.noise_prior_weight = noise_prior_weight
+        self.reset()
+
+    def reset(self):
+        self.squared_deviations = 0.0
+        self.degrees_of_freedom = 0
+
+    @staticmethod
+    def _squared_deviations(mvs):
+        mean = sum(mvs) / len(mvs)
+        return sum((mv - mean) ** 2 for mv in mvs)
+
+    def noise_mv(self, mvs=()):
+        """
+        Returns the estimated capture to capture mV deviation, including the
+        captures mvs of the current probe.
+        """
+        squared_deviations = self.squared_deviations
+        degrees_of_freedom = self.degrees_of_freedom
+        if len(mvs) > 1:
+            squared_deviations += self._squared_deviations(mvs)
+            degrees_of_freedom += len(mvs) - 1
+        variance = (
+            self.noise_prior_mv**2 * self.noise_prior_weight + squared_deviations
+        ) / (self.noise_prior_weight + degrees_of_freedom)
+        return math.sqrt(variance)
+
+    def is_decided(self, analyses, lower_bound, upper_bound, flat_sd_threshold):
+        """
+        Returns True if the analyses classify the waveform against the target
+        range [lower_bound, upper_bound] with confidence.
+        """
+        if max(analysis.sd for analysis in analyses) < flat_sd_threshold:
+            return True
+        mvs = [analysis.mv for analysis in analyses]
+        mean = sum(mvs) / len(mvs)
+        half_width = self.confidence_z * self.noise_mv(mvs) / math.sqrt(len(mvs))
+        return (
+            mean - half_width >= upper_bound
+            or mean + half_width <= lower_bound
+            or (lower_bound < mean - half_width and mean + half_width < upper_bound)
+        )
+
+    def record(self, analyses, flat_sd_threshold):
+        """
+        Adds the captures of a finished probe to the pooled deviation. Flat
+        waveforms are clipped and left out.
+        """
+        if len(analyses) > 1 and max(a.sd for a in analyses) >= flat_sd_threshold:
+            self.squared_deviations += self._squared_deviations(
+                [analysis.mv for analysis in analyses]
+            )
+            self.degrees_of_freedom += len(analyses) - 1
+
+
+class SearchStrategy:
+    """
+    Decides which light levels are probed. search() probes light levels with
+    LightLevelSearch.probe until it is done and returns the final light level.
+    """
+
+    name = None
+
+    async def search(self, light_search, target):
+        raise NotImplementedError
+
+    async def warm_start(self, light_search, target):
+        """
+        Brackets the target light level from the stored response of
+        light_search, if there is one: the light level the response predicts
+        is probed first, then light levels in doubling steps away from it
+        until the target lies between two probes. A first probe that deviates
+        from the stored response discards it.
+
+        Returns:
+            tuple: (lower_bound, upper_bound, light_level), the light levels
+            measured under and over the target (the ends of the light level
+            range if not known) and the light level within the target range,
+            if a probe hit it, else None.
+        """
+        lower_bound = LightSearchConstants.MIN_LIGHT_LEVEL - 1
+        upper_bound = LightSearchConstants.MAX_LIGHT_LEVEL
+        if not light_search.prior:
+            return lower_bound, upper_bound, None
+        points = fit_monotone(light_search.prior)
+        prediction = predict_light_level(points, target)
+        if prediction is None:
+            return lower_bound, upper_bound, None
+        light_level = min(max(round(prediction), lower_bound + 1), upper_bound - 1)
+        logging.info(f"Starting from the stored light response at light level {light_level}")
+
+        measurement, class_ = await light_search.probe(light_level)
+        expected_mv = predict_mv(points, light_level)
+        if (
+            measurement.sd >= light_search.flat_sd_threshold
+            and expected_mv is not None
+            and abs(measurement.mv - expected_mv)
+            > LightSearchConstants.CALIBRATION_DRIFT_TOLERANCE * expected_mv
+        ):
+            light_search.discard_prior(
+                f"{measurement.mv} mV measured, {round(expected_mv, 1)} mV expected"
+            )
+        step = LightSearchConstants.CALIBRATION_BRACKET
+        while True:
+            if class_ == 2:
+                return lower_bound, upper_bound, light_level
+            if class_ == 0:
+                upper_bound = light_level
+            else:
+                lower_bound = light_level
+            if (
+                not light_search.prior
+                or upper_bound - lower_bound <= 1
+                or (
+                    lower_bound >= LightSearchConstants.MIN_LIGHT_LEVEL
+                    and upper_bound < LightSearchConstants.MAX_LIGHT_LEVEL
+                )
+            ):
+                return lower_bound, upper_bound, None
+            if class_ == 0:
+                light_level = max(light_level - step, lower_bound + 1)
+            else:
+                light_level = min(light_level + step, upper_bound - 1)
+            step *= 2
+            _, class_ = await light_search.probe(light_level)
+
+
+class BisectionStrategy(SearchStrategy):
+    """
+    Bisection over the light levels. When a light level comes up a second
+    time the search hands over to stepping the light level by one.
+    """
+
+    name = "bisection"
+
+    async def search(self, light_search, target):
+        lower_bound, upper_bound, light_level = await self.warm_start(
+            light_search, target
+        )
+        if light_level is not None:
+            return light_level
+        lower_bound = max(lower_bound, LightSearchConstants.MIN_LIGHT_LEVEL)
+        checked_light_levels = set(light_search.measurements)
+        light_level = lower_bound
+
+        while lower_bound < upper_bound:
+            light_level = (upper_bound + lower_bound) // 2
+            if light_level in checked_light_levels:
+                logging.info("Oscillation detected")
+                logging.info(f"Light Level {light_level} has been checked before")
+                logging.info("Handing over to precision mode")
+                return await self.adjust_precisely(light_search, light_level, target)
+
+            _, class_ = await light_search.probe(light_level)
+            checked_light_levels.add(light_level)
+
+            if class_ == 0:  # over saturated
+                upper_bound = light_level
+            elif class_ == 1:  # under saturated
+                lower_bound = light_level
+            else:
+                break
+        return light_level
+
+    async def adjust_precisely(self, light_search, light_level, target):
+        """
+        Steps the light level by one until the waveform is within the target
+        range. If a light level comes up again, the closest level is chosen
+        and light_search.confirm_oscillation decides whether to go on.
+        """
+        logging.debug("Adjusting light level precisely")
+        checked_light_levels = set()
+        differences = {}
+
+        while True:
+            measurement, class_ = await light_search.probe(light_level)
+            differences[light_level] = measurement.mv - target
+
+            if light_level in checked_light_levels:
+                logging.info("Oscillation detected")
+                logging.info(f"Light Level {light_level} has been checked before")
+                closest_level = min(
+                    differences, key=lambda level: abs(differences[level])
+                )
+                logging.info(f"Closest level: {closest_level}")
+                logging.info(f"Closest mV difference: {differences[closest_level]}")
+                if await light_search.confirm_oscillation(
+                    closest_level, differences[closest_level]
+                ):
+                    checked_light_levels.clear()
+                    differences.clear()
+                    light_level = closest_level
+                    continue
+                logging.info("User has chosen to stop the process")
+                return closest_level
+
+            checked_light_levels.add(light_level)
+            if class_ == 0:
+                light_level -= 1
+            elif class_ == 1:
+                light_level += 1
+            else:
+                return light_level
+
+
+class ModelBasedStrategy(SearchStrategy):
+    """
+    Fits a monotone light level to mV response through every measurement so
+    far and probes the light level the model predicts for the target. Levels
+    measured over and under the target bracket the search; when the
+    prediction falls outside the bracket or was probed already, the bracket is
+    bisected instead.
+
+    Flat (saturated) measurements only bound the bracket, since their level
+    is clipped. A stored response of an earlier search fills in the light
+    levels not measured yet.
+
+    While the bracket is wide a probe only has to tell the side of the target
+    and takes a single capture; once it is narrow, the sampler averages
+    captures until the classification is confident.
+    """
+
+    name = "model"
+    # probes are averaged once the bracket is this narrow
+    averaging_interval = 4
+
+    def _fit_points(self, light_search):
+        points = dict(light_search.prior or [])
+        points.update(light_search.response_points())
+        return fit_monotone(points.items())
+
+    async def search(self, light_search, target):
+        lower_bound, upper_bound, light_level = await self.warm_start(
+            light_search, target
+        )
+        if light_level is not None:
+            return light_level
+        while True:
+            light_level = await self._search_bracket(
+                light_search, target, lower_bound, upper_bound
+            )
+            if light_level is not None:
+                return light_level
+
+            measurements = light_search.measurements
+            closest_level = min(
+                measurements, key=lambda level: abs(measurements[level].mv - target)
+            )
+            logging.info(f"No light level within the target range, closest level: {closest_level}")
+            if not await light_search.confirm_oscillation(
+                closest_level, measurements[closest_level].mv - target
+            ):
+                return closest_level
+            # the scope has been moved, start over
+            lower_bound = LightSearchConstants.MIN_LIGHT_LEVEL - 1
+            upper_bound = LightSearchConstants.MAX_LIGHT_LEVEL
+
+    async def _search_bracket(self, light_search, target, lower_bound, upper_bound):
+        # returns the light level within the target range, or None if the
+        # bracket closed without one
+        # bracket widths after every probe, to notice a slowly closing bracket
+        widths = []
+
+        while upper_bound - lower_bound > 1:
+            prediction = predict_light_level(self._fit_points(light_search), target)
+            bisect = (lower_bound + upper_bound) // 2
+            if prediction is None or not lower_bound < prediction < upper_bound:
+                # the model disagrees with the bracket
+                light_level = bisect
+            elif len(widths) >= 3 and widths[-1] > widths[-3] / 2:
+                # the model keeps hitting the same side of the target
+                logging.debug("Bracket closing slowly, bisecting")
+                light_level = bisect
+                widths.clear()
+            else:
+                light_level = min(max(round(prediction), lower_bound + 1), upper_bound - 1)
+                if light_level in light_search.measurements:
+                    light_level = bisect
+
+            if upper_bound - lower_bound <= self.averaging_interval:
+                num_sample = None
+            else:
+                num_sample = 1
+            _, class_ = await light_search.probe(light_level, num_sample)
+            if class_ == 2:
+                return light_level
+            if class_ == 0:
+                upper_bound = min(upper_bound, light_level)
+            else:
+                lower_bound = max(lower_bound, light_level)
+            widths.append(upper_bound - lower_bound)
+        return None
+
+
+STRATEGIES = {
+    BisectionStrategy.name: BisectionStrategy,
+    ModelBasedStrategy.name: ModelBasedStrategy,
+}
+
+
+class LightLevelSearch:
+    """
+    Tunes the light level until the waveform is classified as within the
+    target range.
+
+    Usage:
+        light_search = LightLevelSearch(measurement, actuator, analysis_controller, tolerance, flat_sd_threshold)
+        light_search.subscribe(listener)  # called with every SearchEvent
+        result = await light_search.run(target)
+
+    With a LightCalibrationCache, run(target, mode, calibration_key) starts
+    from the light response stored for calibration_key and stores the
+    response it measured.
+    """
+
+    def __init__(
+        self,
+        measurement,
+        actuator,
+        classifier,
+        target_tolerance,
+        flat_sd_threshold,
+        strategy=None,
+        confirm=None,
+        settle_time=LightSearchConstants.SETTLE_TIME,
+        sampler=None,
+        calibration=None,
+        settle=None,
+    ):
+        """
+        Args:
+            measurement (MeasurementBackend): Measures the waveform.
+            actuator (LightActuator): Sets the light level.
+            classifier: A waveform image analysis controller, used for classify_waveform.
+            target_tolerance (float): The relative tolerance of the target range.
+            flat_sd_threshold (float): The standard deviation below which the waveform is flat.
+            strategy (SearchStrategy): Defaults to BisectionStrategy.
+            confirm (callable): confirm(event) -> bool, sync or async. Asked on an
+                OSCILLATION event whether to go on searching. None stops the search.
+            settle_time (float): Seconds to wait after every light level change.
+            settle (SettleDetector): Waits until the waveform has settled
+                after every light level change instead of settle_time.
+            sampler (SequentialSampler): Decides how many captures a probe
+                averages. Defaults to SequentialSampler().
+            calibration (LightCalibrationCache): Stores the measured light
+                responses to warm start later searches. None disables it.
+        """
+        self.measurement = measurement
+        self.actuator = actuator
+        self.classifier = classifier
+        self.target_tolerance = target_tolerance
+        self.flat_sd_threshold = flat_sd_threshold
+        self.strategy = strategy or BisectionStrategy()
+        self.confirm = confirm
+        self.settle_time = settle_time
+        self.settle = settle
+        self.sampler = sampler or SequentialSampler()
+        self.calibration = calibration
+        self.listeners = []
+        self.target = None
+        self.mode = CalculationConstants.NOISE_MODE
+        self._reset()
+
+    def _reset(self):
+        self.measurements = {}
+        self.classes = {}
+        self.probes = 0
+        self.captures = 0
+        self.frames_saved = 0
+        self.settle_seconds = 0.0
+        self.sampler.reset()
+        # the stored (light level, mV) response the search started from
+        self.prior = None
+        self.prior_discarded = False
+
+    def response_points(self):
+        """
+        Returns the (light level, mV) points of the measurements that are not
+        flat, i.e. not clipped.
+        """
+        return [
+            (light_level, measurement.mv)
+            for light_level, measurement in self.measurements.items()
+            if measurement.sd >= self.flat_sd_threshold
+        ]
+
+    def discard_prior(self, reason):
+        """
+        Stops using the stored light response, which no longer matches the setup.
+        """
+        logging.info(f"Stored light response discarded: {reason}")
+        self.prior = None
+        self.prior_discarded = True
+
+    def subscribe(self, listener):
+        """
+        Registers listener(event), sync or async, for every SearchEvent.
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    async def emit(self, event):
+        for listener in list(self.listeners):
+            result = listener(event)
+            if inspect.isawaitable(result):
+                await result
+
+    def classify(self, measurement):
+        return self.classifier.classify_waveform(
+            measurement.mv,
+            measurement.sd,
+            self.target,
+            self.target_tolerance,
+            self.flat_sd_threshold,
+            self.mode,
+        )
+
+    async def probe(self, light_level, num_sample=None):
+        """
+        Sets the light level, measures and classifies the waveform. Unless
+        num_sample is given, captures are averaged until the sampler is
+        confident of the classification.
+
+        Returns:
+            tuple: The LevelMeasurement and the class (0 over, 1 under, 2 within the target range).
+        """
+        await self.actuator.set_light_level(light_level)
+        if self.settle is not None:
+            self.settle_seconds += await self.settle.wait(self.mode)
+        elif self.settle_time > 0:
+            await asyncio.sleep(self.settle_time)
+            self.settle_seconds += self.settle_time
+        logging.info(f"Current Light Level: {light_level}")
+
+        if num_sample is None:
+            measurement = await self._measure_sequentially()
+        else:
+            measurement = await self.measurement.measure(self.mode, num_sample)
+        class_ = self.classify(measurement)
+        self.probes += 1
+        self.captures += measurement.samples
+        self.measurements[light_level] = measurement
+        self.classes[light_level] = class_
+        await self.emit(
+            SearchEvent(SearchEvents.MEASURED, light_level, measurement, class_)
+        )
+        return measurement, class_
+
+    async def _measure_sequentially(self):
+        lower_bound = (1 - self.target_tolerance) * self.target
+        upper_bound = (1 + self.target_tolerance) * self.target
+        analyses = []
+
+        def stop(captured):
+            analyses[:] = captured
+            return self.sampler.is_decided(
+                analyses, lower_bound, upper_bound, self.flat_sd_threshold
+            )
+
+        measurement = await self.measurement.measure(
+            self.mode, self.sampler.max_samples, stop
+        )
+        self.sampler.record(analyses, self.flat_sd_threshold)
+        frames_saved = self.sampler.max_samples - measurement.samples
+        self.frames_saved += frames_saved
+        logging.info(
+            f"Decided after {measurement.samples} of {self.sampler.max_samples} captures, {frames_saved} saved"
+        )
+        return measurement
+
+    async def confirm_oscillation(self, closest_level, difference):
+        """
+        Sets the closest light level found and asks whether to go on searching.
+        """
+        await self.actuator.set_light_level(closest_level)
+        if difference < 0:
+            message = f"Current light level is too low. The closest level is {closest_level}. The difference is {round(difference, 2)} mV. Move the scope closer to the target?"
+        else:
+            message = f"Current light level is too high. The closest level is {closest_level}. The difference is {round(difference, 2)} mV. Move the scope further away from the target?"
+        event = SearchEvent(
+            SearchEvents.OSCILLATION,
+            closest_level,
+            self.measurements.get(closest_level),
+            self.classes.get(closest_level),
+            message,
+        )
+        await self.emit(event)
+        if self.confirm is None:
+            return False
+        result = self.confirm(event)
+        if inspect.isawaitable(result):
+            result = await result
+        if result:
+            # the scope is moved, the measurements so far no longer apply
+            self.measurements.clear()
+            self.classes.clear()
+            self.discard_prior("the scope has been moved")
+        return bool(result)
+
+    async def run(self, target, mode=CalculationConstants.NOISE_MODE, calibration_key=None):
+        """
+        Searches the light level for target (mV) and returns a SearchResult.
+        """
+        self.target = target
+        self.mode = mode
+        self._reset()
+        calibration_key = calibration_key if self.calibration is not None else None
+        if calibration_key is not None:
+            self.prior = self.calibration.get(calibration_key)
+        warm_started = bool(self.prior)
+        tic = time.perf_counter()
+        await self.emit(SearchEvent(SearchEvents.STARTED, message=f"Target: {target} mV"))
+
+        light_level = await self.strategy.search(self, target)
+
+        if calibration_key is not None and self.response_points():
+            self.calibration.put(
+                calibration_key, self.response_points(), replace=self.prior_discarded
+            )
+
+        measurement = self.measurements.get(light_level)
+        class_ = self.classes.get(light_level)
+        result = SearchResult(
+            light_level,
+            measurement.mv if measurement is not None else None,
+            class_ == 2,
+            self.probes,
+            self.captures,
+            round(time.perf_counter() - tic, 3),
+            self.frames_saved,
+            warm_started,
+            round(self.settle_seconds, 3),
+        )
+        await self.emit(
+            SearchEvent(SearchEvents.FINISHED, light_level, measurement, class_)
+        )
+        logging.debug(f"Light level search result: {result}")
+        return result
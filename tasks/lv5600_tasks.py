@@ -1,7 +1,19 @@
-from commands.command_utils import CaptureCommand, InputCommand, PresetCommand,SYSCommand,WFMCommand
+from commands.command_utils import CaptureCommand, PresetCommand,SYSCommand,WFMCommand
+import asyncio
+import inspect
 import logging
+import re
+from functools import partial
+import time
+import numpy as np
 import Constants
+from controllers.telnet_controller import TelnetBatchError
 from config.application_config import AppConfig
+from utils.bmp_utils import decode_bmp
+
+LEVEL_RESPONSE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
 class LV5600Tasks:
 
     @staticmethod
@@ -15,86 +27,44 @@ class LV5600Tasks:
             logging.debug("The response is " + str(response))
             raise Exception("Error initializing LV5600: " + str(e))
     
+        # the remaining settings are independent of each other, so they are
+        # pipelined in a single batch instead of one round trip per command
+        settings = [
+            (WFMCommand.wfm_line_select("ON"), "Error enabling waveform line"),
+            (
+                WFMCommand.wfm_line_number(int(app_config.get_line_number())),
+                "Error setting waveform line number",
+            ),
+            (WFMCommand.wfm_matrix_ycbcr("RGB"), "Error setting waveform matrix"),
+            (WFMCommand.wfm_mode_rgb("R", "OFF"), "Error setting waveform mode"),
+            (WFMCommand.wfm_mode_rgb("G", "ON"), "Error setting waveform mode"),
+            (WFMCommand.wfm_mode_rgb("B", "OFF"), "Error setting waveform mode"),
+            (WFMCommand.wfm_cursor("SINGLE"), "Error setting waveform cursor"),
+            (
+                WFMCommand.wfm_cursor_height("Y", "DELTA", 0),
+                "Error setting waveform cursor height",
+            ),
+            (
+                WFMCommand.wfm_cursor_height("Y", "REF", 0),
+                "Error setting waveform cursor height",
+            ),
+            (WFMCommand.wfm_cursor_unit("Y", "MV"), "Error setting waveform cursor unit"),
+            (WFMCommand.wfm_cursor_value("ON"), "Error setting waveform cursor value"),
+        ]
         try:
-            response = await telnet_client.send_command(WFMCommand.wfm_line_select("ON"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error enabling waveform line: " + str(e))
-
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_line_number(int(app_config.get_line_number())))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform line number: " + str(e))
-    
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_matrix_ycbcr("RGB"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform matrix: " + str(e))
-        
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_mode_rgb("R","OFF"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform mode: " + str(e))
-        
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_mode_rgb("G","ON"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform mode: " + str(e))
-
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_mode_rgb("B","OFF"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform mode: " + str(e))
-        
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_cursor("SINGLE"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform cursor: " + str(e))
-        
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_cursor_height("Y","DELTA",0))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform cursor height: " + str(e))
-        
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_cursor_height("Y","REF",0))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform cursor height: " + str(e))
-        
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_cursor_unit("Y","MV"))
-            logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform cursor unit: " + str(e))
+            responses = await telnet_client.send_batch(
+                [command for command, _ in settings]
+            )
+        except TelnetBatchError as e:
+            for response in e.responses:
+                logging.debug("The response is " + str(response))
+            raise Exception(settings[e.index][1] + ": " + str(e))
 
-        try:
-            response = await telnet_client.send_command(WFMCommand.wfm_cursor_value("ON"))
+        for response in responses:
             logging.debug("The response is " + str(response))
-        except Exception as e:
-            logging.debug("The response is " + str(response))
-            raise Exception("Error setting waveform cursor value: " + str(e))
-
         
     @staticmethod
-    async def capture_n_send_bmp(telnet_client,ftp_client,file_path) -> bool:
+    async def capture_bmp(telnet_client):
         response = None
         # capture
         try:
@@ -114,9 +84,15 @@ class LV5600Tasks:
             logging.debug("The response is " + str(response))
             raise Exception("Error making waveform: " + str(e))
 
+    @staticmethod
+    async def capture_n_send_bmp(telnet_client,ftp_client,file_path) -> bool:
+        await LV5600Tasks.capture_bmp(telnet_client)
+
         # send
         try:
-            ftp_client.get_file(Constants.FTPConstants.FTP_FILE_NAME_BMP,file_path)
+            result = ftp_client.get_file(Constants.FTPConstants.FTP_FILE_NAME_BMP,file_path)
+            if inspect.isawaitable(result):
+                await result
             logging.debug("File downloaded from FTP")
         except Exception as e:
             logging.error("Error downloading file from FTP: " + str(e))
@@ -124,6 +100,62 @@ class LV5600Tasks:
 
         return True
 
+    @staticmethod
+    async def capture_n_fetch_bmp(telnet_client, ftp_client, buffer) -> memoryview:
+        """
+        Captures the screen and downloads the BMP into buffer (a bytearray)
+        instead of a local file. Returns a memoryview of the received bytes.
+        """
+        await LV5600Tasks.capture_bmp(telnet_client)
+
+        # fetch
+        try:
+            received = ftp_client.get_into(Constants.FTPConstants.FTP_FILE_NAME_BMP, buffer)
+            # the asyncio FTP client returns a coroutine, the ftplib one the result
+            if inspect.isawaitable(received):
+                received = await received
+            logging.debug(f"{received} bytes downloaded from FTP")
+        except Exception as e:
+            logging.error("Error downloading file from FTP: " + str(e))
+            raise Exception("Error downloading file from FTP: " + str(e))
+
+        return memoryview(buffer)[:received]
+
+    @staticmethod
+    async def query_level(
+        telnet_client, priority=Constants.TelnetConstants.PRIORITY_NORMAL
+    ):
+        """
+        Reads the waveform level with a Telnet query instead of a screen
+        capture.
+
+        Args:
+            priority (int): The scheduler priority of the query,
+                TelnetConstants.PRIORITY_LOW for background polling.
+
+        Returns:
+            tuple: The level in mV and its standard deviation.
+
+        Raises:
+            Exception: If the query fails or the instrument does not answer
+                with a level, e.g. because its firmware lacks the query.
+        """
+        response = None
+        try:
+            response = await telnet_client.send_command(
+                WFMCommand.wfm_measure_level(), priority
+            )
+            logging.debug("The response is " + str(response))
+            if isinstance(response, bytes):
+                response = response.decode("latin-1")
+            values = [float(value) for value in LEVEL_RESPONSE.findall(response)]
+        except Exception as e:
+            logging.debug("The response is " + str(response))
+            raise Exception("Error querying waveform level: " + str(e))
+        if "ERROR" in response.upper() or len(values) < 2:
+            raise Exception("Error querying waveform level: " + response.strip("\r\n$ "))
+        return values[0], values[1]
+
     @staticmethod
     async def recall_preset(telnet_client, preset_number):
         preset_number = int(preset_number)
@@ -137,23 +169,47 @@ class LV5600Tasks:
             raise Exception("Error recalling preset: " + str(e))
         
     @staticmethod
-    async def scale_and_cursor(telnet_client, turn_on: bool, target_cursor_value=None):
-        response = None
+    def scale_and_cursor_commands(turn_on, target_cursor_value=None):
+        if turn_on:
+            commands = [WFMCommand.wfm_scale_inten(0)]
+            if target_cursor_value is not None:
+                commands.append(
+                    WFMCommand.wfm_cursor_height("Y", "DELTA", int(target_cursor_value))
+                )
+            return commands
+        return [
+            WFMCommand.wfm_scale_inten(-8),
+            WFMCommand.wfm_cursor_height("Y", "DELTA", 0),
+        ]
+
+    @staticmethod
+    async def abort(telnet_client):
+        """
+        Drops the Telnet commands still waiting and shows the scale and cursor
+        a capture may have hidden, ahead of anything queued meanwhile.
+        """
         try:
-            if turn_on:
-                response = await telnet_client.send_command(WFMCommand.wfm_scale_inten(0))
+            responses = await telnet_client.abort(LV5600Tasks.scale_and_cursor_commands(True))
+            for response in responses:
                 logging.debug("The response is " + str(response))
-                if target_cursor_value is not None:
-                    response = await telnet_client.send_command(
-                        WFMCommand.wfm_cursor_height("Y", "DELTA", int(target_cursor_value))
-                    )
-                    logging.debug("The response is " + str(response))
-            else:
-                response = await telnet_client.send_command(WFMCommand.wfm_scale_inten(-8))
-                logging.debug("The response is " + str(response))
-                response = await telnet_client.send_command(
-                    WFMCommand.wfm_cursor_height("Y", "DELTA", 0)
-                )
+        except Exception as e:
+            logging.error(f"An error occurred while trying to abort the Telnet commands: {e}")
+            return False
+
+        return True
+
+    @staticmethod
+    async def scale_and_cursor(
+        telnet_client,
+        turn_on: bool,
+        target_cursor_value=None,
+        priority=Constants.TelnetConstants.PRIORITY_NORMAL,
+    ):
+        try:
+            responses = await telnet_client.send_batch(
+                LV5600Tasks.scale_and_cursor_commands(turn_on, target_cursor_value), priority
+            )
+            for response in responses:
                 logging.debug("The response is " + str(response))
         except Exception as e:
             logging.error(f"An error occurred while trying to turn {'on' if turn_on else 'off'} the scale and cursor: {e}")
@@ -175,4 +231,287 @@ class LV5600Tasks:
 
         return True
         
-        
\ No newline at end of file
+        
+
+
+class CapturePipeline:
+    """
+    Captures, downloads and analyzes a sequence of frames with the stages of
+    consecutive frames overlapped instead of run one frame after another.
+
+    Every stage (trigger, make, fetch, decode, analyze) runs as its own task,
+    connected to the next one by a bounded queue. The instrument holds a single
+    captured screen and a single cap_bmp.bmp, so a frame is only triggered once
+    the previous one has been made, and only made once the previous file has
+    been fetched. The next capture therefore runs on the instrument while the
+    previous frame is downloaded, decoded and analyzed.
+
+    Usage:
+        pipeline = CapturePipeline(telnet_client, ftp_client, analyze)
+        results = await pipeline.run(frame_count)
+        results = await pipeline.run(max_frame_count, stop)  # until stop(results)
+        stats = pipeline.get_stats()
+    """
+
+    STAGES = ("trigger", "make", "fetch", "decode", "analyze")
+
+    def __init__(
+        self,
+        telnet_client,
+        ftp_client,
+        analyze,
+        decode=None,
+        on_result=None,
+        queue_size=Constants.PipelineConstants.QUEUE_SIZE,
+        executor=None,
+        cache=None,
+        cache_context=None,
+    ):
+        """
+        Args:
+            telnet_client (TelnetController): The connected Telnet client.
+            ftp_client: An FTP client or session providing get_into, either blocking or async.
+            analyze (callable): analyze(frame) -> result, run in executor so it
+                overlaps with the I/O of the next frame. A coroutine function
+                (e.g. AnalysisExecutor.analyze) is awaited instead.
+            decode (callable): decode(data, slot) -> frame, defaults to decode_bmp.
+                slot identifies the capture buffer holding data, so a decoder
+                that writes files can use one file per buffer.
+            on_result (callable): on_result(index, frame, result), called as
+                soon as a frame is analyzed, e.g. to display it. The frame is
+                only valid during the call.
+            queue_size (int): The number of frames that can wait between two stages.
+            executor: The executor analyze runs in, None for the loop default.
+            cache (AnalysisCache): Results of frames already analyzed, looked
+                up by the content of the frame before analyze runs.
+            cache_context (tuple): (mode, flat_pixel_count) of analyze, part
+                of the cache key.
+        """
+        self.telnet_client = telnet_client
+        self.ftp_client = ftp_client
+        self.analyze = analyze
+        self.decode = decode
+        self.on_result = on_result
+        self.queue_size = queue_size
+        self.executor = executor
+        self.cache = cache
+        self.cache_context = cache_context
+        # a buffer is in use from fetch until the frame is analyzed
+        self.buffers = [
+            bytearray(Constants.FTPConstants.BMP_FILE_SIZE)
+            for _ in range(queue_size + 2)
+        ]
+        self.latencies = {stage: [] for stage in self.STAGES}
+        self.queue_depths = {stage: [] for stage in self.STAGES}
+        self.elapsed = 0.0
+        self.frame_count = 0
+
+    def _record_latency(self, stage, tic):
+        self.latencies[stage].append(time.perf_counter() - tic)
+
+    async def _trigger(self, item):
+        if self.frames_in_flight is not None:
+            await self.frames_in_flight.acquire()
+        await self.capture_slot.acquire()
+        if self.stopping:
+            # frames already triggered still run through the pipeline
+            self.capture_slot.release()
+            return None
+        tic = time.perf_counter()
+        async with self.telnet_lock:
+            response = await self.telnet_client.send_command(
+                CaptureCommand.take_snapshot()
+            )
+        logging.debug("The response is " + str(response))
+        self._record_latency("trigger", tic)
+        return item
+
+    async def _make(self, item):
+        await self.file_slot.acquire()
+        tic = time.perf_counter()
+        async with self.telnet_lock:
+            response = await self.telnet_client.send_command(
+                CaptureCommand.make("CAP_BMP")
+            )
+        logging.debug("The response is " + str(response))
+        # the captured screen is in the file now, the next frame can be triggered
+        self.capture_slot.release()
+        self._record_latency("make", tic)
+        return item
+
+    async def _fetch(self, item):
+        slot = await self.free_slots.get()
+        tic = time.perf_counter()
+        received = self.ftp_client.get_into(
+            Constants.FTPConstants.FTP_FILE_NAME_BMP, self.buffers[slot]
+        )
+        if inspect.isawaitable(received):
+            received = await received
+        # the file has been read, the next frame can be made
+        self.file_slot.release()
+        item["slot"] = slot
+        item["data"] = memoryview(self.buffers[slot])[:received]
+        self._record_latency("fetch", tic)
+        return item
+
+    async def _decode(self, item):
+        tic = time.perf_counter()
+        if self.decode is None:
+            item["frame"] = decode_bmp(item["data"])
+        else:
+            item["frame"] = self.decode(item["data"], item["slot"])
+        if self.cache is not None:
+            # the cache is keyed by the pixels, decoded once for the key and
+            # the analysis unless decode returns something else (a file path)
+            if isinstance(item["frame"], np.ndarray):
+                item["pixels"] = item["frame"]
+            else:
+                item["pixels"] = decode_bmp(item["data"])
+        self._record_latency("decode", tic)
+        return item
+
+    async def _compute(self, frame):
+        if inspect.iscoroutinefunction(self.analyze):
+            return await self.analyze(frame)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.analyze, frame)
+
+    async def _analyze(self, item):
+        tic = time.perf_counter()
+        if self.cache is None:
+            result = await self._compute(item["frame"])
+        else:
+            result = await self.cache.analyze_async(
+                item.pop("pixels"),
+                *self.cache_context,
+                partial(self._compute, item["frame"]),
+            )
+        self._record_latency("analyze", tic)
+        if self.on_result is not None:
+            self.on_result(item["index"], item["frame"], result)
+        # drop the views on the buffer before handing it back to fetch
+        item["frame"] = None
+        item["data"] = None
+        self.free_slots.put_nowait(item.pop("slot"))
+        self.results[item["index"]] = result
+        if self.stop is not None and not self.stopping:
+            self.stopping = self.stop(self.results[: item["index"] + 1])
+        if self.frames_in_flight is not None:
+            self.frames_in_flight.release()
+        return item
+
+    async def _run_stage(self, stage, work, inbox, outbox, next_stage):
+        while True:
+            item = await inbox.get()
+            if item is None:
+                break
+            try:
+                item = await work(item)
+            except Exception as e:
+                logging.error(f"Error in capture stage {stage}: {str(e)}")
+                raise Exception(f"Error in capture stage {stage}: {str(e)}") from e
+            if item is None:
+                break
+            if outbox is not None:
+                await outbox.put(item)
+                self.queue_depths[next_stage].append(outbox.qsize())
+        if outbox is not None:
+            await outbox.put(None)
+
+    async def run(self, frame_count, stop=None):
+        """
+        Captures and analyzes frame_count frames.
+
+        Args:
+            frame_count (int): The number of frames to capture.
+            stop (callable): stop(results) -> bool, called with the results so
+                far after every analyzed frame. Once it returns True no
+                further frames are triggered; frames already triggered are
+                still analyzed. To keep those few, only STOP_LOOKAHEAD frames
+                are triggered ahead of the analysis.
+
+        Returns:
+            list: The analysis results, in capture order.
+
+        Raises:
+            Exception: If a stage fails. The other stages are cancelled.
+        """
+        self.frame_count = frame_count
+        self.results = [None] * frame_count
+        self.stop = stop
+        self.stopping = False
+        self.frames_in_flight = (
+            asyncio.Semaphore(Constants.PipelineConstants.STOP_LOOKAHEAD + 1)
+            if stop is not None
+            else None
+        )
+        self.telnet_lock = asyncio.Lock()
+        self.capture_slot = asyncio.Semaphore(1)
+        self.file_slot = asyncio.Semaphore(1)
+        self.free_slots = asyncio.Queue()
+        for slot in range(len(self.buffers)):
+            self.free_slots.put_nowait(slot)
+
+        inbox = asyncio.Queue()
+        for index in range(frame_count):
+            inbox.put_nowait({"index": index})
+        inbox.put_nowait(None)
+        queues = [inbox] + [
+            asyncio.Queue(maxsize=self.queue_size) for _ in self.STAGES[1:]
+        ] + [None]
+        works = [self._trigger, self._make, self._fetch, self._decode, self._analyze]
+        next_stages = list(self.STAGES[1:]) + [None]
+
+        tic = time.perf_counter()
+        tasks = [
+            asyncio.ensure_future(
+                self._run_stage(stage, work, queues[i], queues[i + 1], next_stages[i])
+            )
+            for i, (stage, work) in enumerate(zip(self.STAGES, works))
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # stop the remaining stages before the clients are used elsewhere.
+            # asyncio.wait_for can swallow a cancellation (bpo-42130), so keep
+            # cancelling until every stage has stopped
+            pending = [task for task in tasks if not task.done()]
+            while pending:
+                for task in pending:
+                    task.cancel()
+                _, pending = await asyncio.wait(pending, timeout=0.1)
+            self.elapsed = time.perf_counter() - tic
+        if self.stopping:
+            self.results = [result for result in self.results if result is not None]
+            self.frame_count = len(self.results)
+        logging.debug(f"Capture pipeline statistics: {self.get_stats()}")
+        return self.results
+
+    def get_stats(self):
+        """
+        Returns the throughput of the last run and, for every stage, its mean
+        and maximum latency in ms and the mean and maximum depth of its input queue.
+        """
+        stages = {}
+        for stage in self.STAGES:
+            latencies = self.latencies[stage]
+            depths = self.queue_depths[stage]
+            stages[stage] = {
+                "count": len(latencies),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2)
+                if latencies
+                else 0.0,
+                "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+                "mean_queue_depth": round(sum(depths) / len(depths), 2)
+                if depths
+                else 0.0,
+                "max_queue_depth": max(depths) if depths else 0,
+            }
+        return {
+            "frames": self.frame_count,
+            "seconds": round(self.elapsed, 3),
+            "frames_per_second": round(self.frame_count / self.elapsed, 2)
+            if self.elapsed > 0
+            else 0.0,
+            "stages": stages,
+        }
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from controllers.analysis_cache import DEFAULT_ROI, AnalysisCache
+
+MODE = 0
+FLAT_PIXEL_COUNT = 10
+
+
+class CountingCompute:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+class AnalysisCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = AnalysisCache()
+        self.frame = np.zeros((1080, 1920, 3), np.uint8)
+
+    def analyze(self, compute, **kwargs):
+        return self.cache.analyze(self.frame, MODE, FLAT_PIXEL_COUNT, compute, **kwargs)
+
+    def test_identical_frame_is_not_analyzed_again(self):
+        compute = CountingCompute("result")
+        self.assertEqual(self.analyze(compute), "result")
+        self.assertEqual(self.analyze(compute), "result")
+        self.assertEqual(compute.calls, 1)
+        roi_x1, _, roi_y1, _ = DEFAULT_ROI
+        self.frame[roi_y1, roi_x1] = 255
+        self.analyze(compute)
+        self.assertEqual(compute.calls, 2)
+
+    def test_uncached_call_analyzes_afresh(self):
+        self.analyze(CountingCompute("cached"))
+        compute = CountingCompute("fresh")
+        self.assertEqual(self.analyze(compute, use_cache=False), "fresh")
+        self.assertEqual(self.analyze(compute), "cached")
+        self.assertEqual(self.cache.get_stats()["bypassed"], 1)
+
+    async def test_awaitable_compute_is_awaited_and_cached(self):
+        calls = []
+
+        async def compute():
+            calls.append(None)
+            return "result"
+
+        for _ in range(2):
+            result = await self.cache.analyze_async(
+                self.frame, MODE, FLAT_PIXEL_COUNT, compute
+            )
+            self.assertEqual(result, "result")
+        self.assertEqual(len(calls), 1)
+        # a plain compute works as well
+        result = await self.cache.analyze_async(
+            self.frame, MODE, FLAT_PIXEL_COUNT, lambda: "fresh", use_cache=False
+        )
+        self.assertEqual(result, "fresh")
+
+
+if __name__ == "__main__":
+    unittest.main()
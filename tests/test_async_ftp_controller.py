@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+from Constants import FTPConstants
+from controllers.async_ftp_controller import AsyncFTPController
+from controllers.ftp_session_controller import AsyncFTPSession
+from simulator.lv5600_simulator import LV5600Simulator, SimulatorConfig
+
+
+class AsyncFTPControllerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # a round trip time lets concurrent command sequences overlap
+        self.simulator = LV5600Simulator(
+            SimulatorConfig(telnet_port=0, ftp_port=0, rtt=0.002, seed=0)
+        )
+        await self.simulator.start()
+        config = self.simulator.config
+        self.data = bytes(range(256)) * 1000
+        self.simulator.files[FTPConstants.FTP_FILE_NAME_BMP] = self.data
+        self.client = AsyncFTPController(
+            config.host, config.username, config.password, config.ftp_port
+        )
+        await self.client.connect()
+
+    async def asyncTearDown(self):
+        if self.client.ftp is not None:
+            await self.client.close()
+        await self.simulator.stop()
+
+    async def test_get_into(self):
+        buffer = bytearray(len(self.data))
+        received = await self.client.get_into(FTPConstants.FTP_FILE_NAME_BMP, buffer)
+        self.assertEqual(received, len(self.data))
+        self.assertEqual(bytes(buffer), self.data)
+
+    async def test_get_into_extends_a_small_buffer(self):
+        buffer = bytearray(1000)
+        received = await self.client.get_into(FTPConstants.FTP_FILE_NAME_BMP, buffer)
+        self.assertEqual(received, len(self.data))
+        self.assertEqual(bytes(buffer), self.data)
+
+    async def test_concurrent_transfers_do_not_interleave(self):
+        buffers = [bytearray(len(self.data)) for _ in range(4)]
+        received = await asyncio.gather(
+            *(self.client.get_into(FTPConstants.FTP_FILE_NAME_BMP, buffer) for buffer in buffers),
+            self.client.is_connected(),
+        )
+        self.assertEqual(received, [len(self.data)] * 4 + [True])
+        for buffer in buffers:
+            self.assertEqual(bytes(buffer), self.data)
+        self.assertEqual(self.client.get_transfer_stats()["transfers"], 4)
+
+    async def test_concurrent_session_users_connect_once(self):
+        await self.client.close()
+        session = AsyncFTPSession(self.client)
+        buffers = [bytearray(len(self.data)) for _ in range(3)]
+        await asyncio.gather(
+            *(session.get_into(FTPConstants.FTP_FILE_NAME_BMP, buffer) for buffer in buffers)
+        )
+        self.assertEqual(session.get_stats()["connects"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
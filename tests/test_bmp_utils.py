@@ -0,0 +1,114 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from utils.bmp_utils import BGRX_MASKS, decode_bmp, map_bmp, parse_bmp_header
+
+
+def random_pixels(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def pil_bmp(bgr):
+    """
+    Returns a 24 bit bottom-up BMP of the BGR pixels, written by PIL.
+    """
+    output = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(bgr[:, :, ::-1])).save(output, format="BMP")
+    return output.getvalue()
+
+
+def bitfields_bmp(bgr, masks=BGRX_MASKS, top_down=False, bits_per_pixel=32):
+    """
+    Returns a BI_BITFIELDS BMP of the BGR pixels stored as B, G, R, X.
+    """
+    height, width = bgr.shape[:2]
+    rows = np.zeros((height, width, 4), np.uint8)
+    rows[:, :, :3] = bgr
+    if not top_down:
+        rows = rows[::-1]
+    pixel_data = rows.tobytes()
+    return (
+        b"BM"
+        + struct.pack(
+            "<IHHIIiiHHIIiiII",
+            66 + len(pixel_data),
+            0,
+            0,
+            66,
+            40,
+            width,
+            -height if top_down else height,
+            1,
+            bits_per_pixel,
+            3,
+            len(pixel_data),
+            2835,
+            2835,
+            0,
+            0,
+        )
+        + struct.pack("<III", *masks)
+        + pixel_data
+    )
+
+
+class DecodeBmpTest(unittest.TestCase):
+    def test_24_bit_bottom_up_with_row_padding(self):
+        # 3 pixels of 3 bytes pad every row by 3 bytes
+        bgr = random_pixels(5, 3)
+        data = pil_bmp(bgr)
+        header = parse_bmp_header(data)
+        self.assertEqual((header.width, header.rows, header.bits_per_pixel), (3, 5, 24))
+        self.assertEqual(header.row_stride, 12)
+        np.testing.assert_array_equal(decode_bmp(data), bgr)
+
+    def test_decode_is_a_view(self):
+        data = bytearray(pil_bmp(random_pixels(4, 4)))
+        pixels = decode_bmp(data)
+        self.assertFalse(pixels.flags.writeable)
+        data[-1] ^= 0xFF
+        # the first stored row is the bottom row
+        self.assertEqual(pixels[0, -1, 2], data[-1])
+
+    def test_32_bit_bitfields(self):
+        bgr = random_pixels(6, 7, seed=1)
+        np.testing.assert_array_equal(decode_bmp(bitfields_bmp(bgr)), bgr)
+        np.testing.assert_array_equal(decode_bmp(bitfields_bmp(bgr, top_down=True)), bgr)
+
+    def test_bitfields_with_other_channel_order_are_rejected(self):
+        bgr = random_pixels(2, 2)
+        rgbx = (0x000000FF, 0x0000FF00, 0x00FF0000)
+        with self.assertRaisesRegex(ValueError, "channel masks"):
+            parse_bmp_header(bitfields_bmp(bgr, masks=rgbx))
+        with self.assertRaisesRegex(ValueError, "Unsupported BMP format"):
+            parse_bmp_header(bitfields_bmp(bgr, bits_per_pixel=24))
+
+    def test_unsupported_data_is_rejected(self):
+        data = bytearray(pil_bmp(random_pixels(2, 2)))
+        with self.assertRaisesRegex(ValueError, "Invalid BMP data"):
+            parse_bmp_header(b"PK" + bytes(data[2:]))
+        with self.assertRaisesRegex(ValueError, "Invalid BMP data"):
+            parse_bmp_header(data[:20])
+        struct.pack_into("<I", data, 30, 1)  # BI_RLE8
+        with self.assertRaisesRegex(ValueError, "compression 1"):
+            parse_bmp_header(data)
+
+    def test_map_bmp(self):
+        bgr = random_pixels(8, 5, seed=2)
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "capture.bmp")
+            with open(file_path, "wb") as file:
+                file.write(pil_bmp(bgr))
+            pixels = map_bmp(file_path)
+            np.testing.assert_array_equal(pixels, bgr)
+            del pixels  # closes the mapping, so the directory can be removed
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from tasks.calibration_tasks import (
+    LightCalibrationCache,
+    fit_monotone,
+    predict_light_level,
+    predict_mv,
+)
+
+
+class FitMonotoneTest(unittest.TestCase):
+    def test_monotone_points_are_kept(self):
+        points = [(30, 300.0), (10, 100.0), (20, 200.0)]
+        self.assertEqual(fit_monotone(points), [(10, 100.0), (20, 200.0), (30, 300.0)])
+
+    def test_adjacent_violators_are_pooled(self):
+        points = [(10, 100.0), (20, 220.0), (30, 180.0), (40, 400.0)]
+        self.assertEqual(
+            fit_monotone(points), [(10, 100.0), (25, 200.0), (40, 400.0)]
+        )
+
+    def test_pooling_cascades_backwards(self):
+        # pooling 30 and 40 makes the block smaller than 20, which joins it
+        points = [(10, 100.0), (20, 300.0), (30, 290.0), (40, 100.0)]
+        self.assertEqual(fit_monotone(points), [(10, 100.0), (30, 230.0)])
+
+    def test_result_is_non_decreasing(self):
+        points = [(level, (level * 37) % 101) for level in range(1, 60)]
+        mvs = [mv for _, mv in fit_monotone(points)]
+        self.assertEqual(mvs, sorted(mvs))
+
+
+class PredictTest(unittest.TestCase):
+    def test_power_law_is_followed(self):
+        # mV = 2 * level ** 1.5
+        points = [(level, 2 * level**1.5) for level in (16, 64, 144)]
+        self.assertAlmostEqual(predict_mv(points, 100), 2000.0)
+        self.assertAlmostEqual(predict_light_level(points, 2000.0), 100.0)
+        # extrapolated with the secant of the closest points
+        self.assertAlmostEqual(predict_light_level(points, 2 * 196**1.5), 196.0)
+
+    def test_single_point_is_proportional(self):
+        self.assertAlmostEqual(predict_light_level([(100, 400.0)], 200.0), 50.0)
+
+    def test_no_prediction_without_points(self):
+        self.assertIsNone(predict_light_level([], 200.0))
+        self.assertIsNone(predict_light_level([(0, 0.0)], 200.0))
+
+
+class LightCalibrationCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_path = os.path.join(directory.name, "light_calibration.json")
+        self.key = LightCalibrationCache.make_key("scope", 1, 0, 0, 100)
+
+    def test_points_are_merged_and_persisted(self):
+        cache = LightCalibrationCache(self.file_path)
+        cache.put(self.key, [(10, 100.0), (20, 200.0)])
+        cache.put(self.key, [(20, 210.0), (30, 300.0)])
+        expected = [(10, 100.0), (20, 210.0), (30, 300.0)]
+        self.assertEqual(cache.get(self.key), expected)
+        self.assertEqual(LightCalibrationCache(self.file_path).get(self.key), expected)
+
+    def test_replace_drops_the_stored_points(self):
+        cache = LightCalibrationCache(self.file_path)
+        cache.put(self.key, [(10, 100.0), (20, 200.0)])
+        cache.put(self.key, [(30, 300.0)], replace=True)
+        self.assertEqual(cache.get(self.key), [(30, 300.0)])
+
+    def test_most_recent_points_are_kept(self):
+        cache = LightCalibrationCache(self.file_path, max_points=2)
+        cache.put(self.key, [(10, 100.0), (20, 200.0)])
+        cache.put(self.key, [(10, 110.0)])
+        self.assertEqual(cache.get(self.key), [(20, 200.0), (10, 110.0)])
+
+    def test_expired_points_are_dropped(self):
+        cache = LightCalibrationCache(self.file_path, max_age=60)
+        cache.put(self.key, [(10, 100.0)])
+        cache.entries[self.key]["updated"] = time.time() - 120
+        self.assertIsNone(cache.get(self.key))
+        self.assertNotIn(self.key, LightCalibrationCache(self.file_path).entries)
+
+    def test_broken_file_starts_empty(self):
+        with open(self.file_path, "w") as file:
+            file.write("{broken")
+        with self.assertLogs(level="WARNING"):
+            cache = LightCalibrationCache(self.file_path)
+        self.assertIsNone(cache.get(self.key))
+        cache.put(self.key, [(10, 100.0)])
+        with open(self.file_path) as file:
+            self.assertEqual(json.load(file)[self.key]["points"], [[10, 100.0]])
+
+    def test_memory_only_cache_writes_no_file(self):
+        cache = LightCalibrationCache(None)
+        cache.put(self.key, [(10, 100.0)])
+        self.assertEqual(cache.get(self.key), [(10, 100.0)])
+        self.assertFalse(os.path.exists(self.file_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from Constants import TelnetConstants
+from controllers.command_scheduler import CommandAbortedError, CommandScheduler
+
+
+class CommandSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.exchanged = []
+        self.release = asyncio.Event()
+        self.scheduler = CommandScheduler(self.exchange)
+
+    async def asyncTearDown(self):
+        await self.scheduler.stop()
+
+    async def exchange(self, commands, batch):
+        # the first exchange holds the stream until released
+        if not self.exchanged:
+            self.exchanged.append(commands[0])
+            await self.release.wait()
+        else:
+            self.exchanged.append(commands[0])
+        return [b"$"] * len(commands)
+
+    async def submit_while_busy(self, requests):
+        busy = asyncio.create_task(self.scheduler.submit(["BUSY"]))
+        await asyncio.sleep(0)
+        tasks = [
+            asyncio.create_task(self.scheduler.submit([command], priority=priority))
+            for command, priority in requests
+        ]
+        await asyncio.sleep(0)
+        return busy, tasks
+
+    async def test_requests_go_by_priority(self):
+        busy, tasks = await self.submit_while_busy(
+            [
+                ("LOW ?", TelnetConstants.PRIORITY_LOW),
+                ("NORMAL", TelnetConstants.PRIORITY_NORMAL),
+                ("ABORT", TelnetConstants.PRIORITY_ABORT),
+            ]
+        )
+        self.release.set()
+        await asyncio.gather(busy, *tasks)
+        self.assertEqual(self.exchanged, ["BUSY", "ABORT", "NORMAL", "LOW ?"])
+
+    async def test_abort_fails_the_waiting_requests(self):
+        busy, tasks = await self.submit_while_busy(
+            [("NORMAL", TelnetConstants.PRIORITY_NORMAL)]
+        )
+        self.scheduler.abort()
+        restore = asyncio.create_task(
+            self.scheduler.submit(["RESTORE"], priority=TelnetConstants.PRIORITY_ABORT)
+        )
+        self.release.set()
+        with self.assertRaises(CommandAbortedError):
+            await tasks[0]
+        await asyncio.gather(busy, restore)
+        self.assertEqual(self.exchanged, ["BUSY", "RESTORE"])
+
+    async def test_identical_pending_requests_are_merged(self):
+        busy, tasks = await self.submit_while_busy(
+            [
+                ("LEVEL ?", TelnetConstants.PRIORITY_NORMAL),
+                ("LEVEL ?", TelnetConstants.PRIORITY_NORMAL),
+            ]
+        )
+        self.release.set()
+        responses = await asyncio.gather(*tasks)
+        await busy
+        self.assertEqual(responses, [[b"$"], [b"$"]])
+        self.assertEqual(self.exchanged, ["BUSY", "LEVEL ?"])
+        self.assertEqual(self.scheduler.stats["merged"], 1)
+
+    async def test_query_is_not_merged_across_a_later_write(self):
+        busy, tasks = await self.submit_while_busy(
+            [
+                ("LEVEL ?", TelnetConstants.PRIORITY_NORMAL),
+                ("LEVEL 100", TelnetConstants.PRIORITY_NORMAL),
+                ("LEVEL ?", TelnetConstants.PRIORITY_NORMAL),
+            ]
+        )
+        self.release.set()
+        await asyncio.gather(busy, *tasks)
+        self.assertEqual(self.exchanged, ["BUSY", "LEVEL ?", "LEVEL 100", "LEVEL ?"])
+        self.assertEqual(self.scheduler.stats["merged"], 0)
+
+    async def test_request_past_its_deadline_is_dropped(self):
+        busy, _ = await self.submit_while_busy([])
+        late = asyncio.create_task(self.scheduler.submit(["LATE"], timeout=0.01))
+        with self.assertRaises(asyncio.TimeoutError):
+            await late
+        with self.assertLogs(level="WARNING"):
+            self.release.set()
+            await busy
+            # the worker drops the request when its turn comes
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.exchanged, ["BUSY"])
+        self.assertEqual(self.scheduler.stats["expired"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
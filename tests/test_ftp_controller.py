@@ -0,0 +1,175 @@
+import ftplib
+import unittest
+
+from controllers.ftp_controller import FTPController
+from controllers.ftp_session_controller import FTPSession
+
+
+class FakeFTP:
+    """
+    Stands in for ftplib.FTP on the control connection.
+    """
+
+    def __init__(self, noop_error=None):
+        self.noop_error = noop_error
+        self.commands = []
+        self.closed = False
+
+    def voidcmd(self, command):
+        self.commands.append(command)
+        if self.noop_error is not None:
+            raise self.noop_error
+        return "200 NOOP command successful"
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDataConnection:
+    """
+    Stands in for the data connection socket, delivering data in chunks.
+    """
+
+    def __init__(self, data, chunk_size):
+        self.data = memoryview(data)
+        self.chunk_size = chunk_size
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def recv_into(self, view):
+        count = min(len(view), self.chunk_size, len(self.data) - self.offset)
+        view[:count] = self.data[self.offset : self.offset + count]
+        self.offset += count
+        return count
+
+    def recv(self, size):
+        count = min(size, self.chunk_size, len(self.data) - self.offset)
+        chunk = bytes(self.data[self.offset : self.offset + count])
+        self.offset += count
+        return chunk
+
+
+class FakeTransferFTP(FakeFTP):
+    def __init__(self, files, chunk_size=4096):
+        super().__init__()
+        self.files = files
+        self.chunk_size = chunk_size
+
+    def transfercmd(self, command):
+        self.commands.append(command)
+        remote_file = command.partition(" ")[2]
+        if remote_file not in self.files:
+            raise ftplib.error_perm("550 No such file or directory.")
+        return FakeDataConnection(self.files[remote_file], self.chunk_size)
+
+    def voidresp(self):
+        return "226 Transfer complete"
+
+
+class FakeFTPController(FTPController):
+    def __init__(self, noop_error=None):
+        super().__init__("localhost", "user", "password")
+        self.noop_error = noop_error
+        self.connections = []
+
+    def connect(self):
+        self.ftp = FakeFTP(self.noop_error)
+        self.connections.append(self.ftp)
+
+
+class IsConnectedTest(unittest.TestCase):
+    def test_alive_connection(self):
+        client = FTPController("localhost", "user", "password")
+        client.ftp = FakeFTP()
+        self.assertTrue(client.is_connected())
+        self.assertEqual(client.ftp.commands, ["NOOP"])
+
+    def test_broken_connection(self):
+        client = FTPController("localhost", "user", "password")
+        for error in (
+            EOFError(),
+            ConnectionResetError(),
+            ftplib.error_temp("421 Service not available"),
+            ftplib.error_reply("500 Unexpected reply"),
+        ):
+            with self.subTest(error=type(error).__name__):
+                client.ftp = FakeFTP(error)
+                with self.assertLogs(level="WARNING"):
+                    self.assertFalse(client.is_connected())
+
+    def test_not_connected(self):
+        self.assertFalse(FTPController("localhost", "user", "password").is_connected())
+
+
+class GetIntoTest(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 100
+        self.client = FTPController("localhost", "user", "password")
+        self.client.ftp = FakeTransferFTP({"cap_bmp.bmp": self.data}, chunk_size=1000)
+
+    def test_file_filling_the_buffer(self):
+        buffer = bytearray(len(self.data))
+        self.assertEqual(self.client.get_into("cap_bmp.bmp", buffer), len(self.data))
+        self.assertEqual(bytes(buffer), self.data)
+        self.assertEqual(self.client.ftp.commands, ["TYPE I", "RETR cap_bmp.bmp"])
+
+    def test_file_larger_than_the_buffer(self):
+        buffer = bytearray(1500)
+        self.assertEqual(self.client.get_into("cap_bmp.bmp", buffer), len(self.data))
+        self.assertEqual(bytes(buffer), self.data)
+
+    def test_file_smaller_than_the_buffer(self):
+        buffer = bytearray(len(self.data) + 100)
+        self.assertEqual(self.client.get_into("cap_bmp.bmp", buffer), len(self.data))
+        self.assertEqual(bytes(buffer[: len(self.data)]), self.data)
+        self.assertEqual(self.client.get_bytes("cap_bmp.bmp", 10), self.data)
+
+    def test_missing_file(self):
+        with self.assertLogs(level="ERROR"), self.assertRaises(Exception) as raised:
+            self.client.get_into("missing.bmp", bytearray(10))
+        self.assertIsInstance(raised.exception.__cause__, ftplib.error_perm)
+
+    def test_not_connected(self):
+        with self.assertRaises(ConnectionError):
+            FTPController("localhost", "user", "password").get_into("cap_bmp.bmp", bytearray(10))
+
+
+class FTPSessionHealthCheckTest(unittest.TestCase):
+    def test_idle_alive_connection_is_reused(self):
+        client = FakeFTPController()
+        session = FTPSession(client, health_check_idle_time=0)
+        session.acquire()
+        session.last_used -= 1  # idle for longer than health_check_idle_time
+        session.acquire()
+        stats = session.get_stats()
+        self.assertEqual(stats["health_checks"], 1)
+        self.assertEqual(stats["reconnects"], 0)
+        self.assertEqual(len(client.connections), 1)
+
+    def test_recently_used_connection_is_not_checked(self):
+        client = FakeFTPController()
+        session = FTPSession(client, health_check_idle_time=60)
+        session.acquire()
+        session.acquire()
+        self.assertEqual(client.ftp.commands, [])
+        self.assertEqual(session.get_stats()["reuses"], 1)
+
+    def test_idle_broken_connection_is_reestablished(self):
+        client = FakeFTPController(noop_error=EOFError())
+        session = FTPSession(client, health_check_idle_time=0)
+        session.acquire()
+        session.last_used -= 1
+        with self.assertLogs(level="WARNING"):
+            session.acquire()
+        self.assertEqual(session.get_stats()["reconnects"], 1)
+        self.assertEqual(len(client.connections), 2)
+        self.assertTrue(client.connections[0].closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
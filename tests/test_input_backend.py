@@ -0,0 +1,87 @@
+import sys
+import unittest
+
+from controllers.input_backend import (
+    Click,
+    FakeInputBackend,
+    KeyRun,
+    WinInputBackend,
+    create_input_backend,
+)
+from controllers.win_input_simulator import WinInputSimulator
+
+
+class StubSimulator:
+    """
+    Answers the WinInputSimulator calls, recording the window titles.
+    """
+
+    SUCCESS = WinInputSimulator.SUCCESS
+    WINDOW_NOT_FOUND = WinInputSimulator.WINDOW_NOT_FOUND
+
+    def __init__(self, windows=(1234,)):
+        self.windows = list(windows)
+        self.calls = []
+
+    def activate(self, title, flags):
+        self.calls.append(("activate", title.value))
+        return self.SUCCESS if self.windows else self.WINDOW_NOT_FOUND
+
+    def get_windows(self, title):
+        self.calls.append(("get_windows", title))
+        return self.windows
+
+    def move_cursor(self, title, x, y, flags):
+        self.calls.append(("move_cursor", title.value))
+        return self.SUCCESS
+
+    def left_click(self, title, flags):
+        self.calls.append(("left_click", title.value))
+        return self.SUCCESS
+
+    def press_key(self, title, code, flags):
+        self.calls.append(("press_key", title.value))
+        return self.SUCCESS
+
+
+class CreateInputBackendTest(unittest.TestCase):
+    def test_fake_backend_on_request(self):
+        self.assertIsInstance(create_input_backend("fake"), FakeInputBackend)
+
+    def test_invalid_backend_raises(self):
+        with self.assertRaises(ValueError):
+            create_input_backend("keyboard")
+
+    @unittest.skipIf(sys.platform == "win32", "WinInputSimulator.dll loads on Windows")
+    def test_dll_backend_does_not_fall_back(self):
+        with self.assertRaises(Exception):
+            create_input_backend("dll")
+
+
+class WinInputBackendTest(unittest.TestCase):
+    def test_script_addresses_the_window_by_title(self):
+        simulator = StubSimulator()
+        backend = WinInputBackend(simulator)
+        self.assertTrue(backend.run("console", [Click(1, 2), KeyRun("down", 2)]))
+        self.assertEqual(
+            simulator.calls,
+            [
+                ("activate", "console"),
+                ("get_windows", "console"),
+                ("move_cursor", "console"),
+                ("left_click", "console"),
+                ("press_key", "console"),
+                ("press_key", "console"),
+            ],
+        )
+
+    def test_missing_window_fails_the_script(self):
+        backend = WinInputBackend(StubSimulator(windows=()))
+        with self.assertLogs(level="ERROR"):
+            self.assertFalse(backend.run("console", [KeyRun("enter")]))
+        self.assertEqual(backend.get_stats()["failures"], 1)
+        self.assertEqual(backend.get_stats()["key_presses"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from tasks.light_search_tasks import (
+    LevelMeasurement,
+    LightActuator,
+    LightLevelSearch,
+    MeasurementBackend,
+    ModelBasedStrategy,
+    SequentialSampler,
+    SettleDetector,
+)
+from simulator.light_source import LightSourceConfig, SimulatedLightSource
+
+TARGET = 400.0
+TOLERANCE = 0.02  # target range 392 - 408 mV
+FLAT_SD_THRESHOLD = 1.2
+
+
+def analyses(*mvs, sd=5.0):
+    return [LevelMeasurement(mv, sd) for mv in mvs]
+
+
+class SequentialSamplerTest(unittest.TestCase):
+    def setUp(self):
+        # one capture is +-3 mV wide with the default prior
+        self.sampler = SequentialSampler(max_samples=3, confidence_z=1.5, noise_prior_mv=2.0)
+        self.lower_bound = (1 - TOLERANCE) * TARGET
+        self.upper_bound = (1 + TOLERANCE) * TARGET
+
+    def is_decided(self, captured):
+        return self.sampler.is_decided(
+            captured, self.lower_bound, self.upper_bound, FLAT_SD_THRESHOLD
+        )
+
+    def test_one_capture_decides_far_from_the_target(self):
+        self.assertTrue(self.is_decided(analyses(500.0)))
+        self.assertTrue(self.is_decided(analyses(300.0)))
+        self.assertTrue(self.is_decided(analyses(400.0)))
+
+    def test_capture_near_a_bound_is_undecided(self):
+        self.assertFalse(self.is_decided(analyses(406.0)))
+        self.assertFalse(self.is_decided(analyses(394.0)))
+
+    def test_more_captures_narrow_the_interval(self):
+        self.assertFalse(self.is_decided(analyses(406.0)))
+        self.assertTrue(self.is_decided(analyses(406.0, 405.0, 405.5)))
+
+    def test_flat_waveform_is_decided(self):
+        self.assertTrue(self.is_decided(analyses(406.0, sd=0.5)))
+
+    def test_recorded_deviation_widens_the_interval(self):
+        self.assertTrue(self.is_decided(analyses(396.0)))
+        self.sampler.record(analyses(380.0, 420.0), FLAT_SD_THRESHOLD)
+        self.assertGreater(self.sampler.noise_mv(), 2.0)
+        self.assertFalse(self.is_decided(analyses(396.0)))
+        self.sampler.reset()
+        self.assertEqual(self.sampler.noise_mv(), 2.0)
+
+    def test_flat_captures_are_not_recorded(self):
+        self.sampler.record(analyses(380.0, 420.0, sd=0.5), FLAT_SD_THRESHOLD)
+        self.assertEqual(self.sampler.noise_mv(), 2.0)
+
+
+class LinearBench(MeasurementBackend, LightActuator):
+    """
+    A noiseless light source of gain mV per light level, recording the
+    captures of every probe.
+    """
+
+    def __init__(self, gain=2.0):
+        self.gain = gain
+        self.light_level = 0
+        self.probe_captures = []  # (light level, captures)
+
+    async def set_light_level(self, light_level):
+        self.light_level = light_level
+
+    async def measure(self, mode, num_sample, stop=None):
+        captured = []
+        while len(captured) < num_sample:
+            captured.append(LevelMeasurement(self.gain * self.light_level, 5.0))
+            if stop is not None and stop(captured):
+                break
+        self.probe_captures.append((self.light_level, len(captured)))
+        return LevelMeasurement(captured[0].mv, 5.0, samples=len(captured))
+
+
+class LightLevelSearchSamplingTest(unittest.IsolatedAsyncioTestCase):
+    def make_search(self, bench, strategy=None):
+        return LightLevelSearch(
+            bench,
+            bench,
+            NumpyWaveformImageAnalysisController(),
+            TOLERANCE,
+            FLAT_SD_THRESHOLD,
+            strategy=strategy,
+            settle_time=0,
+        )
+
+    async def test_probe_stops_once_decided(self):
+        bench = LinearBench()
+        light_search = self.make_search(bench)
+        light_search.target = TARGET
+        measurement, class_ = await light_search.probe(100)
+        self.assertEqual((measurement.samples, class_), (1, 1))
+        self.assertEqual(light_search.frames_saved, 2)
+        measurement, _ = await light_search.probe(100, 3)
+        self.assertEqual(measurement.samples, 3)
+
+    async def test_model_probes_average_only_in_a_narrow_bracket(self):
+        # the first probe, light level 127, measures 406 mV, close to the upper bound
+        bench = LinearBench(gain=406.0 / 127)
+        light_search = self.make_search(bench)
+        light_search.target = TARGET
+        measurement, _ = await light_search.probe(127)
+        self.assertGreater(measurement.samples, 1)
+
+        bench.probe_captures.clear()
+        result = await self.make_search(bench, ModelBasedStrategy()).run(TARGET)
+        self.assertTrue(result.converged)
+        self.assertEqual(bench.probe_captures, [(127, 1)])
+
+
+class LightSourceMeasurement(MeasurementBackend):
+    """
+    Measures 10 mV per light level of the simulated light output.
+    """
+
+    def __init__(self, light_source):
+        self.light_source = light_source
+
+    async def measure(self, mode, num_sample, stop=None):
+        return LevelMeasurement(10 * self.light_source.output_level(), 5.0)
+
+
+class SettleDetectorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.light_source = SimulatedLightSource(
+            LightSourceConfig(
+                dead_time=0.05, settle_time=0.005, flicker=0, level_error=0, hysteresis=0
+            )
+        )
+        self.light_source.set_light_level(100)
+        self.measurement = LightSourceMeasurement(self.light_source)
+
+    def make_detector(self, min_wait):
+        return SettleDetector(self.measurement, max_wait=0.5, min_wait=min_wait, interval=0.01)
+
+    async def test_waits_out_the_dead_time(self):
+        await self.make_detector(0.08).wait()
+        self.light_source.set_light_level(150)
+        seconds = await self.make_detector(0.08).wait()
+        self.assertGreaterEqual(seconds, 0.08)
+        mv = (await self.measurement.measure(None, 1)).mv
+        self.assertAlmostEqual(mv, 10 * self.light_source.steady_output(), delta=5.0)
+
+    async def test_dead_time_looks_settled_without_min_wait(self):
+        await self.make_detector(0.08).wait()
+        before = (await self.measurement.measure(None, 1)).mv
+        self.light_source.set_light_level(150)
+        seconds = await self.make_detector(0).wait()
+        self.assertLess(seconds, 0.05)
+        self.assertAlmostEqual((await self.measurement.measure(None, 1)).mv, before, delta=1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+
+from controllers.command_scheduler import CommandAbortedError
+from controllers.telnet_controller import InstrumentShadow, TelnetController
+from simulator.lv5600_simulator import LV5600Simulator, SimulatorConfig
+from tasks.connection_tasks import ConnectionTask
+
+
+class InstrumentShadowTest(unittest.TestCase):
+    def setUp(self):
+        self.shadow = InstrumentShadow()
+
+    def test_repeated_write_is_redundant(self):
+        self.assertFalse(self.shadow.is_redundant("WFM:LINE_NUMBER 100"))
+        self.shadow.apply("WFM:LINE_NUMBER 100")
+        self.assertTrue(self.shadow.is_redundant("wfm:line_number 100"))
+        self.assertFalse(self.shadow.is_redundant("WFM:LINE_NUMBER 101"))
+
+    def test_queries_and_unknown_commands_are_not_shadowed(self):
+        self.shadow.apply("WFM:LINE_NUMBER 100")
+        self.shadow.apply("CAP:REFRESH")
+        self.assertFalse(self.shadow.is_redundant("WFM:LINE_NUMBER ?"))
+        self.assertFalse(self.shadow.is_redundant("CAP:REFRESH"))
+
+    def test_invalidating_commands_clear_the_shadow(self):
+        for command in ("SYS:INITIALIZE:ALL", "RCLL 1", "INPUT_CHANGE 2"):
+            with self.subTest(command=command):
+                self.shadow.apply("WFM:LINE_NUMBER 100")
+                self.shadow.apply(command)
+                self.assertFalse(self.shadow.is_redundant("WFM:LINE_NUMBER 100"))
+
+    def test_failed_write_is_forgotten(self):
+        self.shadow.apply("WFM:LINE_NUMBER 100")
+        self.shadow.forget("WFM:LINE_NUMBER 101")
+        self.assertFalse(self.shadow.is_redundant("WFM:LINE_NUMBER 100"))
+
+
+class SimulatorTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.simulator = LV5600Simulator(SimulatorConfig(telnet_port=0, ftp_port=0, seed=0))
+        await self.simulator.start()
+        config = self.simulator.config
+        self.client = TelnetController(
+            config.host, config.telnet_port, config.username, config.password
+        )
+        await ConnectionTask.connect_to_telnet(self.client)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.simulator.stop()
+
+    def sent(self):
+        return self.simulator.get_stats()["commands"]
+
+
+class TelnetShadowTest(SimulatorTestCase):
+    async def test_redundant_write_is_not_sent(self):
+        await self.client.send_command("WFM:LINE_NUMBER 100")
+        sent = self.sent()
+        response = await self.client.send_command("WFM:LINE_NUMBER 100")
+        self.assertEqual(response, self.client.end_string)
+        self.assertEqual(self.sent(), sent)
+        self.assertEqual(self.client.get_shadow_stats()["suppressed"], 1)
+
+    async def test_redundant_writes_in_a_batch_are_not_sent(self):
+        sent = self.sent()
+        responses = await self.client.send_batch(
+            ["WFM:LINE_NUMBER 100", "WFM:LINE_NUMBER 100", "WFM:LINE_NUMBER 101"]
+        )
+        self.assertEqual(len(responses), 3)
+        self.assertEqual(self.sent() - sent, 2)
+
+    async def test_writes_after_an_invalidating_command_are_sent(self):
+        for command in ("SYS:INITIALIZE:ALL", "RCLL 1", "INPUT_CHANGE 2"):
+            with self.subTest(command=command):
+                await self.client.send_command("WFM:LINE_NUMBER 100")
+                await self.client.send_command(command)
+                sent = self.sent()
+                await self.client.send_command("WFM:LINE_NUMBER 100")
+                self.assertEqual(self.sent() - sent, 1)
+
+    async def test_reconnect_invalidates(self):
+        await self.client.send_command("WFM:LINE_NUMBER 100")
+        await self.client.close()
+        await ConnectionTask.connect_to_telnet(self.client)
+        sent = self.sent()
+        await self.client.send_command("WFM:LINE_NUMBER 100")
+        self.assertEqual(self.sent() - sent, 1)
+
+
+class TelnetAbortTest(SimulatorTestCase):
+    async def test_abort_drops_the_waiting_commands_and_sends_its_own(self):
+        running = asyncio.create_task(self.client.send_command("WFM:LINE_NUMBER 100"))
+        while self.client.scheduler.running is None:
+            await asyncio.sleep(0)
+        waiting = asyncio.create_task(self.client.send_command("WFM:LINE_NUMBER 101"))
+        await asyncio.sleep(0)
+        responses = await self.client.abort(["WFM:SCALE:INTEN 0"])
+        self.assertEqual(len(responses), 1)
+        await running
+        with self.assertRaises(CommandAbortedError):
+            await waiting
+        self.assertEqual(self.client.get_scheduler_stats()["aborted"], 1)
+
+    async def test_abort_without_commands_sends_nothing(self):
+        sent = self.sent()
+        self.assertEqual(await self.client.abort(), [])
+        self.assertEqual(self.sent(), sent)
+
+
+if __name__ == "__main__":
+    unittest.main()
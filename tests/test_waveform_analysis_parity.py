@@ -0,0 +1,166 @@
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from Constants import CalculationConstants
+from controllers.numpy_waveform_image_analysis_controller import (
+    NumpyWaveformImageAnalysisController,
+)
+from controllers.waveform_image_analysis_controller import (
+    WaveformImageAnalysisController,
+    summarize_analyses,
+)
+from simulator.lv5600_simulator import SimulatorConfig, WaveformModel
+from utils.bmp_utils import decode_bmp
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# a directory of archived captures (snapshot.bmp files kept from the bench),
+# rendered captures are used if it is not set
+CAPTURES_ENV = "LV5600_CAPTURES"
+FLAT_PIXEL_COUNT = 100
+
+
+def render_captures(directory, count=8, seed=0):
+    model = WaveformModel(SimulatorConfig(seed=seed))
+    captures = []
+    for index, light_level in enumerate(np.linspace(40, 220, count).astype(int)):
+        file_path = os.path.join(directory, f"capture_{index}.bmp")
+        with open(file_path, "wb") as file:
+            file.write(model.render_bmp(model.sample(light_level)))
+        captures.append(file_path)
+    return captures
+
+
+class WaveformAnalysisParityTest(unittest.TestCase):
+    """
+    The NumPy engine must give the results of WaveformImageAnalysisLib.dll.
+    Runs where the DLL loads (Windows), on the captures in LV5600_CAPTURES.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cwd = os.getcwd()
+        os.chdir(REPO_ROOT)  # the DLL is loaded from lib\ relative to the working directory
+        try:
+            cls.dll = WaveformImageAnalysisController()
+        except Exception as e:
+            raise unittest.SkipTest(f"Waveform image analysis DLL not available: {e}")
+        finally:
+            os.chdir(cwd)
+        cls.numpy = NumpyWaveformImageAnalysisController()
+        cls.directory = tempfile.TemporaryDirectory()
+        captures_dir = os.environ.get(CAPTURES_ENV)
+        if captures_dir:
+            cls.captures = sorted(glob.glob(os.path.join(captures_dir, "*.bmp")))
+        else:
+            cls.captures = render_captures(cls.directory.name)
+        if not cls.captures:
+            raise unittest.SkipTest(f"No captures in {captures_dir}")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_analyze_frame(self):
+        for capture in self.captures:
+            for mode in (CalculationConstants.SAT_MODE, CalculationConstants.NOISE_MODE):
+                with self.subTest(capture=os.path.basename(capture), mode=mode):
+                    expected = self.dll.analyze_frame(capture, mode, FLAT_PIXEL_COUNT)
+                    actual = self.numpy.analyze_frame(capture, mode, FLAT_PIXEL_COUNT)
+                    # the DLL computes in float, one rounding step apart at most
+                    self.assertAlmostEqual(actual.mv, expected.mv, delta=0.1)
+                    self.assertAlmostEqual(actual.sd, expected.sd, delta=1e-3 + 1e-4 * expected.sd)
+
+    def test_cursor_level(self):
+        roi = (
+            CalculationConstants.ROI_COORDINATES_X1,
+            CalculationConstants.ROI_COORDINATES_X2,
+            CalculationConstants.ROI_COORDINATES_Y1,
+            CalculationConstants.ROI_COORDINATES_Y2,
+        )
+        for capture in self.captures:
+            for mode in (CalculationConstants.SAT_MODE, CalculationConstants.NOISE_MODE):
+                with self.subTest(capture=os.path.basename(capture), mode=mode):
+                    self.assertAlmostEqual(
+                        self.numpy.get_current_cursor_level(capture, mode, *roi),
+                        self.dll.get_current_cursor_level(capture, mode, *roi),
+                        delta=1,
+                    )
+
+
+class NumpyAnalysisParameterTest(unittest.TestCase):
+    def test_flat_pixel_count_below_two_is_invalid(self):
+        engine = NumpyWaveformImageAnalysisController()
+        with tempfile.TemporaryDirectory() as directory:
+            capture = render_captures(directory, count=1)[0]
+            for flat_pixel_count in (0, 1, 1.9):
+                with self.assertRaisesRegex(Exception, engine.INVALID_PARAMETER_ERROR):
+                    engine.analyze_frame(capture, CalculationConstants.NOISE_MODE, flat_pixel_count)
+            engine.analyze_frame(capture, CalculationConstants.NOISE_MODE, 2)
+
+
+class StackAnalysisTest(unittest.TestCase):
+    """
+    analyze_stack must give the results of analyze_frame on every frame.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = NumpyWaveformImageAnalysisController()
+        model = WaveformModel(SimulatorConfig(seed=0))
+        cls.frames = np.stack(
+            [
+                decode_bmp(model.render_bmp(model.sample(light_level)))
+                for light_level in np.linspace(40, 220, 6).astype(int)
+            ]
+        )
+
+    def assert_summary_equal(self, actual, expected):
+        self.assertEqual(len(actual.frames), len(expected.frames))
+        for actual_frame, expected_frame in zip(actual.frames, expected.frames):
+            self.assertEqual(actual_frame.mv, expected_frame.mv)
+            self.assertAlmostEqual(actual_frame.cursor, expected_frame.cursor)
+            self.assertAlmostEqual(actual_frame.sd, expected_frame.sd)
+            self.assertEqual(actual_frame.mode, expected_frame.mode)
+        self.assertEqual(actual.mv, expected.mv)
+        self.assertEqual(actual.mv_median, expected.mv_median)
+        self.assertEqual(actual.mv_max, expected.mv_max)
+        self.assertAlmostEqual(actual.sd, expected.sd)
+        self.assertAlmostEqual(actual.sd_mean, expected.sd_mean)
+        self.assertAlmostEqual(actual.sd_median, expected.sd_median)
+
+    def test_stack_matches_every_frame(self):
+        for mode in (CalculationConstants.SAT_MODE, CalculationConstants.NOISE_MODE):
+            with self.subTest(mode=mode):
+                expected = summarize_analyses(
+                    self.engine.analyze_frame(frame, mode, FLAT_PIXEL_COUNT)
+                    for frame in self.frames
+                )
+                self.assert_summary_equal(
+                    self.engine.analyze_stack(self.frames, mode, FLAT_PIXEL_COUNT), expected
+                )
+                # a list of frames is stacked the same way
+                self.assert_summary_equal(
+                    self.engine.analyze_stack(list(self.frames), mode, FLAT_PIXEL_COUNT),
+                    expected,
+                )
+
+    def test_single_frame_stack(self):
+        mode = CalculationConstants.NOISE_MODE
+        expected = self.engine.analyze_frame(self.frames[0], mode, FLAT_PIXEL_COUNT)
+        actual = self.engine.analyze_stack(self.frames[:1], mode, FLAT_PIXEL_COUNT)
+        self.assertEqual(actual.mv, expected.mv)
+        self.assertAlmostEqual(actual.sd, expected.sd)
+
+    def test_empty_stack_is_invalid(self):
+        with self.assertRaisesRegex(Exception, self.engine.INVALID_PARAMETER_ERROR):
+            self.engine.analyze_stack(
+                self.frames[:0], CalculationConstants.NOISE_MODE, FLAT_PIXEL_COUNT
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
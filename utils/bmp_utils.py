@@ -0,0 +1,122 @@
+"""
+Helpers for reading the BMP screen captures of the LV5600 without going through the file system, or for reading archived captures through a memory mapping instead of decoding the whole file.
+"""
+from dataclasses import dataclass
+import mmap
+import struct
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class BmpHeader:
+    pixel_offset: int
+    width: int
+    height: int  # positive for bottom-up row order
+    bits_per_pixel: int
+
+    @property
+    def rows(self):
+        return abs(self.height)
+
+    @property
+    def row_stride(self):
+        # every row is padded to a multiple of 4 bytes
+        return ((self.width * self.bits_per_pixel + 31) // 32) * 4
+
+
+# BI_RGB and BI_BITFIELDS
+COMPRESSION_NONE = 0
+COMPRESSION_BITFIELDS = 3
+# the red, green and blue masks of a 32 bit BI_BITFIELDS BMP stored as B, G, R, X
+BGRX_MASKS = (0x00FF0000, 0x0000FF00, 0x000000FF)
+
+
+def parse_bmp_header(data):
+    """
+    Returns the BmpHeader of an uncompressed 24 or 32 bit BMP. A 32 bit
+    BI_BITFIELDS BMP is accepted only if its channel masks store every pixel
+    as B, G, R and an unused byte, the layout decode_bmp reads.
+
+    Raises:
+    - ValueError: If data is not an uncompressed 24 or 32 bit BMP, or its
+        channel masks are not B, G, R.
+    """
+    header = bytes(data[:66])
+    if len(header) < 34 or header[:2] != b"BM":
+        raise ValueError("Invalid BMP data")
+    pixel_offset = struct.unpack_from("<I", header, 10)[0]
+    width, height = struct.unpack_from("<ii", header, 18)
+    bits_per_pixel = struct.unpack_from("<H", header, 28)[0]
+    compression = struct.unpack_from("<I", header, 30)[0]
+    if bits_per_pixel not in (24, 32) or compression not in (
+        COMPRESSION_NONE,
+        COMPRESSION_BITFIELDS,
+    ):
+        raise ValueError(
+            f"Unsupported BMP format: {bits_per_pixel} bit, compression {compression}"
+        )
+    if compression == COMPRESSION_BITFIELDS:
+        # the masks follow the 40 byte info header (and are part of the V4
+        # and V5 headers, at the same offset)
+        if bits_per_pixel != 32:
+            raise ValueError(
+                f"Unsupported BMP format: {bits_per_pixel} bit, compression {compression}"
+            )
+        if len(header) < 66:
+            raise ValueError("Invalid BMP data")
+        masks = struct.unpack_from("<III", header, 54)
+        if masks != BGRX_MASKS:
+            raise ValueError(
+                "Unsupported BMP channel masks: "
+                + ", ".join(f"{mask:#010x}" for mask in masks)
+            )
+    return BmpHeader(pixel_offset, width, height, bits_per_pixel)
+
+
+def decode_bmp(data, header=None):
+    """
+    Returns the pixels of an uncompressed 24 or 32 bit BMP as an H x W x 3 BGR array.
+    The array is a view on data (bytes, bytearray, memoryview or mmap), so no
+    pixel data is copied; bottom-up row order and row padding are handled with
+    strides.
+
+    Args:
+    - data: The content of the BMP file.
+    - header (BmpHeader): The parsed header of data, parsed here if None.
+
+    Raises:
+    - ValueError: If data is not an uncompressed 24 or 32 bit BMP.
+    """
+    if header is None:
+        header = parse_bmp_header(data)
+    pixels = np.frombuffer(
+        data, np.uint8, count=header.row_stride * header.rows, offset=header.pixel_offset
+    )
+    pixels = np.lib.stride_tricks.as_strided(
+        pixels,
+        shape=(header.rows, header.width, 3),
+        strides=(header.row_stride, header.bits_per_pixel // 8, 1),
+        writeable=False,
+    )
+    # a positive height means the rows are stored bottom-up
+    if header.height > 0:
+        pixels = pixels[::-1]
+    return pixels
+
+
+def map_bmp(file_path):
+    """
+    Returns the pixels of a BMP file as an H x W x 3 BGR array on a read-only
+    memory mapping of the file, see decode_bmp. Only the pages of the pixels
+    that are read, e.g. an ROI slice, are loaded. The mapping is closed when
+    the last array on it is gone; on Windows the file cannot be replaced
+    until then, so copy what is kept.
+
+    Raises:
+    - ValueError: If the file is not an uncompressed 24 or 32 bit BMP.
+    """
+    with open(file_path, "rb") as file:
+        # the mapping keeps its own handle on the file
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return decode_bmp(mapping)